@@ -0,0 +1,357 @@
+# Автоматическая векторизация листа: все линии записи за один проход, полосами тайлов в нескольких процессах
+
+import bisect
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from tile_manager import column_slice, gray_pixels
+
+try:
+    from numpy.lib.array_utils import byte_bounds
+except ImportError:  # NumPy < 2.0
+    byte_bounds = np.byte_bounds
+
+
+GRAY_BLOCK = 4096  # Ширина блока столбцов при переводе полосы в серый (кратна 8)
+
+
+class BandTracer:
+    """Линии записи в горизонтальной полосе растра.
+
+    В каждом столбце (с шагом COLUMN_STEP) находятся тёмные участки, центр
+    участка взвешивается по темноте (с долями пикселя). Участки соседних
+    столбцов, перекрывающиеся по высоте, связываются в треки; трек
+    переживает разрыв линии до MAX_GAP столбцов, продолжаясь по прежнему
+    наклону. Поэтому линии однозначны по x, как запись на сейсмограмме:
+    на пересечении двух записей трек может перескочить на соседнюю — это
+    правится вручную.
+    """
+    COLUMN_STEP = 2  # Шаг по столбцам в пикселях
+    CHUNK_COLUMNS = 1024  # Столбцы разбираются кусками, чтобы маски полосы не занимали много памяти
+    MIN_CONTRAST = 40  # Наименьшая разница яркости бумаги и линии
+    INK_FRACTION = 0.002  # Доля самых тёмных пикселей полосы, по которой оценивается яркость линий
+    MAX_RUN_LENGTH = 256  # Тёмный участок длиннее — заливка или поле скана, а не линия
+    MAX_JUMP = 3  # Допуск по высоте между участками соседних столбцов, пиксели
+    MAX_GAP = 8  # Сколько столбцов подряд трек может не находить продолжения
+
+    def __init__(self, gray):
+        self.gray = gray  # Яркость полосы (высота, ширина), 255 — белый
+
+    def threshold(self):
+        """Порог темноты по гистограмме полосы или None, если линий в ней нет"""
+        counts = np.cumsum(np.bincount(self.gray.ravel(), minlength=256))
+        paper = int(np.searchsorted(counts, counts[-1] * 0.5))
+        ink = int(np.searchsorted(counts, counts[-1] * self.INK_FRACTION))
+        if paper - ink < self.MIN_CONTRAST:
+            return None
+        return (paper + ink) / 2
+
+    def tracks(self):
+        """Треки полосы: массивы (N, 2) центров линии в пикселях полосы, x возрастает"""
+        threshold = self.threshold()
+        if threshold is None:
+            return []
+        finished = []
+        active = []  # [верх, низ, центр, пропущено столбцов, xs, ys, наклон]
+        max_gap = self.MAX_GAP // self.COLUMN_STEP
+        for x, tops, bottoms, centers in self._columns(threshold):
+            claims = {}  # Участок -> (расстояние, трек): участок достаётся ближайшему треку
+            for track_number, track in enumerate(active):
+                shift = track[6] * (x - track[4][-1])
+                tolerance = self.MAX_JUMP * (track[3] + 1)
+                first = bisect.bisect_right(bottoms, track[0] + shift - tolerance)
+                last = bisect.bisect_left(tops, track[1] + shift + tolerance)
+                if first >= last:
+                    continue
+                expected = track[2] + shift
+                run = min(range(first, last), key=lambda index: abs(centers[index] - expected))
+                distance = abs(centers[run] - expected)
+                if run not in claims or distance < claims[run][0]:
+                    claims[run] = (distance, track_number)
+
+            continued = {track_number: run for run, (_, track_number) in claims.items()}
+            still_active = []
+            for track_number, track in enumerate(active):
+                run = continued.get(track_number)
+                if run is not None:
+                    track[6] = (centers[run] - track[2]) / (x - track[4][-1])
+                    track[0], track[1], track[2], track[3] = tops[run], bottoms[run], centers[run], 0
+                    track[4].append(x)
+                    track[5].append(centers[run])
+                    still_active.append(track)
+                elif track[3] < max_gap:
+                    track[3] += 1
+                    still_active.append(track)
+                else:
+                    finished.append(track)
+            for run in range(len(tops)):
+                if run not in claims:
+                    still_active.append([tops[run], bottoms[run], centers[run], 0, [x], [centers[run]], 0.0])
+            active = still_active
+
+        return [np.column_stack((track[4], track[5])) for track in finished + active]
+
+    def _columns(self, threshold):
+        """Для каждого столбца: x центра столбца и отсортированные списки верхов, низов и центров участков"""
+        height, width = self.gray.shape
+        step = self.COLUMN_STEP
+        row_centers = np.arange(height, dtype=np.float64) + 0.5
+        for chunk_start in range(0, width, self.CHUNK_COLUMNS):
+            # Столбцы куска — строками: участки одного столбца лежат в памяти подряд
+            block = np.ascontiguousarray(self.gray[:, chunk_start:chunk_start + self.CHUNK_COLUMNS:step].T)
+            dark = block < threshold
+            padded = np.zeros((len(block), height + 2), dtype=np.int8)
+            padded[:, 1:-1] = dark
+            change = np.diff(padded, axis=1)
+            columns, tops = np.nonzero(change == 1)
+            _, bottoms = np.nonzero(change == -1)  # Низ участка — первая светлая строка
+
+            # Суммы по участкам — разности накопленных сумм по всему куску
+            weights = np.where(dark, threshold - block, 0.0)
+            mass = np.concatenate(([0.0], np.cumsum(weights)))
+            moment = np.concatenate(([0.0], np.cumsum(weights * row_centers)))
+            starts, ends = columns * height + tops, columns * height + bottoms
+            centers = (moment[ends] - moment[starts]) / (mass[ends] - mass[starts])
+
+            keep = bottoms - tops <= self.MAX_RUN_LENGTH
+            columns, tops, bottoms, centers = columns[keep], tops[keep], bottoms[keep], centers[keep]
+            bounds = np.searchsorted(columns, np.arange(len(block) + 1)).tolist()
+            tops, bottoms, centers = tops.tolist(), bottoms.tolist(), centers.tolist()
+            for column in range(len(block)):
+                first, last = bounds[column], bounds[column + 1]
+                yield (chunk_start + column * step + 0.5,
+                       tops[first:last], bottoms[first:last], centers[first:last])
+
+
+class TracePiece:
+    """Часть трека в основной (без перекрытия) части полосы, в пикселях растра"""
+
+    def __init__(self, points, continues_before, continues_after):
+        self.points = points
+        self.continues_before = continues_before  # До начала трек шёл за пределами полосы
+        self.continues_after = continues_after  # После конца трек уходил за пределы полосы
+
+
+def _open_source(spec):
+    """Массив уровня по описанию из _source_spec (в процессе пула)"""
+    filename, offset, length, shape, strides, start = spec
+    data = np.memmap(filename, dtype=np.uint8, mode='r', offset=offset, shape=(length,))
+    return np.ndarray(shape, dtype=np.uint8, buffer=data, offset=start, strides=strides)
+
+
+def _trace_band(task):
+    """Задача процесса пула: куски линий полосы.
+
+    Полоса читается с перекрытием (top, bottom), а куски обрезаются по
+    основной части (core_top, core_bottom): линия у границы прослеживается
+    обеими полосами одинаково, и концы кусков соседних полос сходятся.
+    """
+    source, source_top, pixel_format, width, top, bottom, core_top, core_bottom, min_length = task
+    if isinstance(source, tuple):
+        source = _open_source(source)
+    rows = source[top - source_top:bottom - source_top]
+    # Перевод в серый блоками столбцов: промежуточные массивы RGBA не разрастаются на всю полосу
+    gray = np.concatenate([gray_pixels(np.asarray(rows[:, column_slice(pixel_format, x, GRAY_BLOCK)]),
+                                       pixel_format, min(GRAY_BLOCK, width - x))
+                           for x in range(0, width, GRAY_BLOCK)], axis=1)
+
+    pieces = []
+    for track in BandTracer(gray).tracks():
+        track[:, 1] += top
+        inside = (track[:, 1] >= core_top) & (track[:, 1] < core_bottom)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], inside.view(np.int8), [0]))))
+        for start, end in zip(edges[0::2].tolist(), edges[1::2].tolist()):
+            piece = TracePiece(track[start:end], start > 0, end < len(track))
+            # Короткие куски нужны, только если их можно сшить с соседней полосой
+            if (piece.continues_before or piece.continues_after or
+                    piece.points[-1, 0] - piece.points[0, 0] >= min_length):
+                pieces.append(piece)
+    return pieces
+
+
+def _source_spec(source):
+    """Как открыть тот же массив уровня в другом процессе, не копируя пиксели, или None.
+
+    Подходят numpy.memmap и его срезы (в том числе с отрицательным шагом
+    строк): (файл, смещение, длина в байтах, форма, шаги, начало массива).
+    """
+    if not isinstance(source, np.memmap) or not source.filename or not os.path.exists(source.filename):
+        return None
+    root = source
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if not isinstance(root, np.memmap):
+        return None
+    low, high = byte_bounds(source)
+    root_start = root.__array_interface__['data'][0]
+    start = source.__array_interface__['data'][0] - low
+    return source.filename, root.offset + (low - root_start), high - low, source.shape, source.strides, start
+
+
+class AutoVectorizer:
+    """Все линии записи растра в пикселях исходника.
+
+    Растр режется на полосы по рядам тайлов, каждая читается с перекрытием
+    HALO строк и разбирается BandTracer в своём процессе: процессы читают
+    свою полосу прямо из файла (memmap исходника или кэша), так что
+    пиксели не копируются между процессами. Куски линий, обрезанные
+    границей полос, затем сшиваются по концам.
+    """
+    HALO = 32  # Перекрытие полос в строках
+    MIN_CURVE_LENGTH = 200  # Более короткие по x линии — шум, подписи и отметки
+    # Граница полос может прийтись на разрыв линии, поэтому концы кусков сшиваются через такой же разрыв
+    STITCH_GAP = BandTracer.MAX_GAP + BandTracer.COLUMN_STEP  # Наибольший разрыв по x между кусками
+    STITCH_JUMP = 2 * BandTracer.MAX_JUMP  # Наибольшее отклонение по y от продолжения конца куска
+
+    def __init__(self, tile_manager, workers=None):
+        self.tile_manager = tile_manager
+        self.workers = workers or os.cpu_count() or 1
+
+    def run(self, progress_callback=None, is_cancelled=None):
+        """Линии растра — массивы (N, 2) в пикселях исходника — или None, если прервано"""
+        tasks = self._tasks()
+        pieces = []
+        if self.workers <= 1 or len(tasks) <= 1:
+            for number, task in enumerate(tasks):
+                if is_cancelled and is_cancelled():
+                    return None
+                pieces.extend(_trace_band(task()))
+                if progress_callback:
+                    progress_callback(int((number + 1) * 100 / len(tasks)))
+        else:
+            # spawn: дочерний процесс не наследует потоки Qt и OpenGL-контекст
+            executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            try:
+                pending = set()
+                queued = iter(tasks)
+                done_count = 0
+                while True:
+                    # Задач в очереди немного: без memmap каждая несёт пиксели своей полосы
+                    for task in queued:
+                        pending.add(executor.submit(_trace_band, task()))
+                        if len(pending) >= 2 * self.workers:
+                            break
+                    if not pending:
+                        break
+                    done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    if is_cancelled and is_cancelled():
+                        return None
+                    for future in done:
+                        pieces.extend(future.result())
+                        done_count += 1
+                    if done and progress_callback:
+                        progress_callback(int(done_count * 100 / len(tasks)))
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+        return self._stitch(pieces)
+
+    def _tasks(self):
+        """Задачи полос; пиксели полосы без memmap собираются из тайлов только при отправке"""
+        tile_manager = self.tile_manager
+        height, size = tile_manager.image_height, tile_manager.tile_size
+        source = tile_manager.level_sources[0] if tile_manager.level_sources else None
+        in_process = self.workers <= 1
+        spec = None if in_process else _source_spec(source)
+
+        tasks = []
+        for core_top in range(0, height, size):
+            core_bottom = min(core_top + size, height)
+            band = (tile_manager.pixel_format, tile_manager.image_width, max(core_top - self.HALO, 0),
+                    min(core_bottom + self.HALO, height), core_top, core_bottom, self.MIN_CURVE_LENGTH)
+            if source is not None and in_process:
+                tasks.append(lambda band=band: (source, 0) + band)
+            elif spec is not None:
+                tasks.append(lambda band=band: (spec, 0) + band)
+            else:
+                tasks.append(lambda band=band: (self._tile_rows(band[2], band[3]), band[2]) + band)
+        return tasks
+
+    def _tile_rows(self, top, bottom):
+        """Строки [top, bottom) уровня 0 в его формате, собранные из тайлов"""
+        tile_manager = self.tile_manager
+        size = tile_manager.tile_size
+        rows = []
+        for row_top in range(top // size * size, bottom, size):
+            tiles = [tile_manager.tile_at(0, x, row_top) for x in range(0, tile_manager.image_width, size)]
+            # Границы тайлов кратны 8 пикселям, поэтому упакованные биты склеиваются по байтам
+            band = np.concatenate([np.asarray(tile_manager.tile_pixels(tile)) for tile in tiles], axis=1)
+            rows.append(band[max(top - row_top, 0):bottom - row_top])
+        return np.concatenate(rows)
+
+    def _stitch(self, pieces):
+        """Сшивает куски соседних полос в линии и отбрасывает короткие"""
+        starts = {}  # x начала -> куски, продолжающиеся из другой полосы
+        for number, piece in enumerate(pieces):
+            if piece.continues_before:
+                starts.setdefault(piece.points[0, 0], []).append(number)
+
+        links = []
+        for number, piece in enumerate(pieces):
+            if not piece.continues_after:
+                continue
+            end_x, end_y = piece.points[-1]
+            tail = piece.points[-2:]
+            slope = (tail[-1, 1] - tail[0, 1]) / (tail[-1, 0] - tail[0, 0]) if len(tail) > 1 else 0.0
+            # Нулевой разрыв: центр линии лёг на границу, и полосы отнесли один столбец каждая к себе
+            for gap in range(0, self.STITCH_GAP + 1, BandTracer.COLUMN_STEP):
+                for following in starts.get(end_x + gap, ()):
+                    jump = abs(pieces[following].points[0, 1] - (end_y + slope * gap))
+                    if jump <= self.STITCH_JUMP:
+                        links.append((gap + jump, number, following))
+
+        # Жадно, от ближайших пар; x растёт вдоль цепочки, поэтому циклов нет
+        following_of, previous_of = {}, {}
+        for _, number, following in sorted(links):
+            if number not in following_of and following not in previous_of:
+                following_of[number] = following
+                previous_of[following] = number
+
+        lines = []
+        for number in range(len(pieces)):
+            if number in previous_of:
+                continue
+            chain = [pieces[number].points]
+            while number in following_of:
+                number = following_of[number]
+                points = pieces[number].points
+                chain.append(points[1:] if points[0, 0] == chain[-1][-1, 0] else points)
+            points = np.concatenate(chain)
+            if points[-1, 0] - points[0, 0] >= self.MIN_CURVE_LENGTH:
+                lines.append(points)
+        return lines
+
+
+class AutoVectorizeWorker(QObject):
+    """Поиск всех линий растра в рабочем потоке (AutoVectorizer.run).
+
+    GUI-поток получает прогресс и завершение сигналами; отмена — через
+    cancel(), её проверяют между полосами и при ожидании процессов пула.
+    """
+    progress = pyqtSignal(int)  # Процент разобранных полос
+    finished = pyqtSignal()
+
+    def __init__(self, raster_object):
+        super().__init__()
+        self.raster_object = raster_object
+        self.lines = None  # Линии в пикселях исходника, если поиск завершён
+        self.error = None  # Текст ошибки, если поиск не удался
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def run(self):
+        try:
+            self.lines = AutoVectorizer(self.raster_object.tile_manager).run(self.progress.emit, self.is_cancelled)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.finished.emit()
@@ -0,0 +1,131 @@
+# Индекс вершин кривой: поиск ближайшей вершины под курсором на плотных трассах
+
+import math
+
+import numpy as np
+
+_CELL_OFFSET = 1 << 31  # Номера ячеек сдвигаются в неотрицательные, чтобы уложить пару в int64
+
+
+class VertexIndex:
+    """Сетка ячеек в локальных координатах растра поверх точек одной кривой.
+
+    Ключ ячейки — (столбец << 32) | строка; ключи вершин хранятся
+    отсортированными вместе с номерами вершин, поэтому ячейки одного столбца
+    лежат подряд и запрос по радиусу — это один searchsorted на столбец.
+    Вставка, удаление и сдвиг вершины правят массивы на месте (O(N) на
+    копирование памяти, без перестройки), а дописанные в конец точки
+    подхватываются при следующем запросе. О любой правке точек, кроме
+    дописывания, индексу сообщают методы moved/inserted/deleted.
+    """
+    CELL_SIZE = 16.0  # Сторона ячейки в единицах сцены (~0.7 мм при 600 DPI)
+    MAX_QUERY_COLUMNS = 64  # При большем радиусе (сильное отдаление) вершины перебираются все
+
+    def __init__(self, points):
+        self.points = points
+        self._reset()
+
+    def _reset(self):
+        self._keys = np.empty(0, dtype=np.int64)  # Отсортированные ключи ячеек
+        self._order = np.empty(0, dtype=np.int64)  # Номер вершины для каждого ключа
+        self._vertex_keys = np.empty(0, dtype=np.int64)  # Ключ ячейки каждой вершины
+        self._indexed = 0  # Вершины с этим номером и дальше ещё не в сетке
+        self._bounds = None
+
+    def nearest(self, x, y, radius):
+        """Ближайшая к (x, y) вершина не дальше radius: (номер, расстояние) или None"""
+        self._catch_up()
+        if not self._indexed:
+            return None
+        x0, y0, x1, y1 = self._get_bounds()
+        if x < x0 - radius or x > x1 + radius or y < y0 - radius or y > y1 + radius:
+            return None
+
+        columns = range(math.floor((x - radius) / self.CELL_SIZE), math.floor((x + radius) / self.CELL_SIZE) + 1)
+        if len(columns) > self.MAX_QUERY_COLUMNS:
+            candidates = np.arange(self._indexed)
+        else:
+            row0 = math.floor((y - radius) / self.CELL_SIZE) + _CELL_OFFSET
+            row1 = math.floor((y + radius) / self.CELL_SIZE) + _CELL_OFFSET
+            column_keys = (np.asarray(columns, dtype=np.int64) + _CELL_OFFSET) << 32
+            starts = np.searchsorted(self._keys, column_keys | row0, 'left')
+            ends = np.searchsorted(self._keys, column_keys | row1, 'right')
+            candidates = np.concatenate([self._order[start:end] for start, end in zip(starts, ends)])
+            if not len(candidates):
+                return None
+
+        offsets = self.points.array[candidates].astype(np.float64) - (x, y)
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        best = int(np.argmin(distances))
+        if distances[best] > radius:
+            return None
+        return int(candidates[best]), float(distances[best])
+
+    def moved(self, index):
+        """Вершина index получила новые координаты"""
+        if index >= self._indexed:
+            return
+        self._remove_entry(index)
+        key = self._cell_keys(self.points.array[index:index + 1])
+        self._vertex_keys[index] = key[0]
+        self._add_entries(key, np.array([index], dtype=np.int64))
+        self._bounds = None
+
+    def inserted(self, index):
+        """Перед вершиной index вставлена новая (уже есть в points)"""
+        if index >= self._indexed:
+            return  # Вставка в ещё не проиндексированный хвост
+        self._order[self._order >= index] += 1
+        key = self._cell_keys(self.points.array[index:index + 1])
+        self._vertex_keys = np.insert(self._vertex_keys, index, key[0])
+        self._add_entries(key, np.array([index], dtype=np.int64))
+        self._indexed += 1
+        self._bounds = None
+
+    def deleted(self, index):
+        """Вершина index удалена из points"""
+        if index >= self._indexed:
+            return
+        self._remove_entry(index)
+        self._order[self._order > index] -= 1
+        self._vertex_keys = np.delete(self._vertex_keys, index)
+        self._indexed -= 1
+        self._bounds = None
+
+    def _catch_up(self):
+        """Заносит в сетку дописанные с прошлого запроса точки"""
+        count = len(self.points)
+        if count < self._indexed:
+            self._reset()  # Точки укоротили в обход индекса: строим заново
+        if count == self._indexed:
+            return
+        keys = self._cell_keys(self.points.array[self._indexed:count])
+        self._vertex_keys = np.concatenate([self._vertex_keys, keys])
+        self._add_entries(keys, np.arange(self._indexed, count, dtype=np.int64))
+        self._indexed = count
+        self._bounds = None
+
+    def _get_bounds(self):
+        if self._bounds is None:
+            points = self.points.array[:self._indexed]
+            self._bounds = (*points.min(axis=0).tolist(), *points.max(axis=0).tolist())
+        return self._bounds
+
+    def _cell_keys(self, points):
+        cells = np.floor(points.astype(np.float64) / self.CELL_SIZE).astype(np.int64) + _CELL_OFFSET
+        return (cells[:, 0] << 32) | cells[:, 1]
+
+    def _add_entries(self, keys, vertices):
+        sort = np.argsort(keys, kind='stable')
+        keys, vertices = keys[sort], vertices[sort]
+        positions = np.searchsorted(self._keys, keys, 'right')
+        self._keys = np.insert(self._keys, positions, keys)
+        self._order = np.insert(self._order, positions, vertices)
+
+    def _remove_entry(self, index):
+        key = self._vertex_keys[index]
+        start = np.searchsorted(self._keys, key, 'left')
+        end = np.searchsorted(self._keys, key, 'right')
+        position = start + int(np.flatnonzero(self._order[start:end] == index)[0])
+        self._keys = np.delete(self._keys, position)
+        self._order = np.delete(self._order, position)
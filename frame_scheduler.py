@@ -0,0 +1,137 @@
+# Планировщик кадров: ввод мыши копится между кадрами и применяется один раз перед отрисовкой
+
+import math
+import time
+
+from PyQt5.QtCore import QObject, QPointF
+
+
+class FrameScheduler(QObject):
+    """Собирает сдвиги, масштаб и перетаскивание растров и вершин кривых от событий ввода.
+
+    Обработчики событий только складывают приращения и просят кадр; камера и
+    растры меняются в apply() в начале paintGL, то есть не чаще одного раза за
+    кадр. Следующий кадр анимации запрашивается после смены буферов
+    (frameSwapped), поэтому при вертикальной синхронизации кадры идут ровно.
+    Камера задаётся целевым видом (масштаб, сдвиг); при плавном масштабировании
+    текущий масштаб догоняет целевой, а точка под курсором остаётся на месте.
+    """
+    ZOOM_TIME_CONSTANT = 0.05  # Секунды, за которые остаётся ~37% пути до целевого масштаба
+    MAX_FRAME_TIME = 0.1  # Дольше кадр не считается (после паузы анимация не прыгает)
+    FIRST_FRAME_TIME = 1 / 60  # Шаг первого кадра анимации, чтобы отклик был сразу
+
+    def __init__(self, widget, smooth_zoom=True):
+        super().__init__(widget)
+        self.widget = widget
+        self.smooth_zoom = smooth_zoom
+
+        self.target_zoom = widget.zoom
+        self.target_pan = QPointF(widget.pan)
+        self._anchor = QPointF(0, 0)  # Точка экрана, неподвижная при масштабировании
+        self._object_moves = {}  # id(растр) -> (растр, сдвиг в пикселях экрана)
+        self._vertex_move = None  # (кривая, номер вершины, x, y) — последнее положение перетаскиваемой вершины
+        self._frame_requested = False
+        self._next_frame = False  # Нужен ещё кадр после текущего
+        self._last_frame_time = None
+
+        widget.frameSwapped.connect(self._on_frame_swapped)
+
+    def pan_by(self, delta):
+        """Сдвиг сцены на delta пикселей экрана"""
+        self.target_pan += QPointF(delta)
+        self._anchor += QPointF(delta)  # Точка сцены под якорем едет вместе со сценой
+        self.request_frame()
+
+    def zoom_at(self, anchor, factor):
+        """Масштаб в factor раз вокруг точки экрана anchor"""
+        anchor = QPointF(anchor)
+        self.target_pan = anchor - (anchor - self.target_pan) * factor
+        self.target_zoom *= factor
+        self._anchor = anchor
+        self.request_frame()
+
+    def move_object(self, raster_object, delta):
+        """Сдвиг растра на delta пикселей экрана"""
+        _, pending = self._object_moves.get(id(raster_object), (raster_object, QPointF(0, 0)))
+        self._object_moves[id(raster_object)] = (raster_object, pending + QPointF(delta))
+        self.request_frame()
+
+    def move_vertex(self, curve, index, x, y):
+        """Новое положение вершины кривой (локальные координаты растра); в кадре — только последнее"""
+        self._vertex_move = (curve, index, x, y)
+        self.request_frame()
+
+    def set_view(self, zoom, pan):
+        """Сразу ставит камеру (без анимации), например при центрировании на растре"""
+        self.target_zoom = zoom
+        self.target_pan = QPointF(pan)
+        self.widget.zoom = zoom
+        self.widget.pan = QPointF(pan)
+        self.request_frame()
+
+    def is_animating(self):
+        return self.widget.zoom != self.target_zoom
+
+    def request_frame(self):
+        """Просит кадр; повторные просьбы до его начала ничего не стоят"""
+        if self._frame_requested:
+            return
+        self._frame_requested = True
+        self.widget.update()
+
+    def request_next_frame(self):
+        """Просит кадр после смены буферов текущего (вызывается из paintGL)"""
+        self._next_frame = True
+
+    def flush(self):
+        """Применяет накопленный ввод без шага анимации (перед пересчётом координат мыши)"""
+        self._apply(0.0)
+
+    def apply(self):
+        """Начало кадра: применяет ввод и продвигает плавное масштабирование"""
+        now = time.perf_counter()
+        if self._last_frame_time is None:
+            dt = self.FIRST_FRAME_TIME
+        else:
+            dt = min(now - self._last_frame_time, self.MAX_FRAME_TIME)
+        self._last_frame_time = now
+        self._frame_requested = False
+        self._apply(dt)
+        if self.is_animating():
+            self.request_next_frame()
+        else:
+            self._last_frame_time = None
+
+    def _apply(self, dt):
+        widget = self.widget
+        if not self.smooth_zoom:
+            widget.zoom = self.target_zoom
+        elif widget.zoom != self.target_zoom:
+            # Экспоненциальное приближение в логарифмах: шаги при отдалении и приближении одинаковы
+            remaining = math.log(self.target_zoom / widget.zoom) * math.exp(-dt / self.ZOOM_TIME_CONSTANT)
+            if abs(remaining) < 1e-3:
+                widget.zoom = self.target_zoom
+            else:
+                widget.zoom = self.target_zoom / math.exp(remaining)
+
+        if widget.zoom == self.target_zoom:
+            widget.pan = QPointF(self.target_pan)
+        else:
+            # Точка сцены, которая в целевом виде окажется под якорем, остаётся под ним и сейчас
+            anchor_scene = (self._anchor - self.target_pan) / self.target_zoom
+            widget.pan = self._anchor - anchor_scene * widget.zoom
+
+        for raster_object, delta in self._object_moves.values():
+            raster_object.position += delta / widget.zoom
+        self._object_moves.clear()
+
+        # Правка вершины меняет revision, и кривая целиком уходит в видеопамять — раз за кадр
+        if self._vertex_move:
+            curve, index, x, y = self._vertex_move
+            self._vertex_move = None
+            curve.move_vertex(index, x, y)
+
+    def _on_frame_swapped(self):
+        if self._next_frame:
+            self._next_frame = False
+            self.request_frame()
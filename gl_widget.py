@@ -1,16 +1,35 @@
 # Виджет OpenGL (масштабирование, перемещение)
 
+import math
 import os
-from PyQt5.QtWidgets import QOpenGLWidget
-from PyQt5.QtCore import Qt, QPoint, QPointF, QSizeF, pyqtSignal
+import time
+from PyQt5.QtWidgets import QLabel, QOpenGLWidget
+from PyQt5.QtCore import Qt, QPoint, QPointF, QSizeF, QThread, QTimer, pyqtSignal
 from OpenGL.GL import *
-from OpenGL.GLU import *
-from image_loader import ImageLoader
+from auto_vectorizer import AutoVectorizeWorker
+from curve_index import VertexIndex
+from curve_points import CurvePoints
+from frame_scheduler import FrameScheduler
+from load_worker import TileLoadWorker
+from perf_stats import PerfStats
+from raster_index import RasterIndex
+from renderer import SceneRenderer, ortho, rotation, scaling, translation
+from tile_cache import TileCache
+from texture_manager import TextureManager
+from texture_upload import SharedContextUploader, fence_passed
 from tile_manager import TileManager
+from trace_follower import STOP_CROSSING, STOP_EDGE, STOP_GAP, STOP_LIMIT, STOP_UNLOADED, TraceFollower
 import numpy as np
 
+SCENE_DPI = 600  # Разрешение, в котором заданы координаты сцены (и кривых)
+
 class RasterObject:
     def __init__(self, tile_manager, position=QPointF(0, 0), size=QSizeF(100, 100), file_path=""):
+        # Вызывается при смене положения, размера, поворота или DPI (так индекс растров узнаёт о сдвиге)
+        self.geometry_listener = None
+        self._transforms = None  # Матрицы локальные -> сцена, сцена -> локальные, пиксели -> сцена
+        self._inverse_affine = None  # Коэффициенты обратной матрицы для одиночных точек
+        self._scene_bounds = None
         self.tile_manager = tile_manager
         self.position = position
         self.size = size
@@ -19,32 +38,140 @@ class RasterObject:
         self.is_active = False
         self.rotation_angle = 0
         self.rotation_center = QPointF(size.width() / 2, size.height() / 2)
-        self.dpi = (600, 600)
+        self.dpi = (SCENE_DPI, SCENE_DPI)  # Разрешение исходного растра
         self.file_path = file_path  # Сохраняем путь к файлу
         self.scale_settings = ScaleSettings()  # Добавляем настройки шкалы
+        self.display_settings = DisplaySettings()  # Коррекция изображения
 
     def get_physical_size_mm(self): # Просто для вывода размеров изображения
         return QSizeF(
-            self.size.width() * 25.4 / self.dpi[0],
-            self.size.height() * 25.4 / self.dpi[1]
+            self.size.width() * 25.4 / SCENE_DPI,
+            self.size.height() * 25.4 / SCENE_DPI
         )
 
+    def get_pixel_scale(self):
+        """Сколько единиц сцены приходится на пиксель исходного растра"""
+        return SCENE_DPI / self._dpi[0], SCENE_DPI / self._dpi[1]
+
+    # Геометрия — свойства: при любом изменении сбрасываются закэшированные матрицы и границы.
+    # Точки и размеры заменяются целиком (obj.position = ...); правка на месте кэш не сбросит
+    @property
+    def position(self):
+        return self._position
+
+    @position.setter
+    def position(self, value):
+        self._position = QPointF(value)
+        self._geometry_changed()
+
+    @property
+    def size(self):
+        return self._size
+
+    @size.setter
+    def size(self, value):
+        self._size = QSizeF(value)
+        self._geometry_changed()
+
+    @property
+    def rotation_angle(self):
+        return self._rotation_angle
+
+    @rotation_angle.setter
+    def rotation_angle(self, value):
+        self._rotation_angle = value
+        self._geometry_changed()
+
+    @property
+    def rotation_center(self):
+        return self._rotation_center
+
+    @rotation_center.setter
+    def rotation_center(self, value):
+        self._rotation_center = QPointF(value)
+        self._geometry_changed()
+
+    @property
+    def dpi(self):
+        return self._dpi
+
+    @dpi.setter
+    def dpi(self, value):
+        self._dpi = tuple(value)
+        self._geometry_changed()
+
+    def _geometry_changed(self):
+        self._transforms = None
+        self._inverse_affine = None
+        self._scene_bounds = None
+        if self.geometry_listener:
+            self.geometry_listener(self)
+
+    def _get_transforms(self):
+        if self._transforms is None:
+            center_x, center_y = self._rotation_center.x(), self._rotation_center.y()
+            origin_x, origin_y = self._position.x() + center_x, self._position.y() + center_y
+            # Сдвиг и поворот вокруг rotation_center; обратная — те же шаги в обратном порядке
+            forward = translation(origin_x, origin_y) @ rotation(self._rotation_angle) @ \
+                translation(-center_x, -center_y)
+            inverse = translation(center_x, center_y) @ rotation(-self._rotation_angle) @ \
+                translation(-origin_x, -origin_y)
+            self._transforms = (forward, inverse, forward @ scaling(*self.get_pixel_scale()))
+        return self._transforms
+
+    def local_to_scene_matrix(self):
+        """Матрица 3x3: локальные координаты растра -> сцена"""
+        return self._get_transforms()[0]
+
+    def scene_to_local_matrix(self):
+        """Матрица 3x3: сцена -> локальные координаты растра"""
+        return self._get_transforms()[1]
+
+    def pixel_to_scene_matrix(self):
+        """Матрица 3x3: пиксели исходника -> сцена (с учетом DPI)"""
+        return self._get_transforms()[2]
+
+    def map_to_local(self, points):
+        """Массив точек сцены (N, 2) -> локальные координаты растра"""
+        return _apply_affine(self.scene_to_local_matrix(), points)
+
+    def map_to_scene(self, points):
+        """Массив локальных точек растра (N, 2) -> координаты сцены"""
+        return _apply_affine(self.local_to_scene_matrix(), points)
+
+    def map_pixels_to_local(self, points):
+        """Массив точек в пикселях исходника (N, 2) -> локальные координаты растра"""
+        return np.asarray(points, dtype=np.float64) * self.get_pixel_scale()
+
+    def map_local_to_pixels(self, points):
+        """Массив локальных точек растра (N, 2) -> пиксели исходника"""
+        return np.asarray(points, dtype=np.float64) / self.get_pixel_scale()
+
+    def scene_to_local(self, x, y):
+        """Одна точка сцены -> локальные координаты растра (x, y) с учетом поворота"""
+        if self._inverse_affine is None:
+            # Обычные числа вместо массива: для одной точки так в разы быстрее
+            self._inverse_affine = tuple(self.scene_to_local_matrix()[:2].ravel().tolist())
+        a, b, c, d, e, f = self._inverse_affine
+        return a * x + b * y + c, d * x + e * y + f
+
+    def scene_bounds(self):
+        """Охватывающий прямоугольник повёрнутого растра в сцене: (x0, y0, x1, y1)"""
+        if self._scene_bounds is None:
+            width, height = self._size.width(), self._size.height()
+            corners = self.map_to_scene([(0, 0), (width, 0), (width, height), (0, height)])
+            self._scene_bounds = (*corners.min(axis=0).tolist(), *corners.max(axis=0).tolist())
+        return self._scene_bounds
+
     def contains_point(self, point):
         # Проверка попадания точки с учетом поворота
-        local_x = point.x() - self.position.x()
-        local_y = point.y() - self.position.y()
-
-        dx = local_x - self.rotation_center.x()
-        dy = local_y - self.rotation_center.y()
-
-        angle_rad = -np.radians(self.rotation_angle)
-        cos_val = np.cos(angle_rad)
-        sin_val = np.sin(angle_rad)
-
-        rotated_x = dx * cos_val - dy * sin_val + self.rotation_center.x()
-        rotated_y = dx * sin_val + dy * cos_val + self.rotation_center.y()
+        local_x, local_y = self.scene_to_local(point.x(), point.y())
+        return 0 <= local_x <= self._size.width() and 0 <= local_y <= self._size.height()
 
-        return (0 <= rotated_x <= self.size.width() and 0 <= rotated_y <= self.size.height())
+def _apply_affine(matrix, points):
+    """Аффинная матрица 3x3 к массиву точек (N, 2)"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points @ matrix[:2, :2].T + matrix[:2, 2]
 
 class ScaleSettings:
     def __init__(self):
@@ -59,23 +186,103 @@ class ScaleSettings:
         self.color = (1.0, 0.0, 0.0, 1.0)
         self.line_width = 1.0
 
+class DisplaySettings:
+    """Коррекция изображения растра при отрисовке (применяет шейдер, пиксели не меняются)"""
+    def __init__(self):
+        self.black_level = 0.0  # Яркость (0..1), которая становится чёрной
+        self.white_level = 1.0  # Яркость (0..1), которая становится белой
+        self.gamma = 1.0  # Больше 1 — светлее полутона, проявляются бледные следы
+        self.invert = False
+        self.sharpen_amount = 0.0  # Сила нерезкого маскирования (0 — выключено)
+        self.sharpen_radius = 2.0  # Радиус размытия маски в пикселях исходного изображения
+
 class VectorCurve:
     def __init__(self, raster_object, color=(0.0, 1.0, 0.0, 1.0), line_width=2.0):
-        self.points = []  # Точки кривой в локальных координатах растра
+        self.points = CurvePoints()  # Точки кривой в локальных координатах растра
         self.raster_object = raster_object  # Ссылка на растровый объект
         self.color = color
         self.line_width = line_width
         self.completed = False  # Завершена ли кривая
+        self.revision = 0  # Увеличивается при правке уже добавленных точек (дописывание не считается)
+        self._vertex_index = None
+
+    def vertex_index(self):
+        """Индекс вершин для поиска под курсором (строится при первом запросе)"""
+        if self._vertex_index is None or self._vertex_index.points is not self.points:
+            self._vertex_index = VertexIndex(self.points)
+        return self._vertex_index
+
+    # Правка вершин — только через эти методы: они обновляют индекс и revision
+    def move_vertex(self, index, x, y):
+        self.points.set(index, x, y)
+        self.vertex_index().moved(index)
+        self.revision += 1
+
+    def insert_vertex(self, index, x, y):
+        self.points.insert(index, x, y)
+        self.vertex_index().inserted(index)
+        self.revision += 1
+
+    def delete_vertex(self, index):
+        self.points.delete(index)
+        self.vertex_index().deleted(index)
+        self.revision += 1
+
+    def nearest_segment(self, x, y, radius):
+        """Ближайший к (x, y) отрезок не дальше radius: (номер его второй вершины, точка на нём, расстояние)"""
+        points = self.points.array.astype(np.float64)
+        if len(points) < 2:
+            return None
+        starts, chords = points[:-1], np.diff(points, axis=0)
+        lengths = np.maximum((chords ** 2).sum(axis=1), 1e-12)
+        t = np.clip(((x - starts[:, 0]) * chords[:, 0] + (y - starts[:, 1]) * chords[:, 1]) / lengths, 0.0, 1.0)
+        projections = starts + chords * t[:, None]
+        distances = np.hypot(projections[:, 0] - x, projections[:, 1] - y)
+        best = int(np.argmin(distances))
+        if distances[best] > radius:
+            return None
+        return best + 1, tuple(projections[best].tolist()), float(distances[best])
 
 class GLWidget(QOpenGLWidget):
     objectActivated = pyqtSignal(bool)
     curvesChanged = pyqtSignal(bool)
+    loadProgress = pyqtSignal(int)  # Процент загрузки изображения
+    loadFinished = pyqtSignal(bool)  # True — сцена заменена (открытие), False — растр добавлен
+    loadFailed = pyqtSignal(str)
+    traceFinished = pyqtSignal(str)  # Итог следования по линии для пользователя
+    autoVectorizeProgress = pyqtSignal(int)  # Процент разобранных полос листа
+    autoVectorizeFinished = pyqtSignal(int)  # Сколько линий найдено
+    autoVectorizeFailed = pyqtSignal(str)
+
+    UPLOAD_TIME_BUDGET = 0.008  # Сколько секунд за один тик можно тратить на загрузку текстур
+    GPU_MEMORY_BUDGET = 768 * 1024 ** 2  # Лимит видеопамяти под текстуры тайлов всех растров
+    PREFETCH_MARGIN = 0.25  # Тайлы в этой доле экрана за его краем загружаются заранее
+    MAX_UPLOADS_PER_FRAME = 4  # Остальные тайлы догружаются в следующих кадрах
+    BACKGROUND_COLOR = (0.2, 0.2, 0.2)
+    HOVER_OPACITY = 0.7  # Растр под курсором просвечивает до фона
+    SMOOTH_ZOOM = True  # Колесо мыши масштабирует плавно, за несколько кадров
+    WHEEL_ZOOM_FACTOR = 1.1  # Масштаб за один щелчок колеса (120 единиц angleDelta)
+    BACKGROUND_UPLOAD = True  # Текстуры при загрузке создаются в рабочем потоке (если драйвер позволяет)
+    HUD_REFRESH_MS = 500  # Текст оверлея статистики обновляется не каждый кадр
+    VERTEX_PICK_RADIUS = 6  # Пикселей экрана: на таком расстоянии вершину кривой можно взять мышью
+    TRACE_STOP_TEXT = {  # Причины остановки следования по линии для пользователя
+        STOP_GAP: "разрыв линии",
+        STOP_CROSSING: "пересечение с другой линией",
+        STOP_EDGE: "край растра",
+        STOP_LIMIT: "слишком длинная линия",
+        STOP_UNLOADED: "часть растра ещё загружается",
+    }
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.image_loader = ImageLoader()
-        self.tile_manager = TileManager()
+        # Все текстуры тайлов всех растров: лимит видеопамяти и освобождение при удалении растра
+        self.texture_manager = TextureManager(self.GPU_MEMORY_BUDGET)
+        self.renderer = SceneRenderer()
+        # Слой растров перерисовывается, только когда меняется этот ключ (камера, растры, шкалы)
+        self._raster_layer_key = None
+        self.tile_manager = TileManager(self.texture_manager)
         self.raster_objects = []
+        self.raster_index = RasterIndex()  # Поиск растра под курсором
         self.active_object = None
         self.hovered_object = None
 
@@ -83,10 +290,23 @@ class GLWidget(QOpenGLWidget):
         self.mode_move = True
 
         self.zoom = 1.0
-        self.pan = QPoint(0, 0)
+        self.pan = QPointF(0, 0)
         self.last_pos = QPoint(0, 0)
         self.dragging = False
         self.selection_mode = False
+        # Ввод копится до начала кадра и применяется в paintGL
+        self.frame_scheduler = FrameScheduler(self, self.SMOOTH_ZOOM)
+
+        # Замеры производительности; оверлей со статистикой по умолчанию скрыт
+        self.perf_stats = PerfStats()
+        self._hud = QLabel(self)
+        self._hud.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: #e0e0e0;"
+                                "font-family: monospace; padding: 4px;")
+        self._hud.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self._hud.hide()
+        self._hud_timer = QTimer(self)
+        self._hud_timer.setInterval(self.HUD_REFRESH_MS)
+        self._hud_timer.timeout.connect(self._refresh_hud)
 
         self.setMouseTracking(True)
 
@@ -95,11 +315,33 @@ class GLWidget(QOpenGLWidget):
         self.curves = []  # Все кривые
         self.current_color_index = 0
         self.current_color = (1.0, 0.0, 0.0, 1.0)  # Красный по умолчанию
+        self._dragged_vertex = None  # (кривая, номер вершины), которую тащат мышью
+        self._vertex_hovered = False  # Курсор над вершиной (другой курсор мыши)
+        self.trace_mode = False  # Щелчок в режиме векторизации — следование по линии, а не точка
 
         self.hovered_scale_line = None  # Какая линия шкалы под курсором
         self.dragging_scale_line = None  # Какую линию шкалы перемещаем
         self.scale_line_tooltip = ""  # Текст подсказки для линии
 
+        # Фоновая загрузка изображения
+        self._load_worker = None
+        self._load_replace = False  # Заменить сцену после загрузки (а не добавить растр)
+        self._loading_tile_manager = None
+        self._load_threads = []  # Потоки держим до их завершения, даже после отмены
+        self._auto_vectorize_worker = None
+        self._auto_vectorize_threads = []  # Как и потоки загрузки — до их завершения
+        self._upload_timer = QTimer(self)
+        self._upload_timer.setInterval(0)
+        self._upload_timer.timeout.connect(self._upload_pending_tiles)
+        self._load_started = 0.0
+        self._load_upload_time = 0.0  # Время загрузки тайлов в OpenGL в GUI-потоке
+
+        # Дисковый кэш тайлов: повторное открытие скана обходится без декодирования
+        try:
+            self.tile_cache = TileCache()
+        except OSError as e:
+            print(f"Кэш тайлов отключён: {str(e)}")
+            self.tile_cache = None
 
     def start_vectorization(self):
         try:
@@ -110,6 +352,7 @@ class GLWidget(QOpenGLWidget):
             if not hasattr(self, 'curves'):
                 self.curves = []
             self.current_curve = VectorCurve(self.active_object, self.current_color)
+            self._vertex_hovered = False
             self.setCursor(Qt.CrossCursor)
             self.update()
             return True
@@ -127,6 +370,8 @@ class GLWidget(QOpenGLWidget):
                 self.current_curve = None
 
             self.vectorization_mode = False
+            self.trace_mode = False
+            self._dragged_vertex = None
             self.setCursor(Qt.ArrowCursor)
             self.update()
             return True
@@ -189,22 +434,7 @@ class GLWidget(QOpenGLWidget):
 
     def _scene_to_raster_local(self, scene_point, raster_object):
         """Преобразует глобальные координаты сцены в локальные координаты растра с учетом поворота"""
-        # Сначала вычитаем позицию растра
-        local_x = scene_point.x() - raster_object.position.x()
-        local_y = scene_point.y() - raster_object.position.y()
-
-        # Затем учитываем поворот
-        dx = local_x - raster_object.rotation_center.x()
-        dy = local_y - raster_object.rotation_center.y()
-
-        angle_rad = -np.radians(raster_object.rotation_angle)
-        cos_val = np.cos(angle_rad)
-        sin_val = np.sin(angle_rad)
-
-        rotated_x = dx * cos_val - dy * sin_val + raster_object.rotation_center.x()
-        rotated_y = dx * sin_val + dy * cos_val + raster_object.rotation_center.y()
-
-        return QPointF(rotated_x, rotated_y)
+        return QPointF(*raster_object.scene_to_local(scene_point.x(), scene_point.y()))
 
     def set_mode_move(self, enabled: bool):
         self.mode_move = enabled
@@ -232,100 +462,213 @@ class GLWidget(QOpenGLWidget):
                 self.objectActivated.emit(False)
         self.update()
 
-    def add_image(self, file_path, progress_callback=None):
+    def add_image(self, file_path):
+        """Добавляет изображение к сцене; загрузка идёт в фоне, итог — сигналы loadFinished/loadFailed"""
         try:
-            # Проверка существования файла
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"Файл не найден: {file_path}")
-
-            # Загрузка с автоматическим приведением к 600 DPI
-            new_loader = ImageLoader()
-            new_loader.load(file_path, target_dpi=600)
-
-            # Создание тайлов с обработкой прогресса
-            new_tile_manager = TileManager()
-            new_tile_manager.split_into_tiles(
-                new_loader.image_data,
-                new_loader.width,
-                new_loader.height,
-                progress_callback
-            )
+            self._start_loading(file_path, replace=False)
+            return True
+        except Exception as e:
+            print(f"Ошибка при добавлении изображения: {str(e)}")
+            return False
 
-            # Позиционирование нового изображения со смещением
-            new_pos = QPointF(0, 0)
-            if self.raster_objects:
-                last_obj = self.raster_objects[-1]
-                new_pos = QPointF(
-                    last_obj.position.x() + 20 / self.zoom,
-                    last_obj.position.y() + 20 / self.zoom
-                )
+    def load_image(self, file_path):
+        """Открывает изображение вместо текущих; загрузка идёт в фоне"""
+        try:
+            self._start_loading(file_path, replace=True)
+            return True  # Загрузка запущена
+        except Exception as e:
+            print(f"Ошибка при загрузке изображения: {str(e)}")
+            raise  # Пробрасываем исключение для обработки в MainWindow
 
-            # Создание объекта растра с сохранением пути к файлу
-            obj = RasterObject(
-                new_tile_manager,
-                new_pos,
-                QSizeF(new_loader.width, new_loader.height),
-                file_path  # Добавляем путь к файлу
-            )
-            obj.rotation_center = QPointF(new_loader.width / 2, new_loader.height / 2)
-            obj.dpi = (600, 600)
+    def is_loading(self):
+        return self._load_worker is not None
 
-            self.raster_objects.append(obj)
+    def cancel_loading(self, wait=False):
+        """Отменяет текущую загрузку и сразу освобождает уже созданные текстуры"""
+        worker = self._load_worker
+        if worker is None:
+            return
 
-            # Центрирование камеры для первого изображения
-            if len(self.raster_objects) == 1:
-                self.center_camera_on_raster()
+        worker.cancel()
+        self._upload_timer.stop()
+        self._load_worker = None
 
-            self.update()
-            return True
+        self.makeCurrent()
+        try:
+            self._discard_queued_tiles(worker)
+            if self._loading_tile_manager:
+                self._loading_tile_manager.release()
+        finally:
+            self.doneCurrent()
+        self._loading_tile_manager = None
+
+        if wait:
+            for thread, _ in self._load_threads:
+                thread.wait()
+            self._on_load_thread_finished()
+
+    def _discard_queued_tiles(self, worker):
+        """Удаляет текстуры, загруженные в фоне, но так и не принятые (нужен текущий контекст OpenGL)"""
+        while worker.tile_queue:
+            texture = worker.tile_queue.popleft()[6]
+            if texture:
+                texture_id, _, fence = texture
+                glDeleteSync(fence)
+                glDeleteTextures([texture_id])
+
+    def _start_loading(self, file_path, replace):
+        # Проверка существования файла
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Файл не найден: {file_path}")
+
+        self.cancel_loading()
+
+        # Пиксели не передискретизируются: DPI учитывается масштабом при отрисовке
+        self._load_replace = replace
+        self._loading_tile_manager = TileManager(self.texture_manager)
+        worker = TileLoadWorker(file_path, self._loading_tile_manager.tile_size, self.tile_cache)
+
+        thread = QThread(self)
+        if self.BACKGROUND_UPLOAD and self.context():
+            try:
+                worker.use_background_upload(SharedContextUploader(self.context(), thread), self.texture_manager)
+            except Exception as e:
+                print(f"Фоновая загрузка текстур недоступна: {str(e)}")
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        # Напрямую, в рабочем потоке: GUI-поток может ждать его в cancel_loading(wait=True)
+        worker.finished.connect(thread.quit, Qt.DirectConnection)
+        thread.finished.connect(self._on_load_thread_finished)
+        self._load_threads.append((thread, worker))
+
+        self._load_worker = worker
+        self._load_started = time.perf_counter()
+        self._load_upload_time = 0.0
+        self.loadProgress.emit(0)
+        thread.start()
+        self._upload_timer.start()
+
+    def _on_load_thread_finished(self):
+        # Отменённый поток мог положить в очередь ещё одну текстуру уже после сброса очереди
+        abandoned = [w for t, w in self._load_threads
+                     if t.isFinished() and w is not self._load_worker and w.tile_queue]
+        if abandoned:
+            self.makeCurrent()
+            try:
+                for worker in abandoned:
+                    self._discard_queued_tiles(worker)
+            finally:
+                self.doneCurrent()
+        self._load_threads = [(t, w) for t, w in self._load_threads if not t.isFinished()]
+
+    def _upload_pending_tiles(self):
+        """Загружает готовые тайлы в OpenGL порциями, не занимая GUI-поток дольше бюджета"""
+        worker = self._load_worker
+        if worker is None:
+            self._upload_timer.stop()
+            return
 
-        except Exception as e:
-            print(f"Ошибка при добавлении изображения: {str(e)}")
-            return False
+        tile_manager = self._loading_tile_manager
+        if worker.tile_queue:
+            if not tile_manager.tile_count():
+                tile_manager.image_width = worker.width
+                tile_manager.image_height = worker.height
+                tile_manager.pixel_format = worker.pixel_format
+                tile_manager.set_level_sources(worker.level_sources)
 
-    def load_image(self, file_path, progress_callback=None):
-        try:
-            # Проверка существования файла
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"Файл не найден: {file_path}")
+            self.makeCurrent()
+            try:
+                started = time.perf_counter()
+                deadline = started + self.UPLOAD_TIME_BUDGET
+                while worker.tile_queue and time.perf_counter() < deadline:
+                    entry = worker.tile_queue[0]
+                    texture = entry[6]
+                    if texture is None:
+                        tile_manager.upload_tile(*entry[:6])
+                    else:
+                        # Текстура из рабочего потока: берётся, только когда её загрузка завершена
+                        texture_id, flipped, fence = texture
+                        if not fence_passed(fence):
+                            break
+                        glDeleteSync(fence)
+                        tile_manager.adopt_tile(*entry[:6], texture_id, flipped)
+                    worker.tile_queue.popleft()
+                self._load_upload_time += time.perf_counter() - started
+            finally:
+                self.doneCurrent()
+
+            if worker.total_tiles:
+                self.loadProgress.emit(min(99, tile_manager.tile_count() * 100 // worker.total_tiles))
+
+        # Обработчик прогресса мог прокрутить цикл событий и отменить или завершить загрузку
+        if worker is not self._load_worker or not worker.done or worker.tile_queue:
+            return
 
+        if worker.error:
+            self.cancel_loading()
+            self.loadFailed.emit(f"Ошибка загрузки изображения: {worker.error}")
+            return
+
+        self._upload_timer.stop()
+        self._load_worker = None
+        self._loading_tile_manager = None
+        stages = dict(worker.stage_times)
+        stages["gl_upload"] = self._load_upload_time
+        stages["total"] = time.perf_counter() - self._load_started
+        self.perf_stats.record_load(worker.file_path, stages)
+        self._add_raster_object(tile_manager, worker.file_path, worker.dpi)
+        self.loadProgress.emit(100)
+        self.loadFinished.emit(self._load_replace)
+
+    def _add_raster_object(self, tile_manager, file_path, dpi):
+        if self._load_replace:
             self.clear_rasters()
+        self.tile_manager = tile_manager
 
-            # Загрузка изображения
-            self.image_loader = ImageLoader()
-            self.image_loader.load(file_path, target_dpi=600)
-
-            # Создание тайлов
-            self.tile_manager = TileManager()
-            self.tile_manager.split_into_tiles(
-                self.image_loader.image_data,
-                self.image_loader.width,
-                self.image_loader.height,
-                progress_callback
+        # Позиционирование нового изображения со смещением
+        new_pos = QPointF(0, 0)
+        if self.raster_objects:
+            last_obj = self.raster_objects[-1]
+            new_pos = QPointF(
+                last_obj.position.x() + 20 / self.zoom,
+                last_obj.position.y() + 20 / self.zoom
             )
 
-            # Создание основного объекта растра
-            obj = RasterObject(
-                self.tile_manager,
-                QPointF(0, 0),
-                QSizeF(self.image_loader.width, self.image_loader.height),
-                file_path  # Добавляем путь к файлу
-            )
-            obj.rotation_center = QPointF(self.image_loader.width / 2, self.image_loader.height / 2)
-            obj.dpi = (600, 600)
+        # Размер в сцене — размер исходника, приведённый к SCENE_DPI
+        width = tile_manager.image_width * SCENE_DPI / dpi[0]
+        height = tile_manager.image_height * SCENE_DPI / dpi[1]
 
-            self.raster_objects.append(obj)
-            self.center_camera_on_raster()
-            self.update()
+        # Создание объекта растра с сохранением пути к файлу
+        obj = RasterObject(
+            tile_manager,
+            new_pos,
+            QSizeF(width, height),
+            file_path  # Добавляем путь к файлу
+        )
+        obj.rotation_center = QPointF(width / 2, height / 2)
+        obj.dpi = dpi
 
-            return True  # Указываем на успешную загрузку
+        self.raster_objects.append(obj)
+        self.raster_index.insert(obj)
 
-        except Exception as e:
-            print(f"Ошибка при загрузке изображения: {str(e)}")
-            raise  # Пробрасываем исключение для обработки в MainWindow
+        # Центрирование камеры для первого изображения
+        if len(self.raster_objects) == 1:
+            self.center_camera_on_raster()
+
+        self.update()
 
     def clear_rasters(self):
+        self.cancel_auto_vectorize()
+        # Видеопамять удаляемых растров освобождается сразу, а не при выходе из программы
+        self.makeCurrent()
+        try:
+            for obj in self.raster_objects:
+                if obj.tile_manager:
+                    obj.tile_manager.release()
+        finally:
+            self.doneCurrent()
         self.raster_objects = []
+        self.raster_index.clear()
         self.active_object = None
         self.hovered_object = None
         self.update()
@@ -336,187 +679,281 @@ class GLWidget(QOpenGLWidget):
             self.update()
 
     def initializeGL(self):
-        glClearColor(0.2, 0.2, 0.2, 1.0)
-        glEnable(GL_TEXTURE_2D)
-        glEnable(GL_BLEND)
-        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glClearColor(*self.BACKGROUND_COLOR, 1.0)
+        self.perf_stats.read_gl_info()
+        # Контекст пропадает при уничтожении виджета (и при переносе в другое окно)
+        self.context().aboutToBeDestroyed.connect(self._release_gl_resources)
+        try:
+            self.renderer.initialize()
+        except Exception as e:
+            print(f"Ошибка инициализации OpenGL: {str(e)}")
+
+    def _release_gl_resources(self):
+        """Освобождает всю видеопамять, пока контекст ещё жив"""
+        # Рабочий поток должен отпустить разделяемый контекст раньше, чем исчезнет этот
+        self.cancel_loading(wait=True)
+        self.cancel_auto_vectorize(wait=True)
+        self.makeCurrent()
+        try:
+            for obj in self.raster_objects:
+                if obj.tile_manager:
+                    obj.tile_manager.release()
+            self.tile_manager.release()
+            self.texture_manager.release_all()
+            self.renderer.release()
+            self.perf_stats.release()
+        finally:
+            self.doneCurrent()
 
     def resizeGL(self, w, h):
-        glViewport(0, 0, w, h)
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        gluOrtho2D(0, w, h, 0)
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
+        self.renderer.resize(w, h)
+
+    def set_hud_visible(self, visible):
+        """Оверлей статистики; время на GPU меряется, только пока он показан"""
+        self.perf_stats.gpu_timing = visible
+        self._hud.setVisible(visible)
+        if visible:
+            self._refresh_hud()
+            self._hud_timer.start()
+        else:
+            self._hud_timer.stop()
+
+    def _refresh_hud(self):
+        self._hud.setText(self.perf_stats.summary())
+        self._hud.adjustSize()
+        self._hud.move(self.width() - self._hud.width() - 10, 10)
 
     def paintGL(self):
+        self.perf_stats.begin_frame()
+        try:
+            self._paint_scene()
+        finally:
+            self.perf_stats.end_frame()
+
+    def _paint_scene(self):
+        with self.perf_stats.phase("input"):
+            self.frame_scheduler.apply()
+        glClear(GL_COLOR_BUFFER_BIT)
         if not self.raster_objects:
             return
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        glLoadIdentity()
-
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        glOrtho(0, self.width(), self.height(), 0, -1, 1)
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
-
-        glTranslatef(self.pan.x(), self.pan.y(), 0)
-        glScalef(self.zoom, self.zoom, 1.0)
 
+        # Сцена -> экран: перемещение и масштаб камеры
+        view = ortho(self.width(), self.height()) @ translation(self.pan.x(), self.pan.y()) @ \
+            scaling(self.zoom, self.zoom)
+
+        # Растры рисуются в слой, только если изменились камера или сами растры;
+        # иначе кадр — это копия слоя и поверх неё подсветка и кривые
+        key = self._raster_layer_state()
+        if key != self._raster_layer_key:
+            layer = self.renderer.begin_layer()
+            if not layer:
+                self.renderer.end_layer(self.defaultFramebufferObject())
+            pending = self._draw_rasters(view)
+            if layer:
+                self.renderer.end_layer(self.defaultFramebufferObject())
+            self.perf_stats.count("layer_redraws")
+            # Пока догружаются тайлы, слой не считается готовым
+            self._raster_layer_key = key if layer and not pending else None
+            if pending:
+                self.frame_scheduler.request_next_frame()
+        else:
+            layer = True
+        with self.perf_stats.phase("overlay", gpu=True):
+            if layer:
+                self.renderer.draw_layer()
+
+            # Наведённый растр — полупрозрачная заливка цветом фона поверх слоя
+            hovered = self.hovered_object
+            if not self.mode_move and hovered and hovered != self.active_object and hovered in self.raster_objects:
+                self.renderer.fill_rect(view @ self._raster_matrix(hovered),
+                                        (0.0, 0.0, hovered.size.width(), hovered.size.height()),
+                                        (*self.BACKGROUND_COLOR, 1.0 - self.HOVER_OPACITY))
+
+        # Отрисовка кривых векторизации: по одному вызову на растр
+        with self.perf_stats.phase("curves", gpu=True):
+            curves = list(self.curves)
+            if self.current_curve and len(self.current_curve.points) > 0:
+                curves.append(self.current_curve)
+            by_raster = {}
+            for curve in curves:
+                if curve and curve.raster_object:
+                    by_raster.setdefault(id(curve.raster_object), (curve.raster_object, []))[1].append(curve)
+            for raster_object, raster_curves in by_raster.values():
+                self._draw_curves(raster_curves, view @ self._raster_matrix(raster_object))
+            self.renderer.release_curves(keep=curves)
+        self.perf_stats.set("curves", len(curves))
+
+        textures, texture_bytes = self.texture_manager.stats()
+        self.perf_stats.set("textures", textures)
+        self.perf_stats.set("texture_bytes", texture_bytes)
+
+    def _raster_layer_state(self):
+        """Всё, от чего зависит картинка слоя растров"""
+        rasters = tuple((obj, obj.position.x(), obj.position.y(), obj.rotation_angle,
+                         obj.rotation_center.x(), obj.rotation_center.y(),
+                         obj.size.width(), obj.size.height(), obj.dpi,
+                         tuple(vars(obj.scale_settings).values()), tuple(vars(obj.display_settings).values()))
+                        for obj in self.raster_objects)
+        active = self.active_object if not self.mode_move else None
+        return (self.width(), self.height(), self.zoom, self.pan.x(), self.pan.y(), active, rasters)
+
+    def _draw_rasters(self, view):
+        """Тайлы и шкалы всех растров; True — часть тайлов ещё не загружена"""
+        self.texture_manager.begin_frame()
+        uploads_left = self.MAX_UPLOADS_PER_FRAME
+        pending = False
+        tiles_drawn = 0
         for obj in self.raster_objects:
-            glPushMatrix()
-
-            glTranslatef(obj.position.x(), obj.position.y(), 0)
-            glTranslatef(obj.rotation_center.x(), obj.rotation_center.y(), 0)
-            glRotatef(obj.rotation_angle, 0, 0, 1)
-            glTranslatef(-obj.rotation_center.x(), -obj.rotation_center.y(), 0)
+            if not self._raster_on_screen(obj):
+                continue
+            obj_matrix = view @ self._raster_matrix(obj)
 
             if obj.tile_manager and not obj.tile_manager.is_empty():
-                for tile in obj.tile_manager.tiles:
-                    # Светлее, если наведён и в режиме работы с растром
-                    if not self.mode_move:
-                        if obj == self.active_object:
-                            glColor4f(0.65, 0.65, 0.65, 1.0)  # Тёмнее — активный растр
-                        elif obj == self.hovered_object:
-                            glColor4f(1.0, 1.0, 1.0, 0.7)  # Полупрозрачный при наведении
-                        else:
-                            glColor4f(1.0, 1.0, 1.0, 1.0)
-                    else:
-                        glColor4f(1.0, 1.0, 1.0, 1.0)
+                with self.perf_stats.phase("rasters", gpu=True):
+                    uploads_left, tiles_pending, drawn = self._draw_raster_tiles(obj, obj_matrix, uploads_left)
+                pending = pending or tiles_pending
+                tiles_drawn += drawn
 
-                    if not tile.texture_id:
-                        continue
-                    glBindTexture(GL_TEXTURE_2D, tile.texture_id)
-                    glBegin(GL_QUADS)
-                    glTexCoord2f(0, 0)
-                    glVertex2f(tile.x, tile.y)
-                    glTexCoord2f(1, 0)
-                    glVertex2f(tile.x + tile.width, tile.y)
-                    glTexCoord2f(1, 1)
-                    glVertex2f(tile.x + tile.width, tile.y + tile.height)
-                    glTexCoord2f(0, 1)
-                    glVertex2f(tile.x, tile.y + tile.height)
-                    glEnd()
-
-            glPopMatrix()
             # Отрисовка шкал поверх изображения
-            self.draw_scales(obj)
-
-        # Отрисовка кривых векторизации
-        glDisable(GL_TEXTURE_2D)
-        for curve in self.curves:
-            self._draw_curve(curve)
-
-        if self.current_curve and len(self.current_curve.points) > 0:
-            self._draw_curve(self.current_curve)
-        glEnable(GL_TEXTURE_2D)
-
-    def _draw_curve(self, curve):
-        if not curve or not hasattr(curve, 'points') or not curve.raster_object:
-            return
+            with self.perf_stats.phase("scales", gpu=True):
+                self.draw_scales(obj, obj_matrix)
+
+        # Лишние текстуры удаляются после кадра, тайлы этого кадра остаются
+        self.texture_manager.evict()
+        self.perf_stats.set("tiles_drawn", tiles_drawn)
+        return pending
+
+    def _draw_raster_tiles(self, obj, obj_matrix, uploads_left):
+        """Видимые тайлы растра; возвращает (сколько ещё можно загрузить, есть ли незагруженные, нарисовано тайлов)"""
+        tm = obj.tile_manager
+        # Уровень пирамиды под текущий масштаб: при отдалении читаются обзорные тайлы
+        level = tm.level_for_scale(self.zoom * max(obj.get_pixel_scale()))
+
+        # Тёмнее — активный растр в режиме работы с растром (наведённый подсвечивается поверх слоя)
+        tint = (1.0, 1.0, 1.0, 1.0)
+        if not self.mode_move and obj == self.active_object:
+            tint = (0.65, 0.65, 0.65, 1.0)
+
+        draws = []
+        pending = False
+        for tile in tm.visible_tiles(level, self._visible_pixel_quad(obj)):
+            # Вытесненный из видеопамяти тайл загружается заново, но не больше
+            # MAX_UPLOADS_PER_FRAME за кадр, чтобы перемещение не подтормаживало
+            if not tile.texture_id and uploads_left > 0:
+                with self.perf_stats.phase("upload"):
+                    tm.ensure_resident(tile)
+                self.perf_stats.count("tiles_uploaded")
+                uploads_left -= 1
+            else:
+                tm.texture_manager.touch(tile)
 
-        try:
-            # Проверяем корректность цвета
-            color = getattr(curve, 'color', (1.0, 0.0, 0.0, 1.0))
-            if not isinstance(color, (tuple, list)) or len(color) != 4:
-                color = (1.0, 0.0, 0.0, 1.0)
-
-            glColor4f(*color)
-            glLineWidth(getattr(curve, 'line_width', 2.0))
-
-            glPushMatrix()
-            # Применяем преобразования растра
-            glTranslatef(curve.raster_object.position.x(), curve.raster_object.position.y(), 0)
-            glTranslatef(curve.raster_object.rotation_center.x(), curve.raster_object.rotation_center.y(), 0)
-            glRotatef(curve.raster_object.rotation_angle, 0, 0, 1)
-            glTranslatef(-curve.raster_object.rotation_center.x(), -curve.raster_object.rotation_center.y(), 0)
-
-            # Рисуем линии
-            if len(curve.points) > 1:
-                glBegin(GL_LINE_STRIP)
-                for point in curve.points:
-                    if isinstance(point, QPointF):
-                        glVertex2f(point.x(), point.y())
-                glEnd()
-
-            # Рисуем точки
-            glPointSize(5.0)
-            glBegin(GL_POINTS)
-            for point in curve.points:
-                if isinstance(point, QPointF):
-                    glVertex2f(point.x(), point.y())
-            glEnd()
-
-            glPopMatrix()
-        except Exception as e:
-            print(f"Ошибка отрисовки кривой: {str(e)}")
+            if tile.texture_id:
+                draws.append((tile, tile))
+            else:
+                # Пока тайл не загружен, на его месте растягивается более грубый уровень
+                pending = True
+                parent = tm.resident_parent(tile)
+                if parent:
+                    draws.append((tile, parent))
+
+        # Тайлы заданы в пикселях исходника; к SCENE_DPI приводит сама матрица
+        matrix = obj_matrix @ scaling(*obj.get_pixel_scale())
+        display = obj.display_settings
+        if display.sharpen_amount > 0 and draws and self.renderer.begin_sharpen():
+            # Резкость — по экранному изображению всего растра, без швов на стыках тайлов.
+            # Радиус задан в пикселях исходника: на экране это zoom * (единиц сцены на пиксель)
+            self.renderer.draw_tiles(tm, matrix, (1.0, 1.0, 1.0, 1.0), draws)
+            radius = display.sharpen_radius * self.zoom * max(obj.get_pixel_scale())
+            self.renderer.end_sharpen(display, radius, tint)
+        else:
+            self.renderer.draw_tiles(tm, matrix, tint, draws, display)
+        return uploads_left, pending, len(draws)
+
+    def _raster_on_screen(self, obj):
+        """Задевает ли окно охватывающий прямоугольник растра (с запасом на толщину линий шкал)"""
+        width, height = obj.size.width(), obj.size.height()
+        corners = self.scene_to_screen(obj.map_to_scene([(0, 0), (width, 0), (width, height), (0, height)]))
+        (x0, y0), (x1, y1) = corners.min(axis=0), corners.max(axis=0)
+        pad = obj.scale_settings.line_width
+        return x1 >= -pad and y1 >= -pad and x0 <= self.width() + pad and y0 <= self.height() + pad
+
+    def _raster_matrix(self, obj):
+        """Локальные координаты растра -> сцена: сдвиг и поворот вокруг rotation_center"""
+        return obj.local_to_scene_matrix()
+
+    def _visible_pixel_quad(self, obj):
+        """Экран (с запасом PREFETCH_MARGIN) в пикселях исходника растра: четыре угла по кругу"""
+        return obj.map_local_to_pixels(self._visible_local_quad(obj, self.PREFETCH_MARGIN)).tolist()
+
+    def _visible_local_rect(self, obj):
+        """Ограничивающий прямоугольник экрана в локальных координатах растра"""
+        quad = self._visible_local_quad(obj)
+        xs = [x for x, _ in quad]
+        ys = [y for _, y in quad]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def _visible_local_quad(self, obj, margin=0.0):
+        """Углы экрана (расширенного на долю margin) в локальных координатах растра"""
+        margin_x = self.width() * margin
+        margin_y = self.height() * margin
+        left, right = -margin_x, self.width() + margin_x
+        top, bottom = -margin_y, self.height() + margin_y
+        corners = [(left, top), (right, top), (right, bottom), (left, bottom)]
+        return [tuple(point) for point in obj.map_to_local(self.screen_to_scene(corners)).tolist()]
+
+    def _draw_curves(self, curves, matrix):
+        for curve in curves:
+            try:
+                # Проверяем корректность цвета
+                color = getattr(curve, 'color', (1.0, 0.0, 0.0, 1.0))
+                if not isinstance(color, (tuple, list)) or len(color) != 4:
+                    color = (1.0, 0.0, 0.0, 1.0)
+
+                # Линии и точки вершин; детализация по масштабу (кривые заданы в единицах сцены).
+                # Правимую кривую не упрощаем: упрощение пересчитывалось бы на каждом движении мыши
+                edited = self._dragged_vertex is not None and self._dragged_vertex[0] is curve
+                self.renderer.draw_curve(curve, matrix, self.zoom, color,
+                                         getattr(curve, 'line_width', 2.0), point_size=5.0,
+                                         simplify=curve.completed and not edited)
+            except Exception as e:
+                print(f"Ошибка отрисовки кривой: {str(e)}")
 
-    def draw_scales(self, obj):
-        if not obj.scale_settings.time_visible and not obj.scale_settings.amplitude_visible:
+    def draw_scales(self, obj, matrix):
+        settings = obj.scale_settings
+        if not settings.time_visible and not settings.amplitude_visible:
             return
 
-        glPushMatrix()
-        glTranslatef(obj.position.x(), obj.position.y(), 0)
-        glTranslatef(obj.rotation_center.x(), obj.rotation_center.y(), 0)
-        glRotatef(obj.rotation_angle, 0, 0, 1)
-        glTranslatef(-obj.rotation_center.x(), -obj.rotation_center.y(), 0)
-
-        # Устанавливаем параметры линий
-        glColor4f(*obj.scale_settings.color)
-        glLineWidth(obj.scale_settings.line_width)
+        width, height = obj.size.width(), obj.size.height()
 
         # ВРЕМЕННАЯ ШКАЛА (горизонтальные линии)
-        if obj.scale_settings.time_visible and obj.scale_settings.time_max > obj.scale_settings.time_min:
-            time_range = obj.scale_settings.time_max - obj.scale_settings.time_min
-            pixels_per_second = obj.size.height() / time_range
-
-            # Рассчитываем видимый диапазон времени
-            visible_time_min = max(obj.scale_settings.time_min, 0)
-            visible_time_max = min(obj.scale_settings.time_max,
-                                   obj.scale_settings.time_min + obj.size.height() / pixels_per_second)
-
-            # Находим первый и последний шаг, попадающий в видимый диапазон
-            first_step = int(np.ceil((visible_time_min - obj.scale_settings.time_min) / obj.scale_settings.time_step))
-            last_step = int(np.floor((visible_time_max - obj.scale_settings.time_min) / obj.scale_settings.time_step))
-
-            # Рисуем только видимые линии
-            for i in range(first_step, last_step + 1):
-                time = obj.scale_settings.time_min + i * obj.scale_settings.time_step
-                y = (time - obj.scale_settings.time_min) * pixels_per_second
-                if 0 <= y <= obj.size.height():
-                    glBegin(GL_LINES)
-                    glVertex2f(0, y)
-                    glVertex2f(obj.size.width(), y)
-                    glEnd()
+        rows = None
+        if settings.time_visible and settings.time_max > settings.time_min:
+            pixels_per_second = height / (settings.time_max - settings.time_min)
+            rows = self._scale_lines(settings.time_min, settings.time_max, settings.time_step, pixels_per_second)
 
         # ШКАЛА АМПЛИТУД (вертикальные линии)
-        if obj.scale_settings.amplitude_visible and obj.scale_settings.amplitude_max > obj.scale_settings.amplitude_min:
-            amp_range = obj.scale_settings.amplitude_max - obj.scale_settings.amplitude_min
-            pixels_per_unit = obj.size.width() / amp_range
-
-            # Рассчитываем видимый диапазон амплитуд
-            visible_amp_min = max(obj.scale_settings.amplitude_min, 0)
-            visible_amp_max = min(obj.scale_settings.amplitude_max,
-                                  obj.scale_settings.amplitude_min + obj.size.width() / pixels_per_unit)
-
-            # Находим первый и последний шаг, попадающий в видимый диапазон
-            first_step = int(
-                np.ceil((visible_amp_min - obj.scale_settings.amplitude_min) / obj.scale_settings.amplitude_step))
-            last_step = int(
-                np.floor((visible_amp_max - obj.scale_settings.amplitude_min) / obj.scale_settings.amplitude_step))
-
-            # Рисуем только видимые линии
-            for i in range(first_step, last_step + 1):
-                amp = obj.scale_settings.amplitude_min + i * obj.scale_settings.amplitude_step
-                x = (amp - obj.scale_settings.amplitude_min) * pixels_per_unit
-                if 0 <= x <= obj.size.width():
-                    glBegin(GL_LINES)
-                    glVertex2f(x, 0)
-                    glVertex2f(x, obj.size.height())
-                    glEnd()
-
-        glPopMatrix()
+        columns = None
+        if settings.amplitude_visible and settings.amplitude_max > settings.amplitude_min:
+            pixels_per_unit = width / (settings.amplitude_max - settings.amplitude_min)
+            columns = self._scale_lines(settings.amplitude_min, settings.amplitude_max,
+                                        settings.amplitude_step, pixels_per_unit)
+
+        # Сетку рисует шейдер, и только в видимой части растра (с запасом на толщину линий)
+        pad = settings.line_width / self.zoom
+        x0, y0, x1, y1 = self._visible_local_rect(obj)
+        rect = (max(x0, -pad), max(y0, -pad), min(x1, width + pad), min(y1, height + pad))
+        self.renderer.draw_scale_grid(matrix, rect, rows, columns, settings.color, settings.line_width)
+
+    @staticmethod
+    def _scale_lines(value_min, value_max, step, pixels_per_value):
+        """(шаг, первый, последний номер) линий шкалы от max(value_min, 0) до value_max"""
+        if step <= 0:
+            return None
+        first_step = int(np.ceil((max(value_min, 0) - value_min) / step))
+        last_step = int(np.floor((value_max - value_min) / step))
+        if last_step < first_step:
+            return None
+        return (step * pixels_per_value, float(first_step), float(last_step))
 
     def _notify_curves_changed(self):
         """Уведомляет об изменении состояния кривых"""
@@ -545,19 +982,11 @@ class GLWidget(QOpenGLWidget):
                     f.write(f"color={','.join(map(str, curve.color))}\n")
                     f.write(f"width={curve.line_width}\n")
 
-                    # Проверяем и сохраняем точки
-                    if not hasattr(curve, 'points') or not curve.points:
+                    if not len(curve.points):
                         continue
 
-                    points_str = []
-                    for point in curve.points:
-                        # Проверяем, что точка - это QPointF или аналогичный объект
-                        if hasattr(point, 'x') and hasattr(point, 'y'):
-                            points_str.append(f"{point.x():.2f},{point.y():.2f}")
-                        elif isinstance(point, (tuple, list)) and len(point) >= 2:
-                            points_str.append(f"{point[0]:.2f},{point[1]:.2f}")
-
-                    f.write(f"points={';'.join(points_str)}\n\n")
+                    points_str = ";".join(f"{x:.2f},{y:.2f}" for x, y in curve.points.array.tolist())
+                    f.write(f"points={points_str}\n\n")
 
             return True
         except Exception as e:
@@ -618,14 +1047,15 @@ class GLWidget(QOpenGLWidget):
                     # Загружаем точки
                     points_str = curve_data.get('points', '')
                     if points_str:
+                        pairs = []
                         for pair in points_str.split(';'):
                             if ',' in pair:
                                 try:
-                                    x, y = map(float, pair.split(','))
-                                    # Добавляем точку в локальных координатах растра
-                                    curve.points.append(QPointF(x, y))
+                                    # Точка в локальных координатах растра
+                                    pairs.append(tuple(map(float, pair.split(','))))
                                 except ValueError:
                                     continue
+                        curve.points.extend(pairs)
 
                     if len(curve.points) >= 2:  # Добавляем только кривые с достаточным количеством точек
                         curve.completed = True
@@ -648,17 +1078,16 @@ class GLWidget(QOpenGLWidget):
             raise
 
     def mouseDoubleClickEvent(self, event):
+        self.frame_scheduler.flush()  # Камера и растры — как на экране, а не как в прошлом кадре
         if not self.mode_move and self.selection_mode and event.button() == Qt.LeftButton:
-            scene_pos = self.map_to_scene(event.pos())
-            for obj in reversed(self.raster_objects):
-                if obj.contains_point(scene_pos):
-                    if self.active_object:
-                        self.active_object.is_active = False
-                    self.active_object = obj
-                    obj.is_active = True
-                    self.objectActivated.emit(True)
-                    self.update()
-                    break
+            obj = self.raster_index.hit_test(self.map_to_scene(event.pos()))
+            if obj:
+                if self.active_object:
+                    self.active_object.is_active = False
+                self.active_object = obj
+                obj.is_active = True
+                self.objectActivated.emit(True)
+                self.update()
             else:
                 # Если ни один объект не выбран, деактивируем текущий
                 if self.active_object:
@@ -673,23 +1102,19 @@ class GLWidget(QOpenGLWidget):
             super().mouseDoubleClickEvent(event)
 
     def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton and self.vectorization_mode:
+        self.frame_scheduler.flush()
+        if self.vectorization_mode and self.active_object:
             try:
-                scene_pos = self.map_to_scene(event.pos())
-                local_pos = self._scene_to_raster_local(scene_pos, self.active_object)
-
-                if not self.current_curve:
-                    self.current_curve = VectorCurve(self.active_object, self.current_color)
-
-                self.current_curve.points.append(local_pos)
-                self.update()
-
-                # Уведомляем об изменении кривых
-                if hasattr(self.parent(), 'curves_changed'):
-                    self.parent().curves_changed(bool(self.curves) or
-                                                 (self.current_curve and len(self.current_curve.points) > 0))
+                if self._edit_curve_vertex(event):
+                    return
             except Exception as e:
-                print(f"Ошибка при добавлении точки: {str(e)}")
+                print(f"Ошибка правки вершины: {str(e)}")
+            if self.trace_mode and event.button() == Qt.LeftButton:
+                try:
+                    self.trace_line_at(event.pos())
+                except Exception as e:
+                    print(f"Ошибка следования по линии: {str(e)}")
+                return
 
         if event.button() == Qt.LeftButton:
             self.last_pos = event.pos()
@@ -719,56 +1144,191 @@ class GLWidget(QOpenGLWidget):
 
         super().mousePressEvent(event)
 
+    def _editable_curves(self):
+        """Кривые активного растра, вершины которых можно править мышью"""
+        curves = [curve for curve in self.curves if curve.raster_object is self.active_object]
+        if self.current_curve and self.current_curve.raster_object is self.active_object:
+            curves.append(self.current_curve)
+        return curves
+
+    def _pick_vertex(self, x, y, radius):
+        """Ближайшая вершина кривых активного растра у точки (x, y) растра: (кривая, номер) или None"""
+        best = None
+        for curve in self._editable_curves():
+            hit = curve.vertex_index().nearest(x, y, radius)
+            if hit and (best is None or hit[1] < best[2]):
+                best = (curve, hit[0], hit[1])
+        return best[:2] if best else None
+
+    def set_trace_mode(self, enabled):
+        self.trace_mode = enabled
+
+    def trace_line_at(self, widget_point):
+        """Следование по линии активного растра от точки экрана; кривая добавляется к готовым"""
+        obj = self.active_object
+        if not obj or not obj.tile_manager or obj.tile_manager.is_empty():
+            return None
+        scene_pos = self.map_to_scene(widget_point)
+        x, y = obj.map_local_to_pixels([obj.scene_to_local(scene_pos.x(), scene_pos.y())])[0]
+        result = TraceFollower(obj.tile_manager).trace(x, y)
+        if result is None or len(result.points) < 2:
+            self.traceFinished.emit("Рядом с точкой щелчка линия не найдена")
+            return None
+
+        curve = VectorCurve(obj, self.current_color)
+        curve.points.extend(obj.map_pixels_to_local(result.points))
+        curve.completed = True
+        self.curves.append(curve)
+        self._notify_curves_changed()
+        self.update()
+        start_stop, end_stop = (self.TRACE_STOP_TEXT[stop] for stop in result.stops)
+        self.traceFinished.emit(f"Линия прослежена: {len(curve.points)} точек\n"
+                                f"Остановка в начале: {start_stop}, в конце: {end_stop}")
+        return curve
+
+    def start_auto_vectorize(self):
+        """Запускает поиск всех линий активного растра в рабочем потоке.
+
+        Итог приходит сигналом autoVectorizeFinished (линии уже добавлены
+        к готовым кривым для проверки) или autoVectorizeFailed.
+        False — нет растра или поиск уже идёт.
+        """
+        obj = self.active_object
+        if not obj or not obj.tile_manager or obj.tile_manager.is_empty() or self._auto_vectorize_worker:
+            return False
+
+        worker = AutoVectorizeWorker(obj)
+        thread = QThread(self)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        worker.progress.connect(self.autoVectorizeProgress)
+        # Напрямую, в рабочем потоке: GUI-поток может ждать его в cancel_auto_vectorize(wait=True)
+        worker.finished.connect(thread.quit, Qt.DirectConnection)
+        worker.finished.connect(self._on_auto_vectorize_finished)
+        thread.finished.connect(self._on_auto_vectorize_thread_finished)
+        self._auto_vectorize_threads.append((thread, worker))
+        self._auto_vectorize_worker = worker
+        thread.start()
+        return True
+
+    def cancel_auto_vectorize(self, wait=False):
+        """Прерывает поиск линий; найденное к этому моменту отбрасывается"""
+        if self._auto_vectorize_worker:
+            self._auto_vectorize_worker.cancel()
+            self._auto_vectorize_worker = None
+        if wait:
+            for thread, _ in self._auto_vectorize_threads:
+                thread.wait()
+            self._on_auto_vectorize_thread_finished()
+
+    def _on_auto_vectorize_finished(self):
+        worker = self.sender()
+        if worker is not self._auto_vectorize_worker:
+            return  # Поиск отменён
+        self._auto_vectorize_worker = None
+        obj = worker.raster_object
+        if worker.error:
+            self.autoVectorizeFailed.emit(worker.error)
+            return
+        if worker.lines is None or obj not in self.raster_objects:
+            return
+
+        for points in worker.lines:
+            curve = VectorCurve(obj, self.current_color)
+            curve.points.extend(obj.map_pixels_to_local(points))
+            curve.completed = True
+            self.curves.append(curve)
+        self._notify_curves_changed()
+        self.update()
+        self.autoVectorizeFinished.emit(len(worker.lines))
+
+    def _on_auto_vectorize_thread_finished(self):
+        self._auto_vectorize_threads = [(t, w) for t, w in self._auto_vectorize_threads if not t.isFinished()]
+
+    def _edit_curve_vertex(self, event):
+        """Правка кривых в режиме векторизации; True — нажатие обработано.
+
+        Левая кнопка на вершине — перетаскивание, правая — удаление вершины,
+        Ctrl+левая на отрезке — новая вершина (её сразу можно тащить).
+        """
+        scene_pos = self.map_to_scene(event.pos())
+        x, y = self.active_object.scene_to_local(scene_pos.x(), scene_pos.y())
+        radius = self.VERTEX_PICK_RADIUS / self.zoom  # Кривые в единицах сцены
+
+        if event.button() == Qt.LeftButton and event.modifiers() & Qt.ControlModifier:
+            hits = [(curve, curve.nearest_segment(x, y, radius)) for curve in self._editable_curves()]
+            hits = [(curve, hit) for curve, hit in hits if hit]
+            if not hits:
+                return False
+            curve, (index, point, _) = min(hits, key=lambda item: item[1][2])
+            curve.insert_vertex(index, *point)
+            self._dragged_vertex = (curve, index)
+            self.update()
+            return True
+
+        hit = self._pick_vertex(x, y, radius)
+        if not hit:
+            return False
+        curve, index = hit
+        if event.button() == Qt.LeftButton:
+            self._dragged_vertex = hit
+        elif event.button() == Qt.RightButton:
+            curve.delete_vertex(index)
+            if curve.completed and len(curve.points) < 2:
+                self.curves.remove(curve)
+            self._notify_curves_changed()
+        else:
+            return False
+        self.update()
+        return True
+
     def mouseMoveEvent(self, event):
         scene_pos = self.map_to_scene(event.pos())
 
+        if self._dragged_vertex:
+            curve, index = self._dragged_vertex
+            self.frame_scheduler.move_vertex(curve, index,
+                                             *curve.raster_object.scene_to_local(scene_pos.x(), scene_pos.y()))
+            return
+
+        if self.vectorization_mode and self.active_object and not self.dragging:
+            local_x, local_y = self.active_object.scene_to_local(scene_pos.x(), scene_pos.y())
+            hovered = self._pick_vertex(local_x, local_y, self.VERTEX_PICK_RADIUS / self.zoom) is not None
+            if hovered != self._vertex_hovered:
+                self._vertex_hovered = hovered
+                self.setCursor(Qt.PointingHandCursor if hovered else Qt.CrossCursor)
+
         if not self.mode_move and self.selection_mode:
             # Обновляем hovered объект только в режиме работы с растром и при включенном выделении
-            new_hovered = None
-            for obj in reversed(self.raster_objects):
-                if obj.contains_point(scene_pos):
-                    new_hovered = obj
-                    break
+            new_hovered = self.raster_index.hit_test(scene_pos)
 
             if new_hovered != self.hovered_object:
                 self.hovered_object = new_hovered
-                self.update()
+                self.frame_scheduler.request_frame()
 
         if self.dragging:
             delta = event.pos() - self.last_pos
             if self.mode_move:
-                self.pan += delta
+                self.frame_scheduler.pan_by(delta)
             else:
                 if self.active_object and self.selection_mode:  # Добавили проверку selection_mode
-                    self.active_object.position += QPointF(delta.x() / self.zoom, delta.y() / self.zoom)
+                    self.frame_scheduler.move_object(self.active_object, delta)
             self.last_pos = event.pos()
-            self.update()
 
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.LeftButton:
             self.dragging = False
+            if self._dragged_vertex:
+                self.frame_scheduler.flush()  # Последнее положение вершины ещё могло не дойти до кадра
+                self._dragged_vertex = None
+                self._notify_curves_changed()
+                self.update()
 
     def wheelEvent(self, event):
-        mouse_pos = event.pos()
-        scene_pos_before = QPointF(
-            (mouse_pos.x() - self.pan.x()) / self.zoom,
-            (mouse_pos.y() - self.pan.y()) / self.zoom
-        )
-
-        zoom_factor = 1.1
-        if event.angleDelta().y() > 0:
-            self.zoom *= zoom_factor
-        else:
-            self.zoom /= zoom_factor
-
-        scene_pos_after = QPointF(
-            (mouse_pos.x() - self.pan.x()) / self.zoom,
-            (mouse_pos.y() - self.pan.y()) / self.zoom
-        )
-
-        delta = scene_pos_after - scene_pos_before
-        self.pan += QPoint(int(delta.x() * self.zoom), int(delta.y() * self.zoom))
-        self.update()
+        steps = event.angleDelta().y() / 120  # Тачпады присылают доли щелчка
+        if steps:
+            # Точка под курсором остаётся на месте
+            self.frame_scheduler.zoom_at(event.pos(), self.WHEEL_ZOOM_FACTOR ** steps)
 
     def map_to_scene(self, widget_point):
         return QPointF(
@@ -776,6 +1336,14 @@ class GLWidget(QOpenGLWidget):
             (widget_point.y() - self.pan.y()) / self.zoom
         )
 
+    def screen_to_scene(self, points):
+        """Массив точек экрана (N, 2) -> координаты сцены"""
+        return (np.asarray(points, dtype=np.float64).reshape(-1, 2) - (self.pan.x(), self.pan.y())) / self.zoom
+
+    def scene_to_screen(self, points):
+        """Массив точек сцены (N, 2) -> пиксели экрана"""
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2) * self.zoom + (self.pan.x(), self.pan.y())
+
     def center_camera_on_raster(self):
         if not self.raster_objects:
             return
@@ -786,19 +1354,14 @@ class GLWidget(QOpenGLWidget):
 
         zoom_x = self.width() / img_w
         zoom_y = self.height() / img_h
-        self.zoom = min(zoom_x, zoom_y) * 0.95
+        zoom = min(zoom_x, zoom_y) * 0.95
 
         # Центр изображения в координатах сцены
         img_center = QPointF(img_w / 2, img_h / 2)
 
         # Центр окна в экранных координатах
-        widget_center = QPoint(self.width() // 2, self.height() // 2)
+        widget_center = QPointF(self.width() / 2, self.height() / 2)
 
         # Переводим сцену так, чтобы центр изображения оказался в центре окна
-        self.pan = widget_center - QPoint(
-            int(img_center.x() * self.zoom),
-            int(img_center.y() * self.zoom)
-        )
-
-        # print(f"[DEBUG] zoom={self.zoom:.4f}, pan={self.pan}")
-        self.update()
\ No newline at end of file
+        self.frame_scheduler.set_view(zoom, widget_center - img_center * zoom)
+        # print(f"[DEBUG] zoom={self.zoom:.4f}, pan={self.pan}")
\ No newline at end of file
@@ -1,32 +1,638 @@
-from PIL import Image
+# Загрузка изображения: потоковое чтение полосами строк (TIFF, PNG, BMP)
+
+import io
+import struct
+import zlib
+from abc import ABC, abstractmethod
+
 import numpy as np
+from PIL import Image, PngImagePlugin
+
+Image.MAX_IMAGE_PIXELS = None
+
+CHUNK_ROWS = 256  # Сколько строк исходника читается за один раз
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class _RowReader(ABC):
+    """Последовательное чтение строк исходного изображения порциями"""
+
+    def __init__(self, image, file_path):
+        self.image = image
+        self.file_path = file_path
+        self.width, self.height = image.size
+        self.next_row = 0
+
+    @abstractmethod
+    def read_chunk(self):
+        """Возвращает PIL-изображение из следующих строк (не меньше одной)"""
+
+    def close(self):
+        pass
+
+    def _with_palette(self, chunk):
+        palette = _palette(self.image)
+        if chunk.mode in ('P', 'PA') and palette:
+            chunk.putpalette(*palette)
+        return chunk
+
+
+class _FullRowReader(_RowReader):
+    """Запасной вариант: формат не читается по частям, декодируем целиком"""
+
+    def read_chunk(self):
+        if self.next_row == 0:
+            self.image.load()
+        rows = min(CHUNK_ROWS, self.height - self.next_row)
+        chunk = self.image.crop((0, self.next_row, self.width, self.next_row + rows))
+        self.next_row += rows
+        return chunk
+
+
+class _RawRowReader(_RowReader):
+    """Несжатые построчные данные (BMP и т.п.): строки читаются прямо из файла"""
+
+    @staticmethod
+    def supports(image):
+        if len(image.tile) != 1:
+            return False
+        codec, extents, _, args = image.tile[0]
+        return (codec == 'raw' and tuple(extents) == (0, 0) + image.size and
+                isinstance(args, tuple) and len(args) == 3 and args[1] > 0)
+
+    def __init__(self, image, file_path):
+        super().__init__(image, file_path)
+        _, _, self._offset, (self._rawmode, self._stride, self._orientation) = image.tile[0]
+        self._file = open(file_path, 'rb')
+
+    def read_chunk(self):
+        y0 = self.next_row
+        rows = min(CHUNK_ROWS, self.height - y0)
+        if self._orientation < 0:
+            # Строки BMP хранятся снизу вверх
+            self._file.seek(self._offset + (self.height - y0 - rows) * self._stride)
+        else:
+            self._file.seek(self._offset + y0 * self._stride)
+        data = self._file.read(rows * self._stride)
+        if len(data) < rows * self._stride:
+            raise ValueError("Файл изображения обрезан")
+
+        chunk = Image.frombuffer(self.image.mode, (self.width, rows), data, 'raw',
+                                 self._rawmode, self._stride, self._orientation)
+        self.next_row += rows
+        return self._with_palette(chunk)
+
+    def close(self):
+        self._file.close()
+
+
+class _TiffRowReader(_RowReader):
+    """TIFF по полосам (strips) или рядам плиток (tiles).
+
+    Несколько соседних блоков переупаковываются в маленький TIFF в памяти
+    и декодируются PIL/libtiff, поэтому сжатие (LZW, Deflate, CCITT G4 и т.д.)
+    поддерживается так же, как при обычном открытии файла.
+
+    Сжатый блок libtiff распаковывает только целиком, поэтому файл из одной
+    большой полосы (частый случай для LZW) всё равно декодируется за раз.
+    Исключение — Deflate: такую полосу распаковывает zlib порциями по
+    CHUNK_ROWS строк (предсказатель 2 снимается здесь же), и в TIFF
+    в памяти она попадает уже несжатой.
+    """
+    _DEFLATE = (8, 32946)  # Коды сжатия Deflate (Adobe и старый)
+    _READ_SIZE = 1 << 16  # Порция сжатых данных при потоковой распаковке
+    # Теги, которые переносятся в промежуточный TIFF: тег -> тип TIFF
+    _COPIED_TAGS = {
+        258: 3,  # BitsPerSample
+        259: 3,  # Compression
+        262: 3,  # PhotometricInterpretation
+        266: 3,  # FillOrder
+        277: 3,  # SamplesPerPixel
+        284: 3,  # PlanarConfiguration
+        292: 4,  # T4Options
+        293: 4,  # T6Options
+        317: 3,  # Predictor
+        320: 3,  # ColorMap
+        338: 3,  # ExtraSamples
+        339: 3,  # SampleFormat
+        347: 7,  # JPEGTables
+    }
+
+    @staticmethod
+    def supports(image):
+        if image.format != 'TIFF':
+            return False
+        tags = image.tag_v2
+        if tags.get(284, 1) != 1:
+            return False  # Раздельные плоскости каналов не поддерживаем
+        return 273 in tags or 324 in tags
+
+    def __init__(self, image, file_path):
+        super().__init__(image, file_path)
+        self._tags = image.tag_v2
+        self._file = open(file_path, 'rb')
+        self._tiled = 324 in self._tags
+        self._inflated_strips = self._inflatable_strips()
+        self._blocks = self._tiled_blocks() if self._tiled else self._strip_blocks()
+        self._block_index = 0
+        self._inflate = None  # Распаковка текущей полосы Deflate: [полоса, zlib, непрочитанные байты]
+
+    def _inflatable_strips(self):
+        """Полосы Deflate выше CHUNK_ROWS строк распаковываются потоком, если предсказатель это позволяет"""
+        tags = self._tags
+        if self._tiled or tags.get(259, 1) not in self._DEFLATE:
+            return False
+        if min(tags.get(278, self.height), self.height) <= CHUNK_ROWS:
+            return False  # Полосы и так маленькие
+        predictor = tags.get(317, 1)
+        return predictor == 1 or (predictor == 2 and set(_as_tuple(tags.get(258, (1,)))) == {8})
+
+    def _strip_blocks(self):
+        """Блоки (первая строка, число строк, [(смещение, длина), ...])"""
+        tags = self._tags
+        offsets = _as_tuple(tags[273])
+        byte_counts = _as_tuple(tags[279])
+        rows_per_strip = min(tags.get(278, self.height), self.height)
+
+        if self._inflated_strips:
+            # Части полосы: вместо сжатых блоков — (номер полосы, смещение, длина)
+            blocks = []
+            for i, (offset, count) in enumerate(zip(offsets, byte_counts)):
+                strip_row0 = i * rows_per_strip
+                strip_rows = min(rows_per_strip, self.height - strip_row0)
+                for k in range(0, strip_rows, CHUNK_ROWS):
+                    blocks.append((strip_row0 + k, min(CHUNK_ROWS, strip_rows - k), (i, offset, count)))
+            return blocks
+
+        if tags.get(259, 1) != 1:
+            blocks = []
+            for i, (offset, count) in enumerate(zip(offsets, byte_counts)):
+                row0 = i * rows_per_strip
+                blocks.append((row0, min(rows_per_strip, self.height - row0), [(offset, count)]))
+            return blocks
+
+        # Без сжатия полосу можно резать на части произвольной высоты
+        bits = sum(_as_tuple(tags.get(258, (1,))))
+        row_bytes = (self.width * bits + 7) // 8
+        blocks = []
+        for i, offset in enumerate(offsets):
+            strip_row0 = i * rows_per_strip
+            strip_rows = min(rows_per_strip, self.height - strip_row0)
+            for k in range(0, strip_rows, CHUNK_ROWS):
+                rows = min(CHUNK_ROWS, strip_rows - k)
+                blocks.append((strip_row0 + k, rows, [(offset + k * row_bytes, rows * row_bytes)]))
+        return blocks
+
+    def _tiled_blocks(self):
+        tags = self._tags
+        offsets = _as_tuple(tags[324])
+        byte_counts = _as_tuple(tags[325])
+        tile_height = tags[323]
+        tiles_across = (self.width + tags[322] - 1) // tags[322]
+        blocks = []
+        for row_index, row0 in enumerate(range(0, self.height, tile_height)):
+            first = row_index * tiles_across
+            parts = list(zip(offsets[first:first + tiles_across], byte_counts[first:first + tiles_across]))
+            blocks.append((row0, min(tile_height, self.height - row0), parts))
+        return blocks
+
+    def read_chunk(self):
+        if self._inflated_strips:
+            return self._read_inflated_chunk()
+
+        # Набираем блоки одинаковой высоты, пока не наберётся CHUNK_ROWS строк
+        first = self._block_index
+        block_rows = self._blocks[first][1]
+        rows = 0
+        parts = []
+        while self._block_index < len(self._blocks):
+            row0, block_rows_i, block_parts = self._blocks[self._block_index]
+            if parts and (rows >= CHUNK_ROWS or block_rows_i > block_rows):
+                break
+            parts.extend(block_parts)
+            rows += block_rows_i
+            self._block_index += 1
+            if block_rows_i < block_rows:
+                break  # Последний, укороченный блок
+
+        data = []
+        for offset, count in parts:
+            self._file.seek(offset)
+            data.append(self._file.read(count))
+
+        chunk = Image.open(io.BytesIO(self._build_tiff(rows, block_rows, data)))
+        chunk.load()
+        self.next_row += rows
+        return self._with_palette(chunk)
+
+    def _read_inflated_chunk(self):
+        """Следующие строки полосы Deflate: распаковка ровно нужного объёма"""
+        row0, rows, (strip, offset, count) = self._blocks[self._block_index]
+        self._block_index += 1
+        if self._inflate is None or self._inflate[0] != strip:
+            self._file.seek(offset)
+            self._inflate = [strip, zlib.decompressobj(), count]
+
+        samples = len(_as_tuple(self._tags.get(258, (1,))))
+        row_bytes = (self.width * sum(_as_tuple(self._tags.get(258, (1,)))) + 7) // 8
+        needed = rows * row_bytes
+        _, inflate, left = self._inflate
+        data = bytearray()
+        while len(data) < needed:
+            compressed = inflate.unconsumed_tail
+            if not compressed:
+                if not left:
+                    raise ValueError("Файл изображения обрезан")
+                compressed = self._file.read(min(self._READ_SIZE, left))
+                if not compressed:
+                    raise ValueError("Файл изображения обрезан")
+                left -= len(compressed)
+            data += inflate.decompress(compressed, needed - len(data))
+        self._inflate[2] = left
+
+        if self._tags.get(317, 1) == 2:
+            # Горизонтальное предсказание: в строке хранятся разности соседних отсчётов канала
+            pixels = np.frombuffer(data, dtype=np.uint8).reshape(rows, self.width, samples)
+            data = np.cumsum(pixels, axis=1, dtype=np.uint8).tobytes()
+
+        chunk = Image.open(io.BytesIO(self._build_tiff(rows, rows, [bytes(data)], {259: 1, 317: 1})))
+        chunk.load()
+        self.next_row += rows
+        return self._with_palette(chunk)
+
+    def _build_tiff(self, rows, block_rows, data, overrides=None):
+        """Собирает минимальный TIFF из уже сжатых блоков исходного файла.
+
+        overrides — значения тегов вместо исходных (например, для уже распакованных строк).
+        """
+        uncompressed_strips = not self._tiled and self._tags.get(259, 1) == 1
+        if uncompressed_strips:
+            data = [b''.join(data)]
+            block_rows = rows
+
+        entries = {256: (4, (self.width,)), 257: (4, (rows,))}
+        for tag, tag_type in self._COPIED_TAGS.items():
+            value = (overrides or {}).get(tag, self._tags.get(tag))
+            if value is not None:
+                entries[tag] = (tag_type, value if tag_type == 7 else _as_tuple(value))
+
+        if self._tiled:
+            entries[322] = (4, (self._tags[322],))
+            entries[323] = (4, (self._tags[323],))
+            offsets_tag, counts_tag = 324, 325
+        else:
+            entries[278] = (4, (block_rows,))
+            offsets_tag, counts_tag = 273, 279
+        entries[offsets_tag] = (4, (0,) * len(data))
+        entries[counts_tag] = (4, tuple(len(d) for d in data))
+
+        # Раскладка: заголовок, IFD, внешние значения тегов, данные блоков
+        ifd_offset = 8
+        extra_offset = ifd_offset + 2 + 12 * len(entries) + 4
+        encoded = {}
+        for tag in sorted(entries):
+            tag_type, value = entries[tag]
+            if tag_type == 7:
+                payload = bytes(value)
+                count = len(payload)
+            else:
+                payload = struct.pack('<%d%s' % (len(value), 'H' if tag_type == 3 else 'I'), *value)
+                count = len(value)
+            encoded[tag] = (tag_type, count, payload)
+
+        # Размер внешних значений не зависит от смещений блоков, их можно посчитать заранее
+        extra_size = sum(len(p) + len(p) % 2 for _, _, p in encoded.values() if len(p) > 4)
+        data_offset = extra_offset + extra_size
+        block_offsets = []
+        for d in data:
+            block_offsets.append(data_offset)
+            data_offset += len(d)
+        encoded[offsets_tag] = (4, len(block_offsets), struct.pack('<%dI' % len(block_offsets), *block_offsets))
+
+        ifd = struct.pack('<H', len(encoded))
+        extra = b''
+        for tag in sorted(encoded):
+            tag_type, count, payload = encoded[tag]
+            if len(payload) > 4:
+                ifd += struct.pack('<HHII', tag, tag_type, count, extra_offset + len(extra))
+                extra += payload + b'\x00' * (len(payload) % 2)
+            else:
+                ifd += struct.pack('<HHI', tag, tag_type, count) + payload.ljust(4, b'\x00')
+        ifd += struct.pack('<I', 0)
+
+        return b'II*\x00' + struct.pack('<I', ifd_offset) + ifd + extra + b''.join(data)
+
+    def close(self):
+        self._file.close()
+
+
+class _PngRowReader(_RowReader):
+    """PNG без чередования: поток IDAT распаковывается по мере чтения строк.
+
+    Фильтры строк снимает сам PIL: отфильтрованные строки вместе с предыдущей
+    готовой строкой упаковываются в маленький несжатый PNG того же размера пикселя.
+    """
+    # Байт на пиксель -> тип цвета промежуточного 8-битного PNG
+    _UNFILTER_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+    _CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+    @staticmethod
+    def supports(image):
+        if image.format != 'PNG' or image.info.get('interlace'):
+            return False
+        bit_depth, color_type = _PngRowReader._read_header(image.fp)
+        bpp = max(1, _PngRowReader._CHANNELS.get(color_type, 0) * bit_depth // 8)
+        return bpp in _PngRowReader._UNFILTER_COLOR_TYPES and (bit_depth, color_type) in PngImagePlugin._MODES
+
+    @staticmethod
+    def _read_header(fp):
+        position = fp.tell()
+        fp.seek(len(_PNG_SIGNATURE) + 8)
+        _, _, bit_depth, color_type = struct.unpack('>IIBB', fp.read(10))
+        fp.seek(position)
+        return bit_depth, color_type
+
+    def __init__(self, image, file_path):
+        super().__init__(image, file_path)
+        self._file = open(file_path, 'rb')
+        self._bit_depth, self._color_type = self._read_header(self._file)
+        self._mode, self._rawmode = PngImagePlugin._MODES[(self._bit_depth, self._color_type)]
+        self._bpp = max(1, self._CHANNELS[self._color_type] * self._bit_depth // 8)
+        self._row_bytes = (self.width * self._CHANNELS[self._color_type] * self._bit_depth + 7) // 8
+
+        self._palette = None
+        self._transparency = None
+        self._file.seek(len(_PNG_SIGNATURE))
+        self._idat_left = 0  # Непрочитанные байты текущего блока IDAT
+        self._idat_seen = False
+        self._idat_done = False
+        self._inflate = zlib.decompressobj()
+        self._filtered = bytearray()
+        self._prev_row = None
+
+    def _next_idat_data(self):
+        while not self._idat_done:
+            if self._idat_left:
+                data = self._file.read(min(self._idat_left, 1 << 20))
+                self._idat_left -= len(data)
+                if not self._idat_left:
+                    self._file.read(4)  # CRC
+                return data
+
+            length, chunk_type = struct.unpack('>I4s', self._file.read(8))
+            if chunk_type == b'IDAT':
+                self._idat_left = length
+                self._idat_seen = True
+                continue
+            if chunk_type == b'IEND' or self._idat_seen:
+                self._idat_done = True  # Данные изображения закончились
+                break
+            body = self._file.read(length)
+            self._file.read(4)  # CRC
+            if chunk_type == b'PLTE':
+                self._palette = body
+            elif chunk_type == b'tRNS':
+                self._transparency = body
+        return b''
+
+    def read_chunk(self):
+        rows = min(CHUNK_ROWS, self.height - self.next_row)
+        need = rows * (self._row_bytes + 1)
+        while len(self._filtered) < need:
+            data = self._inflate.unconsumed_tail or self._next_idat_data()
+            if not data:
+                raise ValueError("Файл PNG обрезан")
+            # Ограничиваем распаковку: белые листы сжимаются в сотни раз
+            self._filtered += self._inflate.decompress(data, need - len(self._filtered))
+
+        filtered = bytes(self._filtered[:need])
+        del self._filtered[:need]
+        raw = self._unfilter(filtered, rows)
+
+        chunk = Image.frombuffer(self._mode, (self.width, rows), raw, 'raw', self._rawmode, 0, 1)
+        if self._palette:
+            chunk.putpalette(self._palette)
+        if self._transparency:
+            if self._color_type == 3:
+                chunk.info['transparency'] = self._transparency
+            elif self._color_type == 0:
+                chunk.info['transparency'] = struct.unpack('>H', self._transparency[:2])[0]
+            elif self._color_type == 2:
+                chunk.info['transparency'] = struct.unpack('>3H', self._transparency[:6])
+        self.next_row += rows
+        return chunk
+
+    def _unfilter(self, filtered, rows):
+        payload = filtered
+        if self._prev_row is not None:
+            # Предыдущая строка нужна фильтрам Up/Average/Paeth первой строки
+            payload = b'\x00' + self._prev_row + filtered
+            rows += 1
+
+        header = struct.pack('>IIBBBBB', self._row_bytes // self._bpp, rows, 8,
+                             self._UNFILTER_COLOR_TYPES[self._bpp], 0, 0, 0)
+        png = (_PNG_SIGNATURE + _png_chunk(b'IHDR', header) +
+               _png_chunk(b'IDAT', zlib.compress(payload, 0)) + _png_chunk(b'IEND', b''))
+        raw = Image.open(io.BytesIO(png)).tobytes()
+
+        if self._prev_row is not None:
+            raw = raw[self._row_bytes:]
+        self._prev_row = raw[-self._row_bytes:]
+        return raw
+
+    def close(self):
+        self._file.close()
+
+
+class _RowWindow:
+    """Скользящее окно строк: выдаёт произвольные диапазоны, читая исходник только вперёд"""
+
+    def __init__(self, reader, mode):
+        self._reader = reader
+        self._mode = mode
+        self._chunks = []  # (первая строка, массив строк)
+        self._bottom = 0
+
+    def rows(self, y0, y1):
+        self._chunks = [(top, data) for top, data in self._chunks if top + len(data) > y0]
+        while self._bottom < y1:
+            chunk = self._reader.read_chunk()
+            if self._mode == 'L' and chunk.mode.startswith('I;16'):
+                data = (np.asarray(chunk) >> 8).astype(np.uint8)  # 16 бит -> 8 бит без обрезки
+            else:
+                data = np.asarray(chunk.convert(self._mode))
+            self._chunks.append((self._bottom, data))
+            self._bottom += len(data)
+
+        parts = [data[max(0, y0 - top):y1 - top] for top, data in self._chunks if top < y1]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
 
 class ImageLoader:
     def __init__(self):
         self.image_data = None
         self.width = 0
         self.height = 0
-        self.dpi = (600, 600)  # Значение по умолчанию
-        Image.MAX_IMAGE_PIXELS = None
+        self.dpi = (72, 72)  # Разрешение исходника; 72, если в файле оно не задано
+        self.pixel_format = 'RGBA'  # 'L' — оттенки серого, '1' — битовый (8 пикселей в байте)
+        # Строки несжатого исходника прямо из файла (numpy.memmap) и параметры map_raw_rows для них
+        self.pixel_map = None
+        self.pixel_map_layout = None
+        self._reader = None
 
-    def load(self, file_path, target_dpi=600):
+    def open(self, file_path):
+        """Читает только заголовок: размеры и разрешение. Пиксели выдаёт iter_bands"""
         try:
+            self.close()
+            self.pixel_map = self.pixel_map_layout = None
             image = Image.open(file_path)
-            original_dpi = image.info.get('dpi', (72, 72))
-
-            # Масштабирование до target_dpi
-            if original_dpi[0] != target_dpi:
-                scale_factor = target_dpi / original_dpi[0]
-                new_size = (
-                    int(image.width * scale_factor),
-                    int(image.height * scale_factor)
-                )
-                image = image.resize(new_size, Image.LANCZOS)
-
-            self.dpi = (target_dpi, target_dpi)
-            image = image.convert("RGBA")
+            dpi = image.info.get('dpi', (72, 72))
+
             self.width, self.height = image.size
-            self.image_data = np.array(image, dtype=np.uint8)
+            # PNG хранит разрешение в точках на метр: 600 DPI читается как 599.9988
+            self.dpi = (round(float(dpi[0]), 1) or 72.0, round(float(dpi[1]), 1) or 72.0)
+            self.pixel_format = _pixel_format(image)
+            self._reader = _create_row_reader(image, file_path)
+
+            # Несжатые BMP и TIFF не декодируются: строки берутся из отображённого файла
+            self.pixel_map_layout = _raw_layout(image, file_path)
+            if self.pixel_map_layout:
+                try:
+                    self.pixel_map = map_raw_rows(**self.pixel_map_layout)
+                except (OSError, ValueError):
+                    self.pixel_map = self.pixel_map_layout = None  # Например, файл обрезан
 
         except Exception as e:
-            raise ValueError(f"Ошибка загрузки изображения: {str(e)}")
\ No newline at end of file
+            raise ValueError(f"Ошибка загрузки изображения: {str(e)}")
+
+    def iter_bands(self, band_height):
+        """Выдаёт (y, массив) полосами по band_height строк в формате pixel_format:
+        (h, w, 4) для RGBA, (h, w) для L и (h, ceil(w / 8)) упакованных битов для '1'.
+
+        В памяти одновременно находится только окно исходных строк под текущую
+        полосу. Если есть pixel_map, полосы — её срезы без копирования.
+        """
+        window = _RowWindow(self._reader, self.pixel_format)
+        try:
+            if self.pixel_map is not None:
+                for y in range(0, self.height, band_height):
+                    yield y, self.pixel_map[y:y + band_height]
+                return
+            for y in range(0, self.height, band_height):
+                band = window.rows(y, min(y + band_height, self.height))
+                if self.pixel_format == '1':
+                    band = np.packbits(band, axis=1)
+                yield y, band
+        finally:
+            self.close()
+
+    def load(self, file_path):
+        """Читает изображение целиком.
+
+        Для несжатых BMP и TIFF image_data — отображённый в память файл (pixel_map).
+        """
+        self.image_data = None
+        self.open(file_path)
+        if self.pixel_map is not None:
+            self.image_data = self.pixel_map
+            self.close()
+            return
+        try:
+            for y, band in self.iter_bands(CHUNK_ROWS):
+                if self.image_data is None:
+                    self.image_data = np.empty((self.height,) + band.shape[1:], dtype=np.uint8)
+                self.image_data[y:y + len(band)] = band
+        except Exception as e:
+            raise ValueError(f"Ошибка загрузки изображения: {str(e)}")
+
+    def close(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+
+
+def map_raw_rows(file_path, offset, stride, height, row_bytes, orientation):
+    """Строки несжатого растра как numpy.memmap, строки сверху вниз.
+
+    stride — шаг строк в файле (с выравниванием), row_bytes — полезные байты строки.
+    При orientation < 0 строки хранятся снизу вверх (BMP), и массив
+    разворачивается отрицательным шагом, без копирования.
+    """
+    rows = np.memmap(file_path, dtype=np.uint8, mode='r', offset=offset, shape=(height, stride))
+    rows = rows[:, :row_bytes]
+    return rows[::-1] if orientation < 0 else rows
+
+
+def _create_row_reader(image, file_path):
+    for reader_class in (_TiffRowReader, _PngRowReader, _RawRowReader):
+        if reader_class.supports(image):
+            return reader_class(image, file_path)
+    return _FullRowReader(image, file_path)
+
+
+def _raw_layout(image, file_path):
+    """Параметры map_raw_rows, если пиксели лежат в файле готовым массивом, иначе None.
+
+    Подходят несжатые серые (8 бит) и битовые растры, у которых байты файла
+    совпадают с pixel_format: для '1' это старший бит первым и 1 — белый.
+    Блоки (полосы TIFF) должны идти в файле подряд, без промежутков.
+    """
+    if image.mode not in ('L', '1') or not image.tile:
+        return None
+    width, height = image.size
+    row_bytes = width if image.mode == 'L' else (width + 7) // 8
+
+    tiles = sorted(image.tile, key=lambda tile: tile[1][1])
+    _, _, first_offset, first_args = tiles[0]
+    if not isinstance(first_args, tuple) or len(first_args) != 3:
+        return None
+    stride = first_args[1] or row_bytes
+    orientation = first_args[2]
+    if stride < row_bytes or (orientation < 0 and len(tiles) > 1):
+        return None
+
+    next_row = 0
+    for codec, extents, offset, args in tiles:
+        if (codec != 'raw' or args != (image.mode, first_args[1], orientation) or
+                extents[0] != 0 or extents[2] != width or extents[1] != next_row or
+                offset != first_offset + extents[1] * stride):
+            return None
+        next_row = extents[3]
+    if next_row < height:
+        return None
+
+    return {'file_path': file_path, 'offset': first_offset, 'stride': stride,
+            'height': height, 'row_bytes': row_bytes, 'orientation': orientation}
+
+
+def _pixel_format(image):
+    """Формат хранения: сканы сейсмограмм почти всегда серые или битовые"""
+    if image.mode == '1':
+        return '1'
+    if image.mode in ('L', 'I', 'F') or image.mode.startswith('I;'):
+        return 'L'
+    if image.mode == 'P' and _palette(image):
+        # getpalette() у исходника декодировал бы всё изображение, поэтому разбираем палитру отдельно
+        probe = Image.new('P', (1, 1))
+        probe.putpalette(*_palette(image))
+        palette = np.array(probe.getpalette(), dtype=np.uint8).reshape(-1, 3)
+        if (palette == palette[:, :1]).all():
+            return 'L'
+    return 'RGBA'
+
+
+def _palette(image):
+    """(данные, rawmode) палитры без декодирования пикселей"""
+    if image.palette is None:
+        return None
+    return bytes(image.palette.palette), image.palette.rawmode or image.palette.mode
+
+
+def _as_tuple(value):
+    return value if isinstance(value, tuple) else (value,)
+
+
+def _png_chunk(chunk_type, body):
+    return struct.pack('>I', len(body)) + chunk_type + body + \
+        struct.pack('>I', zlib.crc32(chunk_type + body) & 0xffffffff)
@@ -0,0 +1,212 @@
+# Фоновая загрузка изображения (декодирование и нарезка на тайлы вне GUI-потока)
+
+import threading
+import time
+from collections import deque
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from image_loader import ImageLoader
+from tile_cache import LevelArrays
+from tile_manager import PyramidBuilder, level_format, texture_pixels, tile_slice
+
+
+class _LoadCancelled(Exception):
+    pass
+
+
+class TileLoadWorker(QObject):
+    """Декодирует изображение и готовит тайлы в рабочем потоке.
+
+    Готовые тайлы складываются в очередь tile_queue, откуда GUI-поток
+    забирает их небольшими порциями и загружает в текстуры. С фоновой загрузкой
+    (use_background_upload) текстуры создаются здесь же в разделяемом контексте,
+    и GUI-потоку остаётся только принять их после барьера.
+    """
+    finished = pyqtSignal()
+
+    MAX_QUEUED_TILES = 8  # Сколько тайлов может ждать загрузки в OpenGL
+
+    def __init__(self, file_path, tile_size=1024, tile_cache=None):
+        super().__init__()
+        self.file_path = file_path
+        self.tile_size = tile_size
+        self.tile_cache = tile_cache  # TileCache или None
+
+        # (x, y, ширина, высота, данные тайла, уровень пирамиды, текстура или None),
+        # где текстура — (id, строки снизу вверх, барьер) из SharedContextUploader
+        self.tile_queue = deque()
+        self.width = 0
+        self.height = 0
+        self.dpi = (72, 72)
+        self.pixel_format = 'RGBA'
+        # Массивы уровней пирамиды на диске (исходник или кэш), None — уровень есть только в тайлах.
+        # Заполняется до первого тайла в очереди
+        self.level_sources = []
+        self.total_tiles = 0
+        self.done = False  # Рабочий поток закончил подготовку тайлов
+        self.error = None  # Текст ошибки, если загрузка не удалась
+        # Длительность этапов в секундах (этап тайлов включает ожидание GUI-потока при полной очереди)
+        self.stage_times = {}
+
+        self._cancel_event = threading.Event()
+        self._uploader = None  # SharedContextUploader
+        self._texture_manager = None
+
+    def use_background_upload(self, uploader, texture_manager):
+        """Загружать текстуры в рабочем потоке (до запуска; texture_manager — для оценки лимита)"""
+        self._uploader = uploader
+        self._texture_manager = texture_manager
+
+    def cancel(self):
+        """Просит рабочий поток остановиться.
+
+        Без фоновой загрузки очередь сразу сбрасывается; с ней в очереди лежат
+        текстуры, и удалить их должен владелец, у которого есть контекст OpenGL.
+        """
+        self._cancel_event.set()
+        if self._uploader is None:
+            self.tile_queue.clear()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def run(self):
+        cache_writer = None
+        uploading = False
+        try:
+            if self._uploader:
+                self._uploader.begin()
+                uploading = True
+
+            # При попадании в кэш исходник не декодируется вовсе
+            stage_start = time.perf_counter()
+            entry = self.tile_cache.lookup(self.file_path, self.tile_size) if self.tile_cache else None
+            stage_start = self._end_stage("cache_lookup", stage_start)
+            if entry is not None:
+                self._load_from_cache(entry)
+                self._end_stage("cache_tiles", stage_start)
+                return
+
+            # Читаем только заголовок; пиксели приходят полосами высотой в ряд тайлов
+            loader = ImageLoader()
+            loader.open(self.file_path)
+            stage_start = self._end_stage("open", stage_start)
+
+            self.width, self.height = loader.width, loader.height
+            self.dpi = loader.dpi
+            self.pixel_format = loader.pixel_format
+
+            # Тайлы всех уровней пирамиды строятся по ходу чтения полос
+            builder = PyramidBuilder(self.width, self.height, self.tile_size,
+                                     self.pixel_format, self._queue_tile)
+            self.total_tiles = builder.total_tiles
+
+            # Без кэша уровни пишутся во временные файлы: копии всех тайлов в памяти не держатся
+            cache_writer = self._create_cache_writer(builder.level_sizes, loader.pixel_map_layout)
+            level_arrays = cache_writer or self._create_level_arrays(builder.level_sizes,
+                                                                     loader.pixel_map is not None)
+            if level_arrays:
+                def emit_and_store(*tile):
+                    level_arrays.write_tile(*tile)
+                    self._queue_tile(*tile)
+                builder.emit_tile = emit_and_store
+
+            # Тайл сначала попадает на диск, поэтому GUI-поток может перечитать его оттуда
+            self.level_sources = [level_arrays.level_array(level) if level_arrays else None
+                                  for level in range(len(builder.level_sizes))]
+            if loader.pixel_map is not None:
+                self.level_sources[0] = loader.pixel_map
+
+            for y, band in loader.iter_bands(self.tile_size):
+                builder.add_band(band)
+            stage_start = self._end_stage("decode_tiles", stage_start)
+
+            if cache_writer:
+                # Каталог записи остаётся на месте, поэтому level_sources после публикации действительны;
+                # неудачная запись удаляется в finally
+                if cache_writer.commit() is not None:
+                    cache_writer = None
+                self._end_stage("cache_commit", stage_start)
+
+        except _LoadCancelled:
+            pass
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            if cache_writer:
+                cache_writer.discard()
+            if uploading:
+                self._uploader.end()
+            self.done = True
+            self.finished.emit()
+
+    def _end_stage(self, name, start):
+        """Запоминает длительность этапа и возвращает начало следующего"""
+        now = time.perf_counter()
+        self.stage_times[name] = now - start
+        return now
+
+    def _load_from_cache(self, entry):
+        self.width, self.height = entry.width, entry.height
+        self.dpi = entry.dpi
+        self.pixel_format = entry.pixel_format
+        self.level_sources = [entry.level_array(level) for level in range(len(entry.level_sizes))]
+        ts = self.tile_size
+        self.total_tiles = sum(((w + ts - 1) // ts) * ((h + ts - 1) // ts) for w, h in entry.level_sizes)
+
+        for level, (level_width, level_height) in enumerate(entry.level_sizes):
+            for y in range(0, level_height, ts):
+                for x in range(0, level_width, ts):
+                    tile_width = min(ts, level_width - x)
+                    tile_height = min(ts, level_height - y)
+                    # Данные не копируются: GUI-поток прочитает из level_sources только нужные тайлы
+                    self._queue_tile(x, y, tile_width, tile_height, None, level)
+
+    def _create_cache_writer(self, level_sizes, source_layout=None):
+        if not self.tile_cache:
+            return None
+        try:
+            return self.tile_cache.create(self.file_path, self.tile_size, self.width, self.height,
+                                          self.dpi, self.pixel_format, level_sizes, source_layout)
+        except OSError as e:
+            # Без кэша загрузка всё равно должна пройти
+            print(f"Кэш тайлов недоступен: {str(e)}")
+            return None
+
+    def _create_level_arrays(self, level_sizes, skip_level_0):
+        try:
+            return LevelArrays(self.pixel_format, level_sizes, skip_level_0)
+        except OSError as e:
+            # Тогда тайлы остаются в памяти (Tile.pixels)
+            print(f"Временные файлы тайлов недоступны: {str(e)}")
+            return None
+
+    def _queue_tile(self, x, y, tile_width, tile_height, tile_data, level):
+        if not self._wait_for_queue():
+            raise _LoadCancelled()
+        texture = self._upload(x, y, tile_width, tile_height, tile_data, level) if self._uploader else None
+        if self.is_cancelled():
+            if texture:
+                self._uploader.discard(texture)
+            raise _LoadCancelled()
+        self.tile_queue.append((x, y, tile_width, tile_height, tile_data, level, texture))
+
+    def _upload(self, x, y, tile_width, tile_height, tile_data, level):
+        """Текстура тайла в разделяемом контексте или None, если видеопамять, скорее всего, занята"""
+        pixel_format = level_format(self.pixel_format, level)
+        size = self.tile_size * self.tile_size * (4 if pixel_format == 'RGBA' else 1)  # Слой страницы
+        # Лимит читается без блокировки: это лишь оценка, точно его проверит GUI-поток
+        if not self._texture_manager.fits(size):
+            return None
+        if tile_data is None:
+            tile_data = tile_slice(self.level_sources[level], pixel_format, x, y, tile_width, tile_height)
+        pixels, texture_format = texture_pixels(tile_data, pixel_format, tile_width)
+        return self._uploader.upload(pixels, texture_format)
+
+    def _wait_for_queue(self):
+        """Ждёт, пока GUI-поток разберёт очередь; False — загрузка отменена"""
+        while len(self.tile_queue) >= self.MAX_QUEUED_TILES:
+            if self._cancel_event.wait(0.005):
+                return False
+        return not self.is_cancelled()
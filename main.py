@@ -1,10 +1,17 @@
 # Запуск приложения
 
 import sys
+from PyQt5.QtGui import QSurfaceFormat
 from PyQt5.QtWidgets import QApplication
 from main_window import MainWindow
 
 if __name__ == "__main__":
+    # Сцена рисуется шейдерами: нужен контекст OpenGL 3.3 core (задаётся до создания QApplication)
+    surface_format = QSurfaceFormat()
+    surface_format.setVersion(3, 3)
+    surface_format.setProfile(QSurfaceFormat.CoreProfile)
+    QSurfaceFormat.setDefaultFormat(surface_format)
+
     app = QApplication(sys.argv)
     window = MainWindow()
 
@@ -5,7 +5,7 @@ from PyQt5.QtCore import Qt, QTimer, QPointF, QPoint
 from PyQt5.QtGui import QPixmap, QColor, QIcon
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QHBoxLayout, QVBoxLayout,
                              QPushButton, QFileDialog, QProgressDialog,
-                             QMessageBox, QApplication, QLabel, QFrame, QDialog,
+                             QMessageBox, QLabel, QFrame, QDialog,
                              QDialogButtonBox, QDoubleSpinBox, QCheckBox, QFormLayout, QGroupBox, QActionGroup, QAction)
 from PyQt5.QtXml import QDomDocument
 
@@ -132,6 +132,111 @@ class ScaleSettingsDialog(QDialog):
         super().accept()
 
 
+class DisplaySettingsDialog(QDialog):
+    """Коррекция изображения растра; изменения сразу видны на экране, отмена их возвращает"""
+    def __init__(self, display_settings, gl_widget, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Коррекция изображения")
+        self.display_settings = display_settings
+        self.gl_widget = gl_widget
+        self._initial = dict(vars(display_settings))
+
+        layout = QVBoxLayout()
+
+        # Уровни и гамма
+        levels_group = QGroupBox("Яркость")
+        levels_layout = QFormLayout()
+
+        self.black_level = QDoubleSpinBox()
+        self.black_level.setRange(0.0, 0.99)
+        self.black_level.setSingleStep(0.01)
+        self.black_level.setValue(display_settings.black_level)
+        levels_layout.addRow("Уровень чёрного (0–1):", self.black_level)
+
+        self.white_level = QDoubleSpinBox()
+        self.white_level.setRange(0.01, 1.0)
+        self.white_level.setSingleStep(0.01)
+        self.white_level.setValue(display_settings.white_level)
+        levels_layout.addRow("Уровень белого (0–1):", self.white_level)
+
+        self.gamma = QDoubleSpinBox()
+        self.gamma.setRange(0.1, 10.0)
+        self.gamma.setSingleStep(0.1)
+        self.gamma.setValue(display_settings.gamma)
+        levels_layout.addRow("Гамма:", self.gamma)
+
+        self.invert = QCheckBox()
+        self.invert.setChecked(display_settings.invert)
+        levels_layout.addRow("Негатив:", self.invert)
+
+        levels_group.setLayout(levels_layout)
+        layout.addWidget(levels_group)
+
+        # Локальный контраст
+        sharpen_group = QGroupBox("Локальный контраст (нерезкое маскирование)")
+        sharpen_layout = QFormLayout()
+
+        self.sharpen_amount = QDoubleSpinBox()
+        self.sharpen_amount.setRange(0.0, 10.0)
+        self.sharpen_amount.setSingleStep(0.1)
+        self.sharpen_amount.setValue(display_settings.sharpen_amount)
+        sharpen_layout.addRow("Сила (0 — выключено):", self.sharpen_amount)
+
+        self.sharpen_radius = QDoubleSpinBox()
+        self.sharpen_radius.setRange(0.5, 16.0)
+        self.sharpen_radius.setSingleStep(0.5)
+        self.sharpen_radius.setValue(display_settings.sharpen_radius)
+        sharpen_layout.addRow("Радиус (пикс.):", self.sharpen_radius)
+
+        sharpen_group.setLayout(sharpen_layout)
+        layout.addWidget(sharpen_group)
+
+        # Кнопки
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel | QDialogButtonBox.Reset)
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+        self.buttonBox.button(QDialogButtonBox.Reset).clicked.connect(self.reset_values)
+        layout.addWidget(self.buttonBox)
+
+        self.setLayout(layout)
+
+        # Предпросмотр: меняются только uniform-переменные шейдера
+        for spin in (self.black_level, self.white_level, self.gamma, self.sharpen_amount, self.sharpen_radius):
+            spin.valueChanged.connect(self.apply_values)
+        self.invert.toggled.connect(self.apply_values)
+
+    def apply_values(self):
+        black, white = self.black_level.value(), self.white_level.value()
+        valid = white > black
+        self.buttonBox.button(QDialogButtonBox.Ok).setEnabled(valid)
+        self.white_level.setStyleSheet("" if valid else "background-color: #ffdddd;")
+        if not valid:
+            return
+
+        self.display_settings.black_level = black
+        self.display_settings.white_level = white
+        self.display_settings.gamma = self.gamma.value()
+        self.display_settings.invert = self.invert.isChecked()
+        self.display_settings.sharpen_amount = self.sharpen_amount.value()
+        self.display_settings.sharpen_radius = self.sharpen_radius.value()
+        self.gl_widget.update()
+
+    def reset_values(self):
+        """Исходное изображение без коррекции"""
+        self.black_level.setValue(0.0)
+        self.white_level.setValue(1.0)
+        self.gamma.setValue(1.0)
+        self.invert.setChecked(False)
+        self.sharpen_amount.setValue(0.0)
+        self.sharpen_radius.setValue(2.0)
+
+    def reject(self):
+        """Отмена возвращает настройки, бывшие до открытия диалога"""
+        vars(self.display_settings).update(self._initial)
+        self.gl_widget.update()
+        super().reject()
+
+
 class ProjectManager:
     @staticmethod
     def save_project(gl_widget, file_path):
@@ -168,6 +273,8 @@ class ProjectManager:
             raster.setAttribute("width", str(obj.size.width()))
             raster.setAttribute("height", str(obj.size.height()))
             raster.setAttribute("rotation", str(obj.rotation_angle))
+            raster.setAttribute("dpi_x", str(obj.dpi[0]))
+            raster.setAttribute("dpi_y", str(obj.dpi[1]))
 
             # Настройки шкалы
             scale = doc.createElement("scale_settings")
@@ -181,6 +288,16 @@ class ProjectManager:
             scale.setAttribute("amplitude_step", str(obj.scale_settings.amplitude_step))
             raster.appendChild(scale)
 
+            # Коррекция изображения
+            display = doc.createElement("display_settings")
+            display.setAttribute("black_level", str(obj.display_settings.black_level))
+            display.setAttribute("white_level", str(obj.display_settings.white_level))
+            display.setAttribute("gamma", str(obj.display_settings.gamma))
+            display.setAttribute("invert", str(int(obj.display_settings.invert)))
+            display.setAttribute("sharpen_amount", str(obj.display_settings.sharpen_amount))
+            display.setAttribute("sharpen_radius", str(obj.display_settings.sharpen_radius))
+            raster.appendChild(display)
+
             rasters.appendChild(raster)
 
         # 3. Сохраняем кривые
@@ -198,10 +315,11 @@ class ProjectManager:
                 curve_elem.setAttribute("line_width", str(curve.line_width))
 
                 points = doc.createElement("points")
-                for point in curve.points:
+                # Элементы float32 печатаются кратчайшей записью (12.3, а не 12.300000190734863)
+                for x, y in curve.points.array:
                     point_elem = doc.createElement("point")
-                    point_elem.setAttribute("x", str(point.x()))
-                    point_elem.setAttribute("y", str(point.y()))
+                    point_elem.setAttribute("x", str(x))
+                    point_elem.setAttribute("y", str(y))
                     points.appendChild(point_elem)
 
                 curve_elem.appendChild(points)
@@ -247,6 +365,9 @@ class MainWindow(QMainWindow):
         self._connect_signals()
 
         self.gl_widget.objectActivated.connect(self._on_object_activated)
+        self.gl_widget.loadProgress.connect(self._on_load_progress)
+        self.gl_widget.loadFinished.connect(self._on_load_finished)
+        self.gl_widget.loadFailed.connect(self._on_load_failed)
 
         # Меню шкалы (изначально полностью неактивно)
         self.scale_menu = self.menuBar().addMenu("Шкала")
@@ -257,11 +378,21 @@ class MainWindow(QMainWindow):
         self.scale_toggle_action.triggered.connect(self._toggle_scale)
         self.scale_menu.setEnabled(False)
 
+        # Меню изображения (доступно при активном растре)
+        self.image_menu = self.menuBar().addMenu("Изображение")
+        self.display_settings_action = self.image_menu.addAction("Коррекция изображения...")
+        self.display_settings_action.triggered.connect(self._show_display_settings)
+        self.image_menu.setEnabled(False)
+
         # Меню векторизации (изначально неактивно)
         self._create_vectorization_menu()
         self.vectorization_menu.setEnabled(False)
 
         self.gl_widget.curvesChanged.connect(self._update_save_button_state)
+        self.gl_widget.traceFinished.connect(lambda message: self.show_toast(message, timeout=4000))
+        self.gl_widget.autoVectorizeProgress.connect(self._on_auto_vectorize_progress)
+        self.gl_widget.autoVectorizeFinished.connect(self._on_auto_vectorize_finished)
+        self.gl_widget.autoVectorizeFailed.connect(self._on_auto_vectorize_failed)
         self.curves_actions_created = False  # Флаг, созданы ли уже действия
 
     def _update_save_button_state(self, has_curves):
@@ -323,6 +454,28 @@ class MainWindow(QMainWindow):
         self.save_project_action.setVisible(False)
         self.save_project_action.triggered.connect(self._save_project)
 
+        # Диагностика производительности
+        self.view_menu = menubar.addMenu("Вид")
+        self.hud_action = self.view_menu.addAction("Статистика производительности")
+        self.hud_action.setCheckable(True)
+        self.hud_action.toggled.connect(self.gl_widget.set_hud_visible)
+        perf_log_action = self.view_menu.addAction("Сохранить журнал производительности...")
+        perf_log_action.triggered.connect(self._save_perf_log)
+
+    def _save_perf_log(self):
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "Сохранить журнал производительности", "", "CSV Files (*.csv);;All Files (*)"
+        )
+        if not file_path:
+            return
+
+        try:
+            self.gl_widget.perf_stats.export_log(file_path)
+            self.show_toast(f"Журнал сохранен в {file_path}")
+        except OSError as e:
+            QMessageBox.critical(self, "Ошибка сохранения",
+                                 f"Не удалось сохранить журнал:\n{str(e)}")
+
     def _create_mode_panel(self):
         panel = QWidget(self)
         panel.setStyleSheet(self._panel_style())
@@ -427,6 +580,17 @@ class MainWindow(QMainWindow):
         self.finish_curve_action.setEnabled(False)
         self.finish_curve_action.triggered.connect(self._finish_current_curve)
 
+        # Щелчок по линии записи — кривая вдоль неё до разрыва или пересечения
+        self.trace_mode_action = self.vectorization_menu.addAction("Следовать по линии")
+        self.trace_mode_action.setCheckable(True)
+        self.trace_mode_action.setEnabled(False)
+        self.trace_mode_action.toggled.connect(self.gl_widget.set_trace_mode)
+
+        # Все линии листа сразу; найденные кривые проверяются и правятся вручную
+        self.auto_vector_action = self.vectorization_menu.addAction("Векторизовать весь лист")
+        self.auto_vector_action.setEnabled(False)
+        self.auto_vector_action.triggered.connect(self._auto_vectorize)
+
         self.color_menu = self.vectorization_menu.addMenu("Цвет кривой")
         self.color_menu.setEnabled(False)
 
@@ -517,6 +681,8 @@ class MainWindow(QMainWindow):
             self.start_vector_action.setEnabled(False)
             self.finish_vector_action.setEnabled(True)
             self.finish_curve_action.setEnabled(True)
+            self.trace_mode_action.setEnabled(True)
+            self.auto_vector_action.setEnabled(True)
             self.color_menu.setEnabled(True)
             self.clear_last_curve_action.setEnabled(True)  # Всегда доступна при векторизации
             self.clear_curves_action.setEnabled(True)  # Всегда доступна при векторизации
@@ -537,6 +703,9 @@ class MainWindow(QMainWindow):
             self.start_vector_action.setEnabled(True)  # Можно начать снова
             self.finish_vector_action.setEnabled(False)
             self.finish_curve_action.setEnabled(False)
+            self.trace_mode_action.setChecked(False)
+            self.trace_mode_action.setEnabled(False)
+            self.auto_vector_action.setEnabled(False)
             self.clear_last_curve_action.setEnabled(False)
             self.clear_curves_action.setEnabled(False)
             # Цвет остается доступным всегда
@@ -545,6 +714,48 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, "Ошибка",
                                  f"Критическая ошибка при завершении векторизации:\n{str(e)}")
 
+    def _auto_vectorize(self):
+        """Поиск всех линий активного растра в фоне с диалогом прогресса (можно прервать)"""
+        if not self.gl_widget.start_auto_vectorize():
+            return
+        self._hide_auto_vector_dialog()
+        self._auto_vector_dialog = QProgressDialog("Поиск линий записи...", "Отмена", 0, 100, self)
+        self._auto_vector_dialog.setWindowTitle("Векторизация листа")
+        self._auto_vector_dialog.setWindowModality(Qt.WindowModal)
+        self._auto_vector_dialog.setAutoClose(False)
+        self._auto_vector_dialog.setAutoReset(False)
+        self._auto_vector_dialog.setMinimumDuration(0)
+        self._auto_vector_dialog.canceled.connect(self._cancel_auto_vectorize)
+        self._auto_vector_dialog.setValue(0)
+        self._auto_vector_dialog.show()
+
+    def _hide_auto_vector_dialog(self):
+        if hasattr(self, '_auto_vector_dialog'):
+            try:
+                self._auto_vector_dialog.canceled.disconnect(self._cancel_auto_vectorize)
+                self._auto_vector_dialog.hide()
+                self._auto_vector_dialog.deleteLater()
+            except (RuntimeError, TypeError):
+                pass  # Диалог уже удалён
+            del self._auto_vector_dialog
+
+    def _on_auto_vectorize_progress(self, percent):
+        if hasattr(self, '_auto_vector_dialog'):
+            self._auto_vector_dialog.setValue(percent)
+
+    def _on_auto_vectorize_finished(self, count):
+        self._hide_auto_vector_dialog()
+        self.show_toast(f"Найдено линий: {count}", timeout=4000)
+
+    def _on_auto_vectorize_failed(self, message):
+        self._hide_auto_vector_dialog()
+        QMessageBox.critical(self, "Ошибка", f"Ошибка векторизации листа:\n{message}")
+
+    def _cancel_auto_vectorize(self):
+        self.gl_widget.cancel_auto_vectorize()
+        self._hide_auto_vector_dialog()
+        self.show_toast("Операция отменена пользователем", timeout=3000)
+
     def _finish_current_curve(self):
         """Завершение текущей кривой"""
         if not hasattr(self.gl_widget, 'finish_current_curve'):
@@ -690,6 +901,16 @@ class MainWindow(QMainWindow):
             self.scale_toggle_action.setEnabled(True)
             self.gl_widget.update()
 
+    def _show_display_settings(self):
+        if not self.gl_widget.active_object:
+            QMessageBox.warning(self, "Ошибка",
+                                "Нет активного растрового объекта.\n"
+                                "Дважды кликните по растру, чтобы активировать его.")
+            return
+
+        dialog = DisplaySettingsDialog(self.gl_widget.active_object.display_settings, self.gl_widget, self)
+        dialog.exec_()
+
     def _toggle_scale(self):
         if not self.gl_widget.active_object:
             return
@@ -786,6 +1007,7 @@ class MainWindow(QMainWindow):
     def _on_object_activated(self, active):
         self.tool_panel.setVisible(active)
         self.scale_menu.setEnabled(active)  # Меню шкалы доступно только при активном растре
+        self.image_menu.setEnabled(active)
         self.vectorization_menu.setEnabled(active)  # Меню векторизации доступно только при активном растре
         self.color_menu.setEnabled(active)  # Активируем меню цветов
         self._update_curves_actions_visibility(active) # Обновляем видимость действий для кривых
@@ -816,41 +1038,18 @@ class MainWindow(QMainWindow):
         if not file_path:
             return
 
-        try:
-            # Закрываем предыдущие уведомления перед операцией
-            if hasattr(self, '_current_toast'):
-                try:
-                    self._current_toast.hide()
-                except RuntimeError:
-                    pass  # Игнорируем ошибки удаленного объекта
-
-            # Добавляем изображение
-            success = self.gl_widget.add_image(file_path, self._progress_callback)
-
-            if success:
-                # Формируем сообщение после успешного добавления
-                try:
-                    last_obj = self.gl_widget.raster_objects[-1]
-                    self.show_toast(
-                        f"Добавлено изображение: {file_path.split('/')[-1]}\n"
-                        f"Размер: {last_obj.size.width():.0f}×{last_obj.size.height():.0f} px\n"
-                        f"Физический размер: "
-                        f"{last_obj.get_physical_size_mm().width():.1f}×"
-                        f"{last_obj.get_physical_size_mm().height():.1f} мм"
-                    )
-                except (IndexError, AttributeError, RuntimeError) as e:
-                    print(f"Ошибка при показе уведомления: {str(e)}")
-            self.save_project_action.setVisible(True)
-
-        except Exception as e:
-            # Сначала скрываем прогресс-диалог, если он есть
-            if hasattr(self, '_progress_dialog'):
-                try:
-                    self._progress_dialog.hide()
-                except RuntimeError:
-                    pass
+        # Закрываем предыдущие уведомления перед операцией
+        if hasattr(self, '_current_toast'):
+            try:
+                self._current_toast.hide()
+            except RuntimeError:
+                pass  # Игнорируем ошибки удаленного объекта
 
-            QMessageBox.critical( self, "Ошибка", f"Не удалось добавить изображение:\n{str(e)}")
+        # Запускаем фоновую загрузку; результат придёт в _on_load_finished
+        self._show_progress_dialog()
+        if not self.gl_widget.add_image(file_path):
+            self._hide_progress_dialog()
+            QMessageBox.critical(self, "Ошибка", f"Не удалось добавить изображение:\n{file_path}")
 
     def _open_image(self):
         """Загрузка нового изображения (очищает предыдущее)"""
@@ -872,63 +1071,86 @@ class MainWindow(QMainWindow):
                 except RuntimeError:
                     pass
 
-            # Загружаем изображение
-            self.gl_widget.load_image(file_path, self._progress_callback)
+            # Запускаем фоновую загрузку; результат придёт в _on_load_finished
+            self._show_progress_dialog()
+            self.gl_widget.load_image(file_path)
 
-            # Формируем информационное сообщение
-            try:
-                img_info = (
-                    f"Загружено изображение: {file_path.split('/')[-1]}\n"
-                    f"Размер: {self.gl_widget.image_loader.width}×{self.gl_widget.image_loader.height} px\n"
-                    f"Физический размер: "
-                    f"{self.gl_widget.raster_objects[0].get_physical_size_mm().width():.1f}×"
-                    f"{self.gl_widget.raster_objects[0].get_physical_size_mm().height():.1f} мм"
-                )
-                self.show_toast(img_info, timeout=5000)  # Увеличиваем время показа
-            except (IndexError, AttributeError, RuntimeError) as e:
-                print(f"Ошибка при формировании информации: {str(e)}")
+        except Exception as e:
+            self._hide_progress_dialog()
+            QMessageBox.critical( self, "Ошибка", f"Не удалось загрузить изображение:\n{str(e)}")
+
+    def _on_load_finished(self, replaced):
+        """Растр загружен: показываем сведения и активируем интерфейс"""
+        self._hide_progress_dialog()
+
+        try:
+            last_obj = self.gl_widget.raster_objects[-1]
+            action = "Загружено" if replaced else "Добавлено"
+            self.show_toast(
+                f"{action} изображение: {os.path.basename(last_obj.file_path)}\n"
+                f"Размер: {last_obj.tile_manager.image_width}×{last_obj.tile_manager.image_height} px, "
+                f"{last_obj.dpi[0]:g} DPI\n"
+                f"Физический размер: "
+                f"{last_obj.get_physical_size_mm().width():.1f}×"
+                f"{last_obj.get_physical_size_mm().height():.1f} мм",
+                timeout=5000 if replaced else 7000
+            )
+        except (IndexError, AttributeError, RuntimeError) as e:
+            print(f"Ошибка при формировании информации: {str(e)}")
 
+        self.save_project_action.setVisible(True)
+        if replaced:
             # Активируем интерфейс
             self._update_curves_actions_visibility(True)
             self.add_action.setVisible(True)
-            self.save_project_action.setVisible(True)
             self.scale_menu.setEnabled(False)  # Меню шкалы неактивно
             self.vectorization_menu.setEnabled(False)  # Меню векторизации неактивно
             self.mode_panel.setVisible(True)
             self._activate_move_mode()
 
-        except Exception as e:
-            # Скрываем прогресс-диалог при ошибке
-            if hasattr(self, '_progress_dialog'):
-                try:
-                    self._progress_dialog.hide()
-                except RuntimeError:
-                    pass
-
-            QMessageBox.critical( self, "Ошибка", f"Не удалось загрузить изображение:\n{str(e)}")
-
-    def _progress_callback(self, percent):
-        """Обработчик прогресса операций загрузки"""
-        # Инициализация диалога только при начале операции (percent == 0)
-        if percent == 0:
-            if hasattr(self, '_progress_dialog'):
+    def _on_load_failed(self, message):
+        self._hide_progress_dialog()
+        QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить изображение:\n{message}")
+
+    def _show_progress_dialog(self):
+        """Диалог прогресса фоновой загрузки; «Отмена» сразу прерывает загрузку"""
+        self._hide_progress_dialog()
+
+        self._progress_dialog = QProgressDialog("Обработка изображения...", "Отмена", 0, 100, self)
+        self._progress_dialog.setWindowTitle("Прогресс")
+        self._progress_dialog.setWindowModality(Qt.WindowModal)
+        self._progress_dialog.setAutoClose(False)
+        self._progress_dialog.setAutoReset(False)
+        self._progress_dialog.setMinimumDuration(0)
+        self._progress_dialog.canceled.connect(self._cancel_loading)
+        self._progress_dialog.setValue(0)
+        self._progress_dialog.show()
+
+    def _hide_progress_dialog(self):
+        if hasattr(self, '_progress_dialog'):
+            try:
+                self._progress_dialog.canceled.disconnect(self._cancel_loading)
+                self._progress_dialog.hide()
                 self._progress_dialog.deleteLater()
+            except (RuntimeError, TypeError):
+                pass  # Диалог уже удалён
+            del self._progress_dialog
 
-            self._progress_dialog = QProgressDialog("Обработка изображения...", "Отмена", 0, 100, self)
-            self._progress_dialog.setWindowTitle("Прогресс")
-            self._progress_dialog.setWindowModality(True)
-            self._progress_dialog.setAutoClose(True)  # Автоматически закрывать при завершении
-            self._progress_dialog.show()
-
-        # Обновляем прогресс только если диалог существует
+    def _on_load_progress(self, percent):
+        """Обработчик прогресса фоновой загрузки"""
         if hasattr(self, '_progress_dialog'):
             self._progress_dialog.setValue(percent)
-            QApplication.processEvents()
 
-            if self._progress_dialog.wasCanceled():
-                self._progress_dialog.deleteLater()
-                del self._progress_dialog
-                raise Exception("Операция отменена пользователем")
+    def _cancel_loading(self):
+        self.gl_widget.cancel_loading()
+        self._hide_progress_dialog()
+        self.show_toast("Операция отменена пользователем", timeout=3000)
+
+    def closeEvent(self, event):
+        # Дожидаемся рабочих потоков загрузки и поиска линий, чтобы они не пережили окно
+        self.gl_widget.cancel_loading(wait=True)
+        self.gl_widget.cancel_auto_vectorize(wait=True)
+        super().closeEvent(event)
 
     def show_toast(self, message, timeout=7000):
         """Всплывающее уведомление с автоисчезновением"""
@@ -0,0 +1,182 @@
+# Счётчики производительности: время фаз кадра (CPU и GPU), тайлы, видеопамять, этапы загрузки
+
+import platform as system_info  # Имя platform занято звёздочным импортом OpenGL
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from OpenGL.GL import *
+
+
+class PerfStats:
+    """Статистика последних кадров и загрузок изображений.
+
+    Время фазы на CPU считается всегда (perf_counter почти ничего не стоит);
+    фазы CPU могут быть вложенными. Время на GPU меряется запросами
+    GL_TIME_ELAPSED, только если включено gpu_timing: результат читается
+    через несколько кадров, когда он готов, поэтому конвейер не ждёт.
+    Запросы GPU не вкладываются, так что фазы с gpu=True идут подряд.
+    """
+    MAX_FRAMES = 600  # Сколько последних кадров хранится для журнала
+    AVERAGE_FRAMES = 60  # По скольким кадрам считаются средние для оверлея
+
+    def __init__(self):
+        self.gpu_timing = False
+        self.frames = deque(maxlen=self.MAX_FRAMES)
+        self.loads = []  # Замеры загрузок: (файл, {этап: секунды})
+        self.gl_info = ""
+        self._frame = None
+        self._frame_start = 0.0
+        self._free_queries = []
+        self._pending_queries = deque()  # (запрос, запись кадра, фаза) в порядке выдачи
+
+    def begin_frame(self):
+        self._collect_gpu_results()
+        self._frame = {"time": time.time(), "cpu": {}, "gpu": {}, "counts": {}, "gauges": {}}
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if self._frame is None:
+            return
+        self._frame["cpu"]["frame"] = time.perf_counter() - self._frame_start
+        self.frames.append(self._frame)
+        self._frame = None
+
+    @contextmanager
+    def phase(self, name, gpu=False):
+        """Замер фазы кадра; повторные замеры одной фазы за кадр суммируются"""
+        frame = self._frame
+        query = self._begin_query() if gpu and frame is not None else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if frame is not None:
+                frame["cpu"][name] = frame["cpu"].get(name, 0.0) + time.perf_counter() - start
+            if query:
+                glEndQuery(GL_TIME_ELAPSED)
+                self._pending_queries.append((query, frame, name))
+
+    def count(self, name, value=1):
+        """Прибавляет value к счётчику событий текущего кадра (в оверлее — сумма за секунду)"""
+        if self._frame is not None:
+            counts = self._frame["counts"]
+            counts[name] = counts.get(name, 0) + value
+
+    def set(self, name, value):
+        """Текущее значение величины (например, занятая видеопамять)"""
+        if self._frame is not None:
+            self._frame["gauges"][name] = value
+
+    def record_load(self, file_path, stages):
+        self.loads.append((file_path, dict(stages)))
+
+    def read_gl_info(self):
+        """Запоминает драйвер OpenGL для журнала (нужен текущий контекст)"""
+        try:
+            self.gl_info = " / ".join(glGetString(name).decode(errors='replace')
+                                      for name in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+        except Exception as e:
+            self.gl_info = f"нет данных ({str(e)})"
+
+    def averages(self):
+        """Средние по последним кадрам.
+
+        Возвращает ({фаза: мс CPU}, {фаза: мс GPU}, {счётчик: событий в секунду},
+        {величина: последнее значение}, кадров в секунду).
+        """
+        frames = list(self.frames)[-self.AVERAGE_FRAMES:]
+        if not frames:
+            return {}, {}, {}, {}, 0.0
+        cpu, gpu, counts, gauges = {}, {}, {}, {}
+        for frame in frames:
+            for name, seconds in frame["cpu"].items():
+                cpu[name] = cpu.get(name, 0.0) + seconds
+            for name, seconds in frame["gpu"].items():
+                gpu[name] = gpu.get(name, 0.0) + seconds
+            for name, value in frame["counts"].items():
+                counts[name] = counts.get(name, 0) + value
+            gauges.update(frame["gauges"])
+        cpu = {name: total * 1000 / len(frames) for name, total in cpu.items()}
+        gpu = {name: total * 1000 / len(frames) for name, total in gpu.items()}
+        span = frames[-1]["time"] - frames[0]["time"]
+        fps = (len(frames) - 1) / span if span > 0 else 0.0
+        counts = {name: total / span if span > 0 else total for name, total in counts.items()}
+        return cpu, gpu, counts, gauges, fps
+
+    def summary(self):
+        """Текст для оверлея"""
+        cpu, gpu, counts, gauges, fps = self.averages()
+        lines = [f"Кадров/с: {fps:.1f}   кадр CPU: {cpu.get('frame', 0.0):.2f} мс"]
+        for name in sorted(cpu):
+            if name != "frame":
+                gpu_text = f"   GPU {gpu[name]:.2f} мс" if name in gpu else ""
+                lines.append(f"{name}: CPU {cpu[name]:.2f} мс{gpu_text}")
+        for name in sorted(counts):
+            lines.append(f"{name}: {counts[name]:.1f}/с")
+        for name in sorted(gauges):
+            value = gauges[name]
+            if name.endswith("_bytes"):
+                lines.append(f"{name[:-6]}: {value / 1024 ** 2:.1f} МБ")
+            else:
+                lines.append(f"{name}: {value}")
+        if self.loads:
+            file_path, stages = self.loads[-1]
+            lines.append("Загрузка:")
+            lines += [f"  {name}: {seconds:.2f} с" for name, seconds in stages.items()]
+        return "\n".join(lines)
+
+    def export_log(self, file_path):
+        """Журнал для отчёта: окружение, загрузки и покадровые замеры (CSV, миллисекунды)"""
+        phases = sorted({name for frame in self.frames for name in frame["cpu"]})
+        gpu_phases = sorted({name for frame in self.frames for name in frame["gpu"]})
+        counters = sorted({name for frame in self.frames for name in list(frame["counts"]) + list(frame["gauges"])})
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(f"# Журнал производительности, {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+            f.write(f"# Система: {system_info.platform()}, Python {system_info.python_version()}\n")
+            f.write(f"# OpenGL: {self.gl_info}\n")
+            for load_path, stages in self.loads:
+                stage_text = ", ".join(f"{name}={seconds:.3f}" for name, seconds in stages.items())
+                f.write(f"# Загрузка {load_path}: {stage_text} (с)\n")
+
+            columns = (["time"] + [f"cpu_{name}" for name in phases] + [f"gpu_{name}" for name in gpu_phases]
+                       + counters)
+            f.write(";".join(columns) + "\n")
+            for frame in self.frames:
+                row = [f"{frame['time']:.3f}"]
+                row += [f"{frame['cpu'].get(name, 0.0) * 1000:.3f}" for name in phases]
+                row += [f"{frame['gpu'][name] * 1000:.3f}" if name in frame["gpu"] else "" for name in gpu_phases]
+                row += [str(frame["counts"].get(name, frame["gauges"].get(name, ""))) for name in counters]
+                f.write(";".join(row) + "\n")
+
+    def release(self):
+        """Удаляет запросы OpenGL (нужен текущий контекст)"""
+        queries = self._free_queries + [query for query, _, _ in self._pending_queries]
+        if queries:
+            glDeleteQueries(len(queries), queries)
+        self._free_queries = []
+        self._pending_queries.clear()
+
+    def _begin_query(self):
+        if not self.gpu_timing:
+            return None
+        try:
+            query = self._free_queries.pop() if self._free_queries else int(glGenQueries(1)[0])
+            glBeginQuery(GL_TIME_ELAPSED, query)
+        except Exception as e:
+            print(f"Замер времени на GPU недоступен: {str(e)}")
+            self.gpu_timing = False
+            return None
+        return query
+
+    def _collect_gpu_results(self):
+        """Забирает готовые результаты запросов, не дожидаясь остальных"""
+        while self._pending_queries:
+            query, frame, name = self._pending_queries[0]
+            if not glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE):
+                break  # Запросы завершаются по порядку: следующие тоже не готовы
+            # 32 бит наносекунд хватает на 4 с, а 64-битный вариант PyOpenGL не разбирает
+            nanoseconds = glGetQueryObjectuiv(query, GL_QUERY_RESULT)
+            frame["gpu"][name] = frame["gpu"].get(name, 0.0) + int(nanoseconds) / 1e9
+            self._pending_queries.popleft()
+            self._free_queries.append(query)
@@ -0,0 +1,107 @@
+# Пространственный индекс растров: поиск растра под курсором без перебора всей сцены
+
+import math
+
+
+class RasterIndex:
+    """Сетка ячеек сцены, в каждой — растры, чьи повёрнутые границы её задевают.
+
+    Размер ячейки подбирается при перестройке так, чтобы почти каждый растр
+    задевал лишь несколько ячеек; выбросы по размеру держатся вне сетки.
+    Растр сообщает об изменении положения, размера или поворота
+    (geometry_listener); такие растры переносятся по ячейкам при следующем
+    запросе. Точная проверка попадания делается только для растров из одной ячейки
+    и для немногих растров, слишком крупных для сетки.
+    """
+    MAX_CELLS_PER_OBJECT = 64  # Растр, задевающий больше ячеек, проверяется при каждом запросе
+    CELL_SIZE_PERCENTILE = 0.9  # Ячейка не меньше растра этого процентиля по размеру
+    MIN_CELL_SIZE = 1.0
+
+    def __init__(self):
+        self.cell_size = None
+        self._cells = {}  # (столбец, строка) -> растры
+        self._object_cells = {}  # Растр -> его ячейки
+        self._large = set()  # Растры вне сетки
+        self._order = {}  # Растр -> номер в порядке отрисовки (больше — выше)
+        self._next_order = 0
+        self._dirty = set()
+        self._built_for = 0  # Сколько растров было при подборе размера ячейки
+
+    def insert(self, raster_object):
+        """Добавляет растр поверх уже добавленных"""
+        self._order[raster_object] = self._next_order
+        self._next_order += 1
+        raster_object.geometry_listener = self._mark_dirty
+        self._dirty.add(raster_object)
+
+    def clear(self):
+        for raster_object in self._order:
+            raster_object.geometry_listener = None
+        self.cell_size = None
+        self._cells = {}
+        self._object_cells = {}
+        self._large = set()
+        self._order = {}
+        self._dirty = set()
+        self._built_for = 0
+
+    def hit_test(self, scene_point):
+        """Верхний растр, содержащий точку сцены, или None"""
+        self._refresh()
+        if not self.cell_size:
+            return None
+        cell = (math.floor(scene_point.x() / self.cell_size), math.floor(scene_point.y() / self.cell_size))
+        candidates = sorted(self._large.union(self._cells.get(cell, ())), key=self._order.__getitem__, reverse=True)
+        for raster_object in candidates:
+            if raster_object.contains_point(scene_point):
+                return raster_object
+        return None
+
+    def _mark_dirty(self, raster_object):
+        self._dirty.add(raster_object)
+
+    def _refresh(self):
+        # Когда растров стало вдвое больше, размер ячейки подбирается заново
+        if self.cell_size is None or len(self._order) > 2 * self._built_for:
+            self._rebuild()
+            return
+        dirty, self._dirty = self._dirty, set()
+        for raster_object in dirty:
+            self._unlink(raster_object)
+            self._link(raster_object)
+
+    def _rebuild(self):
+        self._cells = {}
+        self._object_cells = {}
+        self._large = set()
+        self._dirty = set()
+        self._built_for = len(self._order)
+        if not self._order:
+            self.cell_size = None
+            return
+        extents = sorted(max(x1 - x0, y1 - y0) for x0, y0, x1, y1
+                         in (obj.scene_bounds() for obj in self._order))
+        self.cell_size = max(extents[int(len(extents) * self.CELL_SIZE_PERCENTILE)], self.MIN_CELL_SIZE)
+        for raster_object in self._order:
+            self._link(raster_object)
+
+    def _link(self, raster_object):
+        x0, y0, x1, y1 = raster_object.scene_bounds()
+        size = self.cell_size
+        columns = range(math.floor(x0 / size), math.floor(x1 / size) + 1)
+        rows = range(math.floor(y0 / size), math.floor(y1 / size) + 1)
+        if len(columns) * len(rows) > self.MAX_CELLS_PER_OBJECT:
+            self._large.add(raster_object)
+            return
+        cells = [(column, row) for column in columns for row in rows]
+        for cell in cells:
+            self._cells.setdefault(cell, []).append(raster_object)
+        self._object_cells[raster_object] = cells
+
+    def _unlink(self, raster_object):
+        self._large.discard(raster_object)
+        for cell in self._object_cells.pop(raster_object, ()):
+            objects = self._cells[cell]
+            objects.remove(raster_object)
+            if not objects:
+                del self._cells[cell]
@@ -0,0 +1,709 @@
+# Отрисовка сцены шейдерами (OpenGL 3.3 core): тайлы растров, кривые, линии шкал и слой растров
+
+import ctypes
+import math
+
+import numpy as np
+from OpenGL.GL import *
+
+# Коррекция яркости считается при выборке: текстуры тайлов не меняются и не перезагружаются
+_DISPLAY_CORRECTION = """
+uniform vec2 u_levels;   // Уровни чёрного и белого (0..1): окно, растягиваемое на весь диапазон
+uniform float u_gamma;
+uniform bool u_invert;
+vec3 display_correction(vec3 color) {
+    vec3 value = clamp((color - u_levels.x) / max(u_levels.y - u_levels.x, 1e-4), 0.0, 1.0);
+    value = pow(value, vec3(1.0 / u_gamma));
+    return u_invert ? 1.0 - value : value;
+}
+"""
+
+# Все видимые тайлы одной страницы — экземпляры одного четырёхугольника, углы берутся из gl_VertexID
+_TILE_VERTEX_SHADER = """
+#version 330 core
+layout(location = 0) in vec4 rect;      // Тайл в пикселях уровня 0: x0, y0, x1, y1
+layout(location = 1) in vec4 tex_map;   // Начало и размер данных текстуры в пикселях уровня 0
+layout(location = 2) in vec3 tex_layer; // Слой страницы и доля слоя, занятая данными, по x и y
+uniform mat3 u_matrix;
+out vec2 v_tex;
+flat out vec3 v_layer;
+void main() {
+    vec2 position = mix(rect.xy, rect.zw, vec2(gl_VertexID & 1, gl_VertexID >> 1));
+    v_tex = (position - tex_map.xy) / tex_map.zw;
+    v_layer = tex_layer;
+    gl_Position = vec4((u_matrix * vec3(position, 1.0)).xy, 0.0, 1.0);
+}
+"""
+
+_TILE_FRAGMENT_SHADER = """
+#version 330 core
+in vec2 v_tex;
+flat in vec3 v_layer;
+uniform sampler2DArray u_texture;
+uniform vec4 u_tint;
+out vec4 frag_color;
+""" + _DISPLAY_CORRECTION + """
+void main() {
+    // Данные занимают угол слоя, дальше — остатки прежних тайлов: выборка не выходит за край данных
+    vec2 size = vec2(textureSize(u_texture, 0).xy);
+    vec2 data = v_layer.yz * size;
+    vec2 texel = clamp(v_tex * data, vec2(0.5), data - 0.5);
+    vec4 color = texture(u_texture, vec3(texel / size, v_layer.x));
+    frag_color = vec4(display_correction(color.rgb), color.a) * u_tint;
+}
+"""
+
+_IMAGE_VERTEX_SHADER = """
+#version 330 core
+layout(location = 0) in vec2 position;  // Пиксели окна
+uniform mat3 u_matrix;
+uniform vec4 u_tex_map;  // Начало и размер текстуры в пикселях окна
+out vec2 v_tex;
+void main() {
+    v_tex = (position - u_tex_map.xy) / u_tex_map.zw;
+    gl_Position = vec4((u_matrix * vec3(position, 1.0)).xy, 0.0, 1.0);
+}
+"""
+
+_IMAGE_FRAGMENT_SHADER = """
+#version 330 core
+in vec2 v_tex;
+uniform sampler2D u_texture;
+uniform vec4 u_tint;
+uniform vec2 u_sharpen;  // Сила нерезкого маскирования и его радиус в текселях (0 — выключено)
+out vec4 frag_color;
+""" + _DISPLAY_CORRECTION + """
+void main() {
+    vec4 color = texture(u_texture, v_tex);
+    if (u_sharpen.x > 0.0) {
+        // Размытие по восьми соседям на расстоянии радиуса; разница с ним — локальный контраст.
+        // Соседи взвешены по непрозрачности: за краем растра пусто, и край не высветляется
+        vec2 step = u_sharpen.y / vec2(textureSize(u_texture, 0));
+        vec4 blur = vec4(0.0);
+        for (int dy = -1; dy <= 1; ++dy)
+            for (int dx = -1; dx <= 1; ++dx)
+                if (dx != 0 || dy != 0) {
+                    vec4 sample = texture(u_texture, v_tex + vec2(dx, dy) * step);
+                    blur += vec4(sample.rgb * sample.a, sample.a);
+                }
+        if (blur.a > 0.0)
+            color.rgb += u_sharpen.x * (color.rgb - blur.rgb / blur.a);
+    }
+    frag_color = vec4(display_correction(color.rgb), color.a) * u_tint;
+}
+"""
+
+_LINE_VERTEX_SHADER = """
+#version 330 core
+layout(location = 0) in vec2 position;
+layout(location = 1) in vec4 color;
+layout(location = 2) in float width;
+uniform mat3 u_matrix;
+uniform float u_point_size;
+out vec4 g_color;
+out float g_width;
+void main() {
+    g_color = color;
+    g_width = width;
+    gl_PointSize = u_point_size;
+    gl_Position = vec4((u_matrix * vec3(position, 1.0)).xy, 0.0, 1.0);
+}
+"""
+
+# Толстые линии в core profile не гарантированы: отрезок разворачивается в полосу нужной ширины
+_LINE_GEOMETRY_SHADER = """
+#version 330 core
+layout(lines) in;
+layout(triangle_strip, max_vertices = 4) out;
+in vec4 g_color[];
+in float g_width[];
+uniform vec2 u_viewport;
+out vec4 f_color;
+void main() {
+    vec2 a = gl_in[0].gl_Position.xy;
+    vec2 b = gl_in[1].gl_Position.xy;
+    vec2 direction = (b - a) * u_viewport;
+    if (dot(direction, direction) < 1e-12)
+        direction = vec2(1.0, 0.0);
+    // Половина ширины в пикселях, а пиксель — это 2 / u_viewport в координатах отсечения
+    vec2 offset = normalize(vec2(-direction.y, direction.x)) * g_width[0] / u_viewport;
+    f_color = g_color[0];
+    gl_Position = vec4(a + offset, 0.0, 1.0); EmitVertex();
+    gl_Position = vec4(a - offset, 0.0, 1.0); EmitVertex();
+    f_color = g_color[1];
+    gl_Position = vec4(b + offset, 0.0, 1.0); EmitVertex();
+    gl_Position = vec4(b - offset, 0.0, 1.0); EmitVertex();
+    EndPrimitive();
+}
+"""
+
+_LINE_FRAGMENT_SHADER = """
+#version 330 core
+in vec4 f_color;
+out vec4 frag_color;
+void main() {
+    frag_color = f_color;
+}
+"""
+
+_POINT_FRAGMENT_SHADER = """
+#version 330 core
+in vec4 g_color;
+out vec4 frag_color;
+void main() {
+    frag_color = g_color;
+}
+"""
+
+# Сетка шкал считается по пикселю: расстояние до ближайшей линии переводится в пиксели экрана
+_GRID_VERTEX_SHADER = """
+#version 330 core
+layout(location = 0) in vec2 position;  // Локальные координаты растра (единицы сцены)
+uniform mat3 u_matrix;
+out vec2 v_local;
+void main() {
+    v_local = position;
+    gl_Position = vec4((u_matrix * vec3(position, 1.0)).xy, 0.0, 1.0);
+}
+"""
+
+_GRID_FRAGMENT_SHADER = """
+#version 330 core
+in vec2 v_local;
+uniform vec4 u_rows;     // Горизонтальные линии: шаг, первый и последний номер, включены ли
+uniform vec4 u_columns;  // Вертикальные линии: то же по x
+uniform vec4 u_color;
+uniform float u_line_width;  // В пикселях экрана
+out vec4 frag_color;
+
+float line_coverage(float coordinate, vec4 lines) {
+    // Расстояние до линии в пикселях экрана — по длине его экранного градиента. fwidth (|dx| + |dy|)
+    // на повёрнутом растре завышает его до sqrt(2) раз, и линии под углом становятся тоньше.
+    // Градиент расстояния равен градиенту координаты: номер линии между соседними пикселями
+    // постоянен, а на середине между линиями скачок номера исказил бы производную
+    float units_per_px = max(length(vec2(dFdx(coordinate), dFdy(coordinate))), 1e-6);
+    if (lines.w < 0.5 || lines.x <= 0.0)
+        return 0.0;
+    float index = clamp(floor(coordinate / lines.x + 0.5), lines.y, lines.z);
+    float distance_px = abs(coordinate - index * lines.x) / units_per_px;
+    return clamp(u_line_width * 0.5 + 0.5 - distance_px, 0.0, 1.0);
+}
+
+void main() {
+    float coverage = max(line_coverage(v_local.y, u_rows), line_coverage(v_local.x, u_columns));
+    if (coverage <= 0.0)
+        discard;
+    frag_color = vec4(u_color.rgb, u_color.a * coverage);
+}
+"""
+
+_FILL_FRAGMENT_SHADER = """
+#version 330 core
+uniform vec4 u_color;
+out vec4 frag_color;
+void main() {
+    frag_color = u_color;
+}
+"""
+
+
+def ortho(width, height):
+    """Пиксели экрана (y вниз) -> координаты отсечения"""
+    return np.array([[2.0 / width, 0.0, -1.0],
+                     [0.0, -2.0 / height, 1.0],
+                     [0.0, 0.0, 1.0]])
+
+
+def translation(x, y):
+    return np.array([[1.0, 0.0, x], [0.0, 1.0, y], [0.0, 0.0, 1.0]])
+
+
+def scaling(sx, sy):
+    return np.array([[sx, 0.0, 0.0], [0.0, sy, 0.0], [0.0, 0.0, 1.0]])
+
+
+def rotation(angle):
+    """Поворот на angle градусов (как glRotatef вокруг оси z)"""
+    c, s = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    return np.array([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]])
+
+
+class CurveBuffer:
+    """Вершины одной кривой в видеопамяти.
+
+    Новые точки дописываются в конец буфера (ёмкость растёт вдвое) прямо из
+    массива кривой (CurvePoints), без копирования, так что кадр не передаёт
+    кривую заново. Для отрисовки длинной кривой берутся только
+    вершины, значимые при текущем масштабе (Дуглас–Пекер с допуском в долю
+    пикселя экрана); индексы пересчитываются, когда допуск меняется вдвое.
+    """
+    LOD_MIN_POINTS = 256  # Короткие кривые рисуются целиком
+    LOD_TOLERANCE_PX = 0.5  # Допустимое отклонение упрощённой кривой на экране
+
+    def __init__(self):
+        self.count = 0  # Сколько вершин кривой уже в буфере
+        self.revision = None
+        self._vertex_array = 0
+        self._vertex_buffer = 0
+        self._index_buffer = 0
+        self._capacity = 0  # Ёмкость буфера вершин в точках
+        self._source = None  # Точки кривой (для расчёта упрощения)
+        self._tolerances = None  # Допуск, при котором вершина ещё нужна (для каждой вершины)
+        self._lod_key = None  # (степень двойки допуска, count) для индексов в _index_buffer
+        self._lod_count = 0
+
+    def sync(self, points, revision):
+        """Догружает новые точки CurvePoints; при правке старых (другая revision) загружает всё заново"""
+        if revision != self.revision or len(points) < self.count:
+            self.revision = revision
+            self.count = 0
+            self._lod_key = None  # Точки могли сдвинуться при том же их числе
+        self._source = points
+        if len(points) == self.count:
+            return
+        vertices = points.array
+        start = self.count
+        self.count = len(vertices)
+        self._tolerances = None
+
+        if not self._vertex_array:
+            self._vertex_array = glGenVertexArrays(1)
+            self._vertex_buffer = glGenBuffers(1)
+            self._index_buffer = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self._vertex_buffer)
+        if self._capacity < self.count:
+            # Ёмкость выросла: буфер создаётся заново и получает все точки
+            self._capacity = max(self.count, self._capacity * 2, 64)
+            glBufferData(GL_ARRAY_BUFFER, self._capacity * 8, None, GL_DYNAMIC_DRAW)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, vertices.nbytes, vertices)
+            glBindVertexArray(self._vertex_array)
+            glEnableVertexAttribArray(0)
+            glVertexAttribPointer(0, 2, GL_FLOAT, GL_FALSE, 0, None)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._index_buffer)
+            glBindVertexArray(0)
+        else:
+            glBufferSubData(GL_ARRAY_BUFFER, start * 8, vertices[start:].nbytes, vertices[start:])
+
+    def draw(self, mode, scale):
+        """Рисует вершины (mode — GL_LINE_STRIP или GL_POINTS).
+
+        scale — пикселей экрана на единицу координат; 0 — без упрощения.
+        """
+        if not self.count:
+            return
+        glBindVertexArray(self._vertex_array)
+        if self.count < self.LOD_MIN_POINTS or scale <= 0:
+            glDrawArrays(mode, 0, self.count)
+        else:
+            glDrawElements(mode, self._lod_indices(scale), GL_UNSIGNED_INT, None)
+        glBindVertexArray(0)
+
+    def release(self):
+        """Удаляет буферы (нужен текущий контекст OpenGL)"""
+        if self._vertex_array:
+            glDeleteBuffers(2, [self._vertex_buffer, self._index_buffer])
+            glDeleteVertexArrays(1, [self._vertex_array])
+            self._vertex_array = self._vertex_buffer = self._index_buffer = 0
+
+    def _lod_indices(self, scale):
+        """Загружает индексы вершин для масштаба и возвращает их число"""
+        tolerance_log2 = math.floor(math.log2(self.LOD_TOLERANCE_PX / scale))
+        key = (tolerance_log2, self.count)
+        if key != self._lod_key:
+            if self._tolerances is None:
+                self._tolerances = simplification_tolerances(self._source.array[:self.count])
+            indices = np.flatnonzero(self._tolerances > 2.0 ** tolerance_log2).astype(np.uint32)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._index_buffer)
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_DYNAMIC_DRAW)
+            self._lod_key = key
+            self._lod_count = len(indices)
+        return self._lod_count
+
+
+def simplification_tolerances(points):
+    """Для каждой вершины — наибольший допуск Дугласа–Пекера, при котором она остаётся.
+
+    Упрощение с допуском t — это вершины, у которых значение больше t,
+    поэтому один расчёт годится для любого масштаба. Концы кривой не отбрасываются.
+    """
+    count = len(points)
+    tolerances = np.zeros(count)
+    if count == 0:
+        return tolerances
+    tolerances[0] = tolerances[-1] = np.inf
+    points = points.astype(np.float64)
+    stack = [(0, count - 1, np.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        chord = points[last] - points[first]
+        offsets = points[first + 1:last] - points[first]
+        length = math.hypot(chord[0], chord[1])
+        if length > 0:
+            distances = np.abs(chord[0] * offsets[:, 1] - chord[1] * offsets[:, 0]) / length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = int(np.argmax(distances))
+        # Вершина не может пережить ту, что делит объемлющий участок
+        value = min(distances[farthest], parent)
+        index = first + 1 + farthest
+        tolerances[index] = value
+        stack.append((first, index, value))
+        stack.append((index, last, value))
+    return tolerances
+
+
+class SceneRenderer:
+    """Шейдерная отрисовка: все преобразования — одна матрица в uniform.
+
+    Тайлы лежат в слоях страниц (массивов текстур) TextureManager, поэтому
+    видимые тайлы растра рисуются одним glDrawArraysInstanced на страницу:
+    прямоугольник, слой и привязка текстуры каждого тайла — атрибуты его
+    экземпляра, а подмена грубым уровнем меняет только их. Сетку шкал растра рисует фрагментный шейдер за один
+    вызов, а кривые векторизации живут в видеопамяти (CurveBuffer)
+    и лишь дописываются. Растры можно нарисовать один раз в текстуру слоя
+    (begin_layer/end_layer) и дальше только копировать её на экран (draw_layer).
+    Резкость повышается уже на экранном изображении растра (begin_sharpen/
+    end_sharpen), поэтому на стыках тайлов не видно швов.
+    """
+
+    def __init__(self):
+        self._tile_program = None
+        self._image_program = None
+        self._line_program = None
+        self._point_program = None
+        self._grid_program = None
+        self._fill_program = None
+        self._uniforms = {}
+        self._quad_vao = 0  # Один четырёхугольник, вершины которого задаются каждый раз
+        self._quad_vbo = 0
+        self._tile_vao = 0  # Атрибуты экземпляров-тайлов, заполняются в каждом draw_tiles
+        self._tile_vbo = 0
+        self._viewport = (1, 1)
+        self._curve_buffers = {}  # id(кривой) -> (кривая, CurveBuffer)
+        self._layer = _RenderTarget(GL_NEAREST)  # Слой растров
+        self._scratch = _RenderTarget(GL_LINEAR)  # Растр до нерезкого маскирования
+        self._target_framebuffer = 0  # Куда сейчас рисуются растры: слой или окно
+
+    def initialize(self):
+        """Компилирует шейдеры (нужен текущий контекст OpenGL 3.3 core)"""
+        self._tile_program = _link_program(_TILE_VERTEX_SHADER, _TILE_FRAGMENT_SHADER)
+        self._image_program = _link_program(_IMAGE_VERTEX_SHADER, _IMAGE_FRAGMENT_SHADER)
+        self._line_program = _link_program(_LINE_VERTEX_SHADER, _LINE_FRAGMENT_SHADER, _LINE_GEOMETRY_SHADER)
+        self._point_program = _link_program(_LINE_VERTEX_SHADER, _POINT_FRAGMENT_SHADER)
+        self._grid_program = _link_program(_GRID_VERTEX_SHADER, _GRID_FRAGMENT_SHADER)
+        self._fill_program = _link_program(_GRID_VERTEX_SHADER, _FILL_FRAGMENT_SHADER)
+        for program in (self._tile_program, self._image_program, self._line_program, self._point_program,
+                        self._grid_program, self._fill_program):
+            for name in ("u_matrix", "u_tex_map", "u_tint", "u_texture", "u_viewport", "u_point_size",
+                         "u_rows", "u_columns", "u_color", "u_line_width",
+                         "u_levels", "u_gamma", "u_invert", "u_sharpen"):
+                self._uniforms[program, name] = glGetUniformLocation(program, name)
+
+        self._quad_vao = glGenVertexArrays(1)
+        self._quad_vbo = glGenBuffers(1)
+        glBindVertexArray(self._quad_vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self._quad_vbo)
+        glBufferData(GL_ARRAY_BUFFER, 4 * 2 * 4, None, GL_DYNAMIC_DRAW)
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(0, 2, GL_FLOAT, GL_FALSE, 0, None)
+
+        self._tile_vao = glGenVertexArrays(1)
+        self._tile_vbo = glGenBuffers(1)
+        glBindVertexArray(self._tile_vao)
+        for location in range(3):
+            glEnableVertexAttribArray(location)
+            glVertexAttribDivisor(location, 1)  # Один набор на экземпляр, а не на вершину
+        glBindVertexArray(0)
+
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        glEnable(GL_PROGRAM_POINT_SIZE)
+
+    def resize(self, width, height):
+        self._viewport = (max(1, width), max(1, height))
+        glViewport(0, 0, width, height)
+
+    def draw_tiles(self, tile_manager, matrix, tint, draws, display=None):
+        """draws — пары (тайл, тайл с текстурой): второй может быть грубее и накрывать первый.
+
+        display — коррекция изображения (black_level, white_level, gamma, invert) или None;
+        резкость тайлам не добавляется, для неё растр рисуется между begin_sharpen и end_sharpen.
+        """
+        if not draws:
+            return
+        # Экземпляр тайла: rect (4), tex_map (4), tex_layer (3) и выравнивание до 12 чисел
+        instances = np.zeros((len(draws), 12), dtype=np.float32)
+        pages = np.empty(len(draws), dtype=np.int64)
+        layer_size = float(tile_manager.tile_size)
+        for index, (tile, texture_tile) in enumerate(draws):
+            span_x = texture_tile.data_width << texture_tile.level
+            span_y = texture_tile.data_height << texture_tile.level
+            tex_y = texture_tile.y
+            if texture_tile.tex_flipped:
+                tex_y, span_y = tex_y + span_y, -span_y
+            instances[index, :11] = (tile.x, tile.y, tile.x + tile.width, tile.y + tile.height,
+                                     texture_tile.x, tex_y, span_x, span_y, texture_tile.texture_layer,
+                                     texture_tile.data_width / layer_size, texture_tile.data_height / layer_size)
+            pages[index] = texture_tile.texture_id
+        # Тайлы не перекрываются, поэтому порядок не важен: группируем по страницам
+        order = np.argsort(pages, kind='stable')
+        instances = instances[order]
+        pages = pages[order]
+        starts = np.flatnonzero(np.diff(pages, prepend=-1))
+
+        program = self._tile_program
+        glUseProgram(program)
+        self._set_matrix(program, matrix)
+        self._set_display(program, display)
+        glUniform4f(self._uniforms[program, "u_tint"], *tint)
+        glUniform1i(self._uniforms[program, "u_texture"], 0)
+        glActiveTexture(GL_TEXTURE0)
+        glBindVertexArray(self._tile_vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self._tile_vbo)
+        glBufferData(GL_ARRAY_BUFFER, instances.nbytes, instances, GL_STREAM_DRAW)
+
+        stride = instances.strides[0]
+        for start, end in zip(starts, list(starts[1:]) + [len(pages)]):
+            offset = int(start) * stride
+            for location, (size, field) in enumerate(((4, 0), (4, 16), (3, 32))):
+                glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(offset + field))
+            glBindTexture(GL_TEXTURE_2D_ARRAY, int(pages[start]))
+            glDrawArraysInstanced(GL_TRIANGLE_STRIP, 0, 4, int(end - start))
+        glBindVertexArray(0)
+
+    def draw_curve(self, curve, matrix, scale, color, width, point_size=0.0, simplify=True):
+        """Кривая векторизации из её буфера в видеопамяти.
+
+        scale — сколько пикселей экрана приходится на единицу координат кривой.
+        Упрощение пересчитывается после каждой новой точки, поэтому для
+        кривой, которую ещё рисуют, его лучше выключать (simplify=False).
+        """
+        if not simplify:
+            scale = 0
+        entry = self._curve_buffers.get(id(curve))
+        if entry is None or entry[0] is not curve:
+            entry = (curve, CurveBuffer())
+            self._curve_buffers[id(curve)] = entry
+        buffer = entry[1]
+        buffer.sync(curve.points, curve.revision)
+
+        program = self._line_program
+        glUseProgram(program)
+        self._set_matrix(program, matrix)
+        glUniform2f(self._uniforms[program, "u_viewport"], *self._viewport)
+        # Цвет и ширина общие для всей кривой: постоянные атрибуты вместо массивов
+        glVertexAttrib4f(1, *color)
+        glVertexAttrib1f(2, width)
+        if buffer.count > 1:
+            buffer.draw(GL_LINE_STRIP, scale)
+
+        if point_size > 0:
+            program = self._point_program
+            glUseProgram(program)
+            self._set_matrix(program, matrix)
+            glUniform1f(self._uniforms[program, "u_point_size"], point_size)
+            glVertexAttrib4f(1, *color)
+            buffer.draw(GL_POINTS, scale)
+
+    def release_curves(self, keep=()):
+        """Удаляет буферы кривых, которых нет в keep (нужен текущий контекст OpenGL)"""
+        keep_ids = {id(curve) for curve in keep}
+        for key in [key for key in self._curve_buffers if key not in keep_ids]:
+            self._curve_buffers.pop(key)[1].release()
+
+    def draw_scale_grid(self, matrix, rect, rows, columns, color, width):
+        """Линии шкал растра за один проход фрагментного шейдера.
+
+        rect — (x0, y0, x1, y1) в локальных координатах растра: рисуется только он,
+        обычно это видимая часть растра. rows и columns — (шаг, первый номер,
+        последний номер) линий по y и по x или None, если шкала скрыта.
+        """
+        x0, y0, x1, y1 = rect
+        if x1 <= x0 or y1 <= y0 or (rows is None and columns is None):
+            return
+        program = self._grid_program
+        glUseProgram(program)
+        self._set_matrix(program, matrix)
+        glUniform4f(self._uniforms[program, "u_rows"], *(rows + (1.0,) if rows else (0.0, 0.0, 0.0, 0.0)))
+        glUniform4f(self._uniforms[program, "u_columns"], *(columns + (1.0,) if columns else (0.0, 0.0, 0.0, 0.0)))
+        glUniform4f(self._uniforms[program, "u_color"], *color)
+        glUniform1f(self._uniforms[program, "u_line_width"], width)
+
+        self._draw_quad(rect)
+
+    def fill_rect(self, matrix, rect, color):
+        """Заливка прямоугольника rect (x0, y0, x1, y1) цветом color с учётом прозрачности"""
+        program = self._fill_program
+        glUseProgram(program)
+        self._set_matrix(program, matrix)
+        glUniform4f(self._uniforms[program, "u_color"], *color)
+        self._draw_quad(rect)
+
+    def begin_layer(self):
+        """Направляет отрисовку в текстуру слоя растров и очищает её; False — слой недоступен"""
+        try:
+            self._layer.bind(self._viewport)
+        except Exception as e:
+            print(f"Слой растров недоступен, растры рисуются в каждом кадре: {str(e)}")
+            self._layer.delete()
+            return False
+        self._target_framebuffer = self._layer.framebuffer
+        glClear(GL_COLOR_BUFFER_BIT)
+        return True
+
+    def end_layer(self, target_framebuffer):
+        """Возвращает отрисовку в кадровый буфер окна (у QOpenGLWidget он не нулевой)"""
+        glBindFramebuffer(GL_FRAMEBUFFER, target_framebuffer)
+        self._target_framebuffer = target_framebuffer
+
+    def draw_layer(self):
+        """Копирует слой растров на весь экран"""
+        # Слой непрозрачен: копия без смешивания переносит пиксели как есть
+        self._draw_texture(self._layer.texture, None, 0.0, (1.0, 1.0, 1.0, 1.0), blend=False)
+
+    def begin_sharpen(self):
+        """Направляет отрисовку растра в прозрачную вспомогательную текстуру; False — она недоступна.
+
+        Тайлы рисуются туда без коррекции, а end_sharpen переносит растр на место.
+        """
+        try:
+            self._scratch.bind(self._viewport)
+        except Exception as e:
+            print(f"Повышение резкости недоступно: {str(e)}")
+            self._scratch.delete()
+            glBindFramebuffer(GL_FRAMEBUFFER, self._target_framebuffer)
+            return False
+        glClearBufferfv(GL_COLOR, 0, (0.0, 0.0, 0.0, 0.0))
+        return True
+
+    def end_sharpen(self, display, radius, tint):
+        """Переносит растр из вспомогательной текстуры туда, где он рисовался до begin_sharpen:
+        нерезкое маскирование (radius — в пикселях экрана), затем коррекция display и tint.
+        """
+        glBindFramebuffer(GL_FRAMEBUFFER, self._target_framebuffer)
+        self._draw_texture(self._scratch.texture, display, radius, tint)
+
+    def release(self):
+        """Удаляет шейдеры и буферы (нужен текущий контекст OpenGL)"""
+        self.release_curves()
+        self._layer.delete()
+        self._scratch.delete()
+        for program in (self._tile_program, self._image_program, self._line_program, self._point_program,
+                        self._grid_program, self._fill_program):
+            if program:
+                glDeleteProgram(program)
+        self._tile_program = self._image_program = self._line_program = self._point_program = None
+        self._grid_program = self._fill_program = None
+        if self._quad_vbo:
+            glDeleteBuffers(2, [self._quad_vbo, self._tile_vbo])
+            glDeleteVertexArrays(2, [self._quad_vao, self._tile_vao])
+            self._quad_vbo = self._quad_vao = self._tile_vbo = self._tile_vao = 0
+
+    def _draw_quad(self, rect):
+        x0, y0, x1, y1 = rect
+        vertices = np.array([(x0, y0), (x1, y0), (x0, y1), (x1, y1)], dtype=np.float32)
+        glBindVertexArray(self._quad_vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self._quad_vbo)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, vertices.nbytes, vertices)
+        glDrawArrays(GL_TRIANGLE_STRIP, 0, 4)
+        glBindVertexArray(0)
+
+    def _draw_texture(self, texture, display, sharpen_radius, tint, blend=True):
+        """Текстура размером с окно (слой или вспомогательная) на весь экран"""
+        width, height = self._viewport
+        program = self._image_program
+        glUseProgram(program)
+        self._set_matrix(program, ortho(width, height))
+        self._set_display(program, display, sharpen_radius)
+        # Строки текстуры кадрового буфера идут снизу вверх
+        glUniform4f(self._uniforms[program, "u_tex_map"], 0.0, height, width, -height)
+        glUniform4f(self._uniforms[program, "u_tint"], *tint)
+        glUniform1i(self._uniforms[program, "u_texture"], 0)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        if not blend:
+            glDisable(GL_BLEND)
+        self._draw_quad((0.0, 0.0, width, height))
+        glEnable(GL_BLEND)
+
+    def _set_matrix(self, program, matrix):
+        glUniformMatrix3fv(self._uniforms[program, "u_matrix"], 1, GL_TRUE, matrix.astype(np.float32))
+
+    def _set_display(self, program, display, sharpen_radius=0.0):
+        """Коррекция изображения; резкость — только при sharpen_radius > 0 (в текселях текстуры)"""
+        if display is None:
+            glUniform2f(self._uniforms[program, "u_levels"], 0.0, 1.0)
+            glUniform1f(self._uniforms[program, "u_gamma"], 1.0)
+            glUniform1i(self._uniforms[program, "u_invert"], 0)
+            glUniform2f(self._uniforms[program, "u_sharpen"], 0.0, 0.0)
+            return
+        glUniform2f(self._uniforms[program, "u_levels"], display.black_level, display.white_level)
+        glUniform1f(self._uniforms[program, "u_gamma"], max(display.gamma, 0.01))
+        glUniform1i(self._uniforms[program, "u_invert"], int(display.invert))
+        if sharpen_radius > 0:
+            glUniform2f(self._uniforms[program, "u_sharpen"], display.sharpen_amount, sharpen_radius)
+        else:
+            glUniform2f(self._uniforms[program, "u_sharpen"], 0.0, 0.0)
+
+
+class _RenderTarget:
+    """Текстура размером с окно и кадровый буфер для отрисовки в неё"""
+
+    def __init__(self, texture_filter):
+        self.texture_filter = texture_filter
+        self.framebuffer = 0
+        self.texture = 0
+        self.size = None
+
+    def bind(self, size):
+        """Привязывает кадровый буфер; при смене размера окна он создаётся заново"""
+        if self.size != size:
+            self._create(size)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+
+    def _create(self, size):
+        self.delete()
+        width, height = size
+        self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, self.texture_filter)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, self.texture_filter)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        self.framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture, 0)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError(f"кадровый буфер не готов (0x{int(status):x})")
+        self.size = size
+
+    def delete(self):
+        if self.framebuffer:
+            glDeleteFramebuffers(1, [self.framebuffer])
+        if self.texture:
+            glDeleteTextures([self.texture])
+        self.framebuffer = self.texture = 0
+        self.size = None
+
+
+def _link_program(vertex_source, fragment_source, geometry_source=None):
+    program = glCreateProgram()
+    shaders = [(GL_VERTEX_SHADER, vertex_source), (GL_FRAGMENT_SHADER, fragment_source)]
+    if geometry_source:
+        shaders.append((GL_GEOMETRY_SHADER, geometry_source))
+    for shader_type, source in shaders:
+        shader = glCreateShader(shader_type)
+        glShaderSource(shader, source)
+        glCompileShader(shader)
+        if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+            raise RuntimeError(f"Ошибка компиляции шейдера: {glGetShaderInfoLog(shader).decode(errors='replace')}")
+        glAttachShader(program, shader)
+        glDeleteShader(shader)  # Удалится вместе с программой
+    glLinkProgram(program)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        raise RuntimeError(f"Ошибка сборки шейдеров: {glGetProgramInfoLog(program).decode(errors='replace')}")
+    return program
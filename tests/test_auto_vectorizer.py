@@ -0,0 +1,91 @@
+# Автоматическая векторизация: полосы тайлов и сшивка линий на их границах
+
+import numpy as np
+import pytest
+
+from auto_vectorizer import AutoVectorizer
+from tile_manager import TileManager
+from trace_follower import STOP_EDGE, TraceFollower
+
+WIDTH, HEIGHT, TILE_SIZE = 1200, 256, 64
+
+
+def line_y(x):
+    # Размах больше высоты полосы: линия пересекает все три границы полос
+    return 128 + 100 * np.sin(x / 90)
+
+
+def make_raster(path=None, noise=8):
+    """Серый растр с одной тёмной линией толщиной ~3 пикселя на шумной бумаге"""
+    rng = np.random.default_rng(1)
+    xs = np.arange(WIDTH) + 0.5
+    ys = np.arange(HEIGHT)[:, None] + 0.5
+    slope = 100 / 90 * np.cos(xs / 90)
+    distance = np.abs(ys - line_y(xs)) / np.sqrt(1 + slope ** 2)
+    pixels = (235 - 215 * np.clip(2.0 - distance, 0, 1) + rng.normal(0, noise, (HEIGHT, WIDTH)))
+    pixels = pixels.clip(0, 255).astype(np.uint8)
+    if path is None:
+        return pixels
+    np.save(path, pixels)
+    return np.load(path, mmap_mode='r')
+
+
+def make_tile_manager(pixels):
+    tile_manager = TileManager()
+    tile_manager.tile_size = TILE_SIZE
+    tile_manager.image_width, tile_manager.image_height = WIDTH, HEIGHT
+    tile_manager.pixel_format = 'L'
+    tile_manager.level_sources = [pixels]
+    for y in range(0, HEIGHT, TILE_SIZE):
+        for x in range(0, WIDTH, TILE_SIZE):
+            tile_manager._register_tile(x, y, min(TILE_SIZE, WIDTH - x), min(TILE_SIZE, HEIGHT - y), None, 0)
+    return tile_manager
+
+
+def check_single_line(lines):
+    assert len(lines) == 1
+    points = lines[0]
+    assert (np.diff(points[:, 0]) > 0).all()
+    assert points[0, 0] < 10 and points[-1, 0] > WIDTH - 10
+    assert np.abs(points[:, 1] - line_y(points[:, 0])).max() < 1.0
+
+
+def test_line_crossing_bands_is_one_curve():
+    check_single_line(AutoVectorizer(make_tile_manager(make_raster()), workers=1).run())
+
+
+def test_tiles_in_memory():
+    pixels = make_raster()
+    tile_manager = make_tile_manager(pixels)
+    for tile in tile_manager.tiles:
+        tile.pixels = pixels[tile.y:tile.y + tile.height, tile.x:tile.x + tile.width]
+    tile_manager.level_sources = [None]
+    check_single_line(AutoVectorizer(tile_manager, workers=1).run())
+
+
+def test_process_pool_matches_single_process(tmp_path):
+    pixels = make_raster(str(tmp_path / "raster.npy"))
+    single = AutoVectorizer(make_tile_manager(pixels), workers=1).run()
+    pooled = AutoVectorizer(make_tile_manager(pixels), workers=2).run()
+    check_single_line(pooled)
+    assert np.array_equal(single[0], pooled[0])
+
+
+def test_cancelled_run_returns_none():
+    assert AutoVectorizer(make_tile_manager(make_raster()), workers=1).run(is_cancelled=lambda: True) is None
+
+
+def test_trace_follower_reaches_both_edges():
+    x = 600.5
+    result = TraceFollower(make_tile_manager(make_raster())).trace(x, float(line_y(x)))
+    assert result.stops == (STOP_EDGE, STOP_EDGE)
+    points = result.points
+    assert points[:, 0].min() < 5 and points[:, 0].max() > WIDTH - 5
+    # Отклонение по вертикали: на крутых участках оно больше, чем поперёк линии
+    errors = np.abs(points[:, 1] - line_y(points[:, 0]))
+    assert np.median(errors) < 0.3 and errors.max() < 1.5
+
+
+def test_trace_follower_misses_blank_paper():
+    pixels = make_raster(noise=4)
+    assert TraceFollower(make_tile_manager(pixels)).trace(600.5, float(line_y(600.5)) + 60) is None
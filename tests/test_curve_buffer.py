@@ -0,0 +1,52 @@
+# Буфер кривой: индексы упрощённой кривой после правки вершин
+
+import numpy as np
+import pytest
+
+import renderer
+from curve_points import CurvePoints
+from renderer import CurveBuffer
+
+
+@pytest.fixture
+def index_uploads(monkeypatch):
+    """Вызовы OpenGL заменяются заглушками; возвращает загруженные в буфер индексов массивы"""
+    uploads = []
+
+    def buffer_data(target, size, data, usage):
+        if target == renderer.GL_ELEMENT_ARRAY_BUFFER:
+            uploads.append(np.array(data))
+
+    for name in ('glBindBuffer', 'glBufferSubData', 'glBindVertexArray',
+                 'glEnableVertexAttribArray', 'glVertexAttribPointer'):
+        monkeypatch.setattr(renderer, name, lambda *args: None)
+    monkeypatch.setattr(renderer, 'glGenVertexArrays', lambda count: 1)
+    monkeypatch.setattr(renderer, 'glGenBuffers', lambda count: 1)
+    monkeypatch.setattr(renderer, 'glBufferData', buffer_data)
+    return uploads
+
+
+def test_moved_vertex_updates_lod_indices(index_uploads):
+    points = CurvePoints(np.column_stack((np.arange(1000.0), np.zeros(1000))))
+    buffer = CurveBuffer()
+    buffer.sync(points, 0)
+    buffer._lod_indices(0.1)
+    assert index_uploads[-1].tolist() == [0, 999]
+
+    # Правка на месте: число точек то же, меняется только revision
+    points.set(500, 500.0, 300.0)
+    buffer.sync(points, 1)
+    count = buffer._lod_indices(0.1)
+    assert 500 in index_uploads[-1].tolist()
+    assert count == len(index_uploads[-1])
+
+
+def test_appended_points_extend_lod_indices(index_uploads):
+    points = CurvePoints(np.column_stack((np.arange(500.0), np.zeros(500))))
+    buffer = CurveBuffer()
+    buffer.sync(points, 0)
+    buffer._lod_indices(0.1)
+    points.extend([(500.0, 300.0), (501.0, 0.0)])
+    buffer.sync(points, 0)
+    buffer._lod_indices(0.1)
+    assert index_uploads[-1].tolist() == [0, 499, 500, 501]
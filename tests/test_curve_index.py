@@ -0,0 +1,70 @@
+# Индекс вершин кривой против полного перебора при случайных правках
+
+import numpy as np
+
+from curve_index import VertexIndex
+from curve_points import CurvePoints
+
+
+def brute_force_nearest(points, x, y, radius):
+    if not len(points):
+        return None
+    distances = np.hypot(points[:, 0] - x, points[:, 1] - y)
+    best = int(np.argmin(distances))
+    return (best, float(distances[best])) if distances[best] <= radius else None
+
+
+def check_query(index, points, x, y, radius):
+    expected = brute_force_nearest(points.array.astype(np.float64), x, y, radius)
+    found = index.nearest(x, y, radius)
+    if expected is None:
+        assert found is None
+    else:
+        # При равных расстояниях номера могут различаться — сравниваются расстояния
+        assert found is not None and abs(found[1] - expected[1]) < 1e-9
+
+
+def test_random_edits_match_brute_force():
+    rng = np.random.default_rng(7)
+    points = CurvePoints(rng.uniform(0, 500, (200, 2)))
+    index = VertexIndex(points)
+    for step in range(3000):
+        operation = rng.integers(5)
+        if operation == 0:
+            points.append(tuple(rng.uniform(0, 500, 2)))  # Дописанные точки индекс подхватывает сам
+        elif operation == 1 and len(points):
+            vertex = int(rng.integers(len(points)))
+            points.set(vertex, *rng.uniform(0, 500, 2))
+            index.moved(vertex)
+        elif operation == 2:
+            vertex = int(rng.integers(len(points) + 1))
+            points.insert(vertex, *rng.uniform(0, 500, 2))
+            index.inserted(vertex)
+        elif operation == 3 and len(points) > 1:
+            vertex = int(rng.integers(len(points)))
+            points.delete(vertex)
+            index.deleted(vertex)
+        x, y = rng.uniform(-20, 520, 2)
+        check_query(index, points, x, y, radius=float(rng.choice([3.0, 20.0, 2000.0])))
+
+
+def test_nearest_returns_vertex_number():
+    points = CurvePoints([(0, 0), (10, 0), (20, 0)])
+    index = VertexIndex(points)
+    assert index.nearest(11, 1, 5)[0] == 1
+    points.insert(1, 5, 0)
+    index.inserted(1)
+    assert index.nearest(11, 1, 5)[0] == 2
+    points.delete(0)
+    index.deleted(0)
+    assert index.nearest(11, 1, 5)[0] == 1
+    assert index.nearest(100, 100, 5) is None
+
+
+def test_shortened_points_rebuild_index():
+    points = CurvePoints([(0, 0), (10, 0), (20, 0)])
+    index = VertexIndex(points)
+    assert index.nearest(20, 0, 1)[0] == 2
+    points.clear()  # В обход индекса
+    points.append((20, 0))
+    assert index.nearest(20, 0, 1)[0] == 0
@@ -0,0 +1,168 @@
+# Планировщик кадров: пачки событий ввода дают один кадр за такт, плавный масштаб сам просит кадры
+
+import math
+
+import pytest
+from PyQt5.QtCore import QObject, QPointF, pyqtSignal
+
+import frame_scheduler
+from frame_scheduler import FrameScheduler
+
+FRAME_TIME = 1 / 60
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeWidget(QObject):
+    """Вместо GLWidget: камера, счётчик update() и смена буферов по команде"""
+    frameSwapped = pyqtSignal()
+
+    def __init__(self, zoom=1.0, pan=QPointF(0, 0)):
+        super().__init__()
+        self.zoom = zoom
+        self.pan = QPointF(pan)
+        self.updates = 0
+        self.frames = 0
+
+    def update(self):
+        self.updates += 1
+
+
+class FakeRaster:
+    def __init__(self):
+        self.position = QPointF(0, 0)
+
+
+class FakeCurve:
+    def __init__(self):
+        self.moves = []
+
+    def move_vertex(self, index, x, y):
+        self.moves.append((index, x, y))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(frame_scheduler.time, "perf_counter", clock)
+    return clock
+
+
+def tick(widget, scheduler, clock):
+    """Такт вертикальной синхронизации: если кадр запрошен — paintGL и смена буферов"""
+    clock.now += FRAME_TIME
+    if widget.updates == widget.frames:
+        return False
+    widget.frames = widget.updates
+    scheduler.apply()
+    widget.frameSwapped.emit()
+    return True
+
+
+def test_burst_of_pan_and_wheel_events_gives_one_frame(clock):
+    widget = FakeWidget()
+    scheduler = FrameScheduler(widget, smooth_zoom=False)
+    for _ in range(25):
+        scheduler.pan_by(QPointF(2, -1))
+    for _ in range(10):
+        scheduler.zoom_at(QPointF(400, 300), 1.1)
+    assert widget.updates == 1
+    assert widget.zoom == 1.0 and widget.pan == QPointF(0, 0)  # До кадра камера не меняется
+
+    assert tick(widget, scheduler, clock)
+    assert widget.zoom == pytest.approx(1.1 ** 10)
+    # Сдвиг копится, а каждый щелчок колеса масштабирует вокруг точки под курсором
+    pan_x, pan_y = 50.0, -25.0
+    for _ in range(10):
+        pan_x, pan_y = 400 - (400 - pan_x) * 1.1, 300 - (300 - pan_y) * 1.1
+    assert widget.pan.x() == pytest.approx(pan_x) and widget.pan.y() == pytest.approx(pan_y)
+
+    assert not tick(widget, scheduler, clock)  # Без нового ввода кадров больше нет
+    assert widget.frames == 1
+
+
+def test_burst_of_moves_is_applied_once_per_frame(clock):
+    widget = FakeWidget(zoom=2.0)
+    scheduler = FrameScheduler(widget)
+    raster, curve = FakeRaster(), FakeCurve()
+    for step in range(40):
+        scheduler.move_object(raster, QPointF(3, 1))
+        scheduler.move_vertex(curve, 7, step, -step)
+    assert widget.updates == 1
+
+    assert tick(widget, scheduler, clock)
+    # Сдвиг растра — в пикселях экрана, то есть делится на масштаб
+    assert raster.position == QPointF(60, 20)
+    # Кривая правится один раз, последним положением вершины
+    assert curve.moves == [(7, 39, -39)]
+
+    for step in range(5):
+        scheduler.move_object(raster, QPointF(-2, 0))
+    assert tick(widget, scheduler, clock)
+    assert raster.position == QPointF(55, 20)
+    assert curve.moves == [(7, 39, -39)]
+    assert widget.frames == 2
+
+
+def test_smooth_zoom_requests_frames_until_target(clock):
+    widget = FakeWidget()
+    scheduler = FrameScheduler(widget)
+    anchor = QPointF(200, 150)
+    scheduler.zoom_at(anchor, 2.0)
+    # Точка сцены, которая в конце окажется под курсором
+    anchor_scene = (anchor - scheduler.target_pan) / scheduler.target_zoom
+
+    zooms = []
+    while tick(widget, scheduler, clock):
+        zooms.append(widget.zoom)
+        assert scheduler.is_animating() == (widget.zoom != 2.0)
+        # Точка под курсором остаётся на месте в каждом кадре анимации
+        screen = anchor_scene * widget.zoom + widget.pan
+        assert screen.x() == pytest.approx(anchor.x()) and screen.y() == pytest.approx(anchor.y())
+        assert len(zooms) < 100
+
+    # Кадры идут сами, по одному за такт, пока масштаб не догонит целевой
+    assert zooms == sorted(zooms) and zooms[-1] == 2.0
+    steps = math.ceil(math.log(math.log(2.0) / 1e-3) * FrameScheduler.ZOOM_TIME_CONSTANT / FRAME_TIME)
+    assert len(zooms) == pytest.approx(steps, abs=1)
+    assert widget.pan == scheduler.target_pan
+    assert not scheduler.is_animating()
+    assert widget.frames == widget.updates == len(zooms)
+
+
+def test_frame_time_after_pause_is_limited(clock):
+    widget = FakeWidget()
+    scheduler = FrameScheduler(widget)
+    scheduler.zoom_at(QPointF(0, 0), 4.0)
+    tick(widget, scheduler, clock)
+    # Первый кадр анимации — фиксированный шаг, а не время с прошлой анимации
+    first = math.log(4.0) * (1 - math.exp(-FrameScheduler.FIRST_FRAME_TIME / FrameScheduler.ZOOM_TIME_CONSTANT))
+    assert math.log(widget.zoom) == pytest.approx(first)
+
+    # Долгий кадр (например, загрузка) не перескакивает анимацию до конца
+    clock.now += 5.0
+    before = math.log(4.0 / widget.zoom)
+    tick(widget, scheduler, clock)
+    after = math.log(4.0 / widget.zoom)
+    limit = math.exp(-FrameScheduler.MAX_FRAME_TIME / FrameScheduler.ZOOM_TIME_CONSTANT)
+    assert after == pytest.approx(before * limit)
+    assert scheduler.is_animating()
+
+
+def test_input_during_animation_does_not_add_frames(clock):
+    widget = FakeWidget()
+    scheduler = FrameScheduler(widget)
+    scheduler.zoom_at(QPointF(0, 0), 2.0)
+    tick(widget, scheduler, clock)
+    # Пока идёт анимация, кадр уже запрошен сменой буферов: ввод его не дублирует
+    for _ in range(10):
+        scheduler.pan_by(QPointF(1, 0))
+    assert widget.updates == widget.frames + 1
+    tick(widget, scheduler, clock)
+    assert widget.updates == widget.frames + 1
@@ -0,0 +1,137 @@
+# Потоковое чтение полосами против PIL.Image.open(...).load() на разных форматах и сжатиях
+
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_loader
+from image_loader import ImageLoader, _PngRowReader, _RawRowReader, _TiffRowReader
+
+WIDTH, HEIGHT = 77, 150  # Ширина не кратна 8: у битовых строк неполный последний байт
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Мелкие порции: полосы, блоки и распаковка Deflate переходят через границы много раз
+    monkeypatch.setattr(image_loader, "CHUNK_ROWS", 32)
+    monkeypatch.setattr(_TiffRowReader, "_READ_SIZE", 256)
+
+
+def make_image(mode, seed=1):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:HEIGHT, 0:WIDTH]
+    base = (x * 3 + y * 2) % 256  # Плавный фон, на котором видны ошибки предсказателя
+    if mode == '1':
+        return Image.fromarray(rng.random((HEIGHT, WIDTH)) > 0.5)
+    channels = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}[mode]
+    data = (base[..., None] + rng.integers(0, 40, (HEIGHT, WIDTH, channels))) % 256
+    return Image.fromarray(data.astype(np.uint8).squeeze(), mode)
+
+
+def expected_pixels(path, pixel_format):
+    image = Image.open(path)
+    image.load()
+    if pixel_format == '1':
+        return np.packbits(np.asarray(image.convert('1')), axis=1)
+    return np.asarray(image.convert(pixel_format))
+
+
+def read_bands(path, band_height=40):
+    loader = ImageLoader()
+    loader.open(path)
+    reader = type(loader._reader)
+    mapped = loader.pixel_map is not None
+    bands = list(loader.iter_bands(band_height))
+    assert [y for y, _ in bands] == list(range(0, HEIGHT, band_height))
+    return loader.pixel_format, np.concatenate([band for _, band in bands]), reader, mapped
+
+
+def check_file(path, reader_class, mapped=False):
+    pixel_format, pixels, reader, is_mapped = read_bands(path)
+    assert reader is reader_class
+    assert is_mapped == mapped
+    assert np.array_equal(pixels, expected_pixels(path, pixel_format))
+    return pixel_format
+
+
+@pytest.mark.parametrize("mode, predictor", [
+    ('1', 1), ('L', 1), ('L', 2), ('RGB', 1), ('RGB', 2), ('RGBA', 1), ('RGBA', 2),
+])
+def test_single_strip_deflate_tiff(tmp_path, mode, predictor):
+    path = str(tmp_path / "scan.tif")
+    info = {317: predictor} if predictor != 1 else {}
+    make_image(mode).save(path, compression='tiff_adobe_deflate', tiffinfo=info)
+    assert Image.open(path).tag_v2.get(278, HEIGHT) >= HEIGHT  # Действительно одна полоса
+    pixel_format = check_file(path, _TiffRowReader)
+    assert pixel_format == {'1': '1', 'L': 'L'}.get(mode, 'RGBA')
+
+
+@pytest.mark.parametrize("mode, rows_per_strip, predictor", [
+    ('L', 16, 1),  # Полосы меньше порции: идут как есть, несколько за раз
+    ('L', 40, 2),  # Полосы больше порции: каждая распаковывается потоком
+    ('RGB', 40, 2),
+    ('1', 40, 1),
+])
+def test_multi_strip_deflate_tiff(tmp_path, mode, rows_per_strip, predictor):
+    path = str(tmp_path / "scan.tif")
+    info = {278: rows_per_strip}
+    if predictor != 1:
+        info[317] = predictor
+    make_image(mode).save(path, compression='tiff_adobe_deflate', tiffinfo=info)
+    assert len(Image.open(path).tag_v2[273]) > 1
+    check_file(path, _TiffRowReader)
+
+
+@pytest.mark.parametrize("mode, compression", [
+    ('RGB', 'tiff_lzw'),
+    ('L', 'packbits'),
+    ('1', 'group4'),
+])
+def test_other_tiff_compressions(tmp_path, mode, compression):
+    path = str(tmp_path / "scan.tif")
+    make_image(mode).save(path, compression=compression, tiffinfo={278: 24})
+    check_file(path, _TiffRowReader)
+
+
+@pytest.mark.parametrize("mode", ['L', '1'])
+def test_uncompressed_tiff_is_memory_mapped(tmp_path, mode):
+    path = str(tmp_path / "scan.tif")
+    make_image(mode).save(path, tiffinfo={278: 20})
+    check_file(path, _TiffRowReader, mapped=True)
+
+
+@pytest.mark.parametrize("mode", ['1', 'L', 'LA', 'RGB', 'RGBA', 'P'])
+def test_png(tmp_path, mode):
+    path = str(tmp_path / "scan.png")
+    image = make_image('RGB').quantize(16) if mode == 'P' else make_image(mode)
+    image.save(path)
+    check_file(path, _PngRowReader)
+
+
+@pytest.mark.parametrize("mode, mapped", [('L', True), ('1', True), ('RGB', False)])
+def test_bottom_up_bmp(tmp_path, mode, mapped):
+    path = str(tmp_path / "scan.bmp")
+    make_image(mode).save(path)  # PIL пишет BMP снизу вверх
+    assert Image.open(path).tile[0][3][2] < 0
+    check_file(path, _RawRowReader, mapped=mapped)
+
+
+def test_top_down_bmp(tmp_path):
+    bottom_up = str(tmp_path / "bottom_up.bmp")
+    image = make_image('RGB')
+    image.save(bottom_up)
+    data = bytearray(open(bottom_up, 'rb').read())
+
+    # Отрицательная высота в заголовке — строки сверху вниз; переставляем их в файле
+    offset = struct.unpack_from('<I', data, 10)[0]
+    stride = (WIDTH * 3 + 3) & ~3
+    rows = [bytes(data[offset + i * stride:offset + (i + 1) * stride]) for i in range(HEIGHT)]
+    data[offset:offset + HEIGHT * stride] = b''.join(reversed(rows))
+    struct.pack_into('<i', data, 22, -HEIGHT)
+    path = tmp_path / "top_down.bmp"
+    path.write_bytes(bytes(data))
+
+    check_file(str(path), _RawRowReader)
+    assert np.array_equal(expected_pixels(str(path), 'RGBA'), np.asarray(image.convert('RGBA')))
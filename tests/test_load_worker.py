@@ -0,0 +1,37 @@
+# Фоновая загрузка: уровни пирамиды лежат на диске и без кэша, копии тайлов в памяти не держатся
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from load_worker import TileLoadWorker
+from tile_cache import TileCache
+from tile_manager import tile_slice
+
+
+def run_worker(path, monkeypatch, tile_cache=None):
+    # Без GUI-потока очередь никто не разбирает: пусть вмещает все тайлы
+    monkeypatch.setattr(TileLoadWorker, "MAX_QUEUED_TILES", 10 ** 6)
+    worker = TileLoadWorker(path, tile_size=64, tile_cache=tile_cache)
+    worker.run()
+    assert worker.error is None
+    return worker
+
+
+@pytest.mark.parametrize("compression", [None, 'tiff_adobe_deflate'])
+@pytest.mark.parametrize("use_cache", [False, True])
+def test_level_sources_are_on_disk(tmp_path, monkeypatch, compression, use_cache):
+    pixels = np.random.default_rng(2).integers(0, 256, (300, 200), dtype=np.uint8)
+    path = str(tmp_path / "scan.tif")
+    Image.fromarray(pixels).save(path, compression=compression)
+    tile_cache = TileCache(str(tmp_path / "cache")) if use_cache else None
+
+    worker = run_worker(path, monkeypatch, tile_cache)
+    assert len(worker.level_sources) > 1
+    assert all(isinstance(source, np.memmap) for source in worker.level_sources)
+    assert np.array_equal(worker.level_sources[0], pixels)
+
+    # Каждый тайл очереди совпадает со срезом своего уровня на диске
+    for x, y, width, height, tile_data, level, _ in worker.tile_queue:
+        expected = tile_slice(worker.level_sources[level], 'L', x, y, width, height)
+        assert np.array_equal(tile_data, expected)
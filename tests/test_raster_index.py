@@ -0,0 +1,102 @@
+# Индекс растров: попадание после сдвига, поворота и масштаба против полного перебора
+
+import numpy as np
+from PyQt5.QtCore import QPointF, QSizeF
+
+from gl_widget import RasterObject
+from raster_index import RasterIndex
+
+
+def make_raster(x, y, width, height, angle=0):
+    obj = RasterObject(None, QPointF(x, y), QSizeF(width, height))
+    obj.rotation_angle = angle
+    return obj
+
+
+def brute_force_hit(objects, point):
+    """Верхний (последний добавленный) растр, содержащий точку"""
+    for obj in reversed(objects):
+        if obj.contains_point(point):
+            return obj
+    return None
+
+
+def check_points(index, objects, rng, count=400):
+    for x, y in rng.uniform(-300, 1300, (count, 2)):
+        point = QPointF(x, y)
+        assert index.hit_test(point) is brute_force_hit(objects, point)
+
+
+def test_hit_test_after_move_rotate_and_scale():
+    rng = np.random.default_rng(3)
+    objects = [make_raster(*rng.uniform(0, 900, 2), *rng.uniform(20, 120, 2)) for _ in range(40)]
+    # Крупный растр задевает много ячеек, а самый большой — держится вне сетки
+    objects.append(make_raster(100, 100, 400, 250))
+    objects.append(make_raster(-200, -200, 1400, 1400, angle=10))
+    index = RasterIndex()
+    for obj in objects:
+        index.insert(obj)
+    check_points(index, objects, rng)
+
+    for step in range(30):
+        obj = objects[rng.integers(len(objects))]
+        change = step % 3
+        if change == 0:
+            obj.position = QPointF(*rng.uniform(-100, 1000, 2))
+        elif change == 1:
+            obj.rotation_angle = float(rng.uniform(0, 360))
+        else:
+            obj.size = QSizeF(*rng.uniform(10, 600, 2))
+        check_points(index, objects, rng, count=100)
+
+
+def test_object_spanning_cells_moves_between_buckets():
+    small = [make_raster(x * 50, 0, 40, 40) for x in range(10)]
+    wide = make_raster(0, 100, 300, 30)
+    index = RasterIndex()
+    for obj in small + [wide]:
+        index.insert(obj)
+    assert index.hit_test(QPointF(250, 110)) is wide
+
+    # Поворот на 90° вокруг центра: растр уходит из прежних ячеек в другие
+    wide.rotation_angle = 90
+    assert index.hit_test(QPointF(250, 110)) is None
+    assert index.hit_test(QPointF(150, 230)) is wide
+    assert index.hit_test(QPointF(150, -20)) is wide  # Выше малых растров, в их ячейках
+
+    wide.position = QPointF(500, 100)
+    assert index.hit_test(QPointF(150, 230)) is None
+    assert index.hit_test(QPointF(650, 230)) is wide
+
+
+def test_cleared_and_replaced_objects_are_not_found():
+    old = [make_raster(0, 0, 100, 100), make_raster(50, 50, 100, 100)]
+    index = RasterIndex()
+    for obj in old:
+        index.insert(obj)
+    assert index.hit_test(QPointF(75, 75)) is old[1]
+
+    # Замена растров (загрузка с заменой): индекс очищается и заполняется новыми
+    index.clear()
+    assert index.hit_test(QPointF(75, 75)) is None
+    assert all(obj.geometry_listener is None for obj in old)
+
+    new = make_raster(200, 200, 100, 100)
+    index.insert(new)
+    assert index.hit_test(QPointF(75, 75)) is None
+    assert index.hit_test(QPointF(250, 250)) is new
+
+    # Сдвиг удалённого растра не трогает индекс
+    old[0].position = QPointF(200, 200)
+    assert index.hit_test(QPointF(210, 210)) is new
+
+
+def test_new_objects_are_drawn_on_top():
+    index = RasterIndex()
+    bottom = make_raster(0, 0, 100, 100)
+    index.insert(bottom)
+    assert index.hit_test(QPointF(50, 50)) is bottom
+    top = make_raster(25, 25, 100, 100)
+    index.insert(top)
+    assert index.hit_test(QPointF(50, 50)) is top
+    assert index.hit_test(QPointF(10, 10)) is bottom
@@ -0,0 +1,175 @@
+# Дисковый кэш тайлов: публикация записей и одновременная запись одного файла
+
+import os
+
+import numpy as np
+import pytest
+
+from tile_cache import TileCache
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "scan.tif"
+    path.write_bytes(b"\0" * 100)
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TileCache(str(tmp_path / "cache"))
+
+
+def create(cache, source, width=16, height=8):
+    return cache.create(source, 1024, width, height, (300, 300), 'L', [(width, height)])
+
+
+def test_discard_of_old_writer_keeps_new_one(cache, source):
+    # Отменённая загрузка и новая загрузка того же файла
+    old = create(cache, source)
+    new = create(cache, source)
+    new.write_tile(0, 0, 16, 8, np.full((8, 16), 7, dtype=np.uint8), 0)
+    old.discard()
+    entry = new.commit()
+    assert entry is not None
+    assert cache.lookup(source, 1024).level_array(0).tolist() == np.full((8, 16), 7).tolist()
+
+
+def test_second_commit_replaces_published_entry(cache, source):
+    first, second = create(cache, source), create(cache, source)
+    first.write_tile(0, 0, 16, 8, np.full((8, 16), 1, dtype=np.uint8), 0)
+    second.write_tile(0, 0, 16, 8, np.full((8, 16), 2, dtype=np.uint8), 0)
+    first_entry = first.commit()
+    os.utime(os.path.join(first_entry.path, "meta.json"), (1000, 1000))
+    entry = second.commit()
+    assert entry.level_array(0)[0, 0] == 2
+    second.discard()  # Опубликованную запись discard не трогает
+    assert cache.lookup(source, 1024).path == entry.path
+    # Прежняя запись того же ключа не отображена в память и удалена при публикации новой
+    assert not os.path.exists(first_entry.path)
+
+
+def test_commit_with_open_memmap_does_not_rename(cache, source, monkeypatch):
+    # В Windows каталог с отображёнными в память файлами переименовать нельзя
+    def refuse(*args):
+        raise PermissionError("каталог занят")
+    monkeypatch.setattr(os, "rename", refuse)
+    monkeypatch.setattr(os, "renames", refuse)
+
+    writer = create(cache, source)
+    level = writer.level_array(0)  # Как level_sources загрузки и менеджера тайлов
+    writer.write_tile(0, 0, 16, 8, np.full((8, 16), 9, dtype=np.uint8), 0)
+    entry = writer.commit()
+    assert entry is not None
+    assert os.path.dirname(os.path.abspath(level.filename)) == entry.path
+    assert level[0, 0] == 9
+    assert cache.lookup(source, 1024).level_array(0)[7, 15] == 9
+
+
+def test_eviction_skips_mapped_entries(cache, source):
+    writer = create(cache, source)
+    level = writer.level_array(0)
+    entry = writer.commit()
+    cache.max_bytes = 0
+    cache.evict()
+    assert os.path.exists(entry.path)
+    assert level.sum() == 0
+
+    del level
+    cache.evict()
+    assert not os.path.exists(entry.path)
+
+
+def test_failed_commit_leaves_writer_to_discard(cache, source, monkeypatch):
+    writer = create(cache, source)
+    path = writer._path
+
+    def refuse(*args):
+        raise PermissionError("нет места")
+    monkeypatch.setattr(os, "replace", refuse)
+    assert writer.commit() is None
+    assert cache.lookup(source, 1024) is None
+    writer.discard()
+    assert not os.path.exists(path)
+
+
+def test_discarded_writer_leaves_no_entry(cache, source):
+    writer = create(cache, source)
+    writer.discard()
+    assert cache.lookup(source, 1024) is None
+    assert not os.listdir(cache.cache_dir)
+
+
+def publish(cache, source, value=0):
+    writer = create(cache, source)
+    writer.write_tile(0, 0, 16, 8, np.full((8, 16), value, dtype=np.uint8), 0)
+    return writer.commit()
+
+
+def test_lookup_hit_and_miss(cache, source):
+    assert cache.lookup(source, 1024) is None
+    publish(cache, source, 5)
+    entry = cache.lookup(source, 1024)
+    assert (entry.width, entry.height, entry.dpi, entry.pixel_format) == (16, 8, (300, 300), 'L')
+    assert entry.level_array(0)[3, 3] == 5
+    assert cache.lookup(source, 512) is None  # Другой размер тайла — другая нарезка
+
+
+def test_changed_size_invalidates_key(cache, source):
+    publish(cache, source)
+    with open(source, 'ab') as f:
+        f.write(b"\0")
+    assert cache.lookup(source, 1024) is None
+
+
+def test_changed_mtime_invalidates_key(cache, source):
+    publish(cache, source)
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert cache.lookup(source, 1024) is None
+
+
+def test_format_version_invalidates_key(cache, source, monkeypatch):
+    publish(cache, source)
+    monkeypatch.setattr(TileCache, "FORMAT_VERSION", TileCache.FORMAT_VERSION + 1)
+    assert cache.lookup(source, 1024) is None
+
+
+def entry_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    sources = []
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.tif"
+        path.write_bytes(name.encode())
+        sources.append(str(path))
+    cache = TileCache(str(tmp_path / "cache"))
+    a, b, c = sources
+
+    first = publish(cache, a)
+    publish(cache, b)
+    # «a» открывали позже «b»: вытесняться должна «b»
+    os.utime(os.path.join(first.path, "meta.json"), (1000, 1000))
+    os.utime(os.path.join(cache.lookup(b, 1024).path, "meta.json"), (500, 500))
+    cache.lookup(a, 1024)
+
+    cache.max_bytes = 2 * entry_size(first.path)
+    publish(cache, c)
+    assert cache.lookup(b, 1024) is None
+    assert cache.lookup(a, 1024) is not None
+    assert cache.lookup(c, 1024) is not None
+
+
+def test_stale_temp_directories_are_removed(cache, source):
+    # Каталог записи, брошенной после сбоя: без meta.json и без отображённых файлов
+    path = os.path.join(cache.cache_dir, f"{cache.key(source, 1024)}.1.0")
+    os.makedirs(path)
+    fresh = create(cache, source)
+    old = os.path.getmtime(path) - 2 * TileCache.STALE_TMP_SECONDS
+    os.utime(path, (old, old))
+    os.utime(fresh._path, (old, old))
+    cache.evict()
+    assert not os.path.exists(path)
+    assert os.path.exists(fresh._path)  # Ещё пишется: файлы уровней отображены в память
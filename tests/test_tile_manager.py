@@ -0,0 +1,128 @@
+# Видимые тайлы по сетке и выбор уровня пирамиды против полного перебора
+
+import math
+
+import numpy as np
+import pytest
+
+from tile_manager import TileManager, _band_x_range
+
+WIDTH, HEIGHT, TILE_SIZE = 1050, 730, 100  # Края уровней не кратны тайлу
+
+
+def make_manager():
+    """Сетка тайлов всех уровней без текстур (как после загрузки с вытесненной видеопамятью)"""
+    tm = TileManager()
+    tm.tile_size = TILE_SIZE
+    tm.image_width, tm.image_height = WIDTH, HEIGHT
+    level = 0
+    while True:
+        width, height = tm.level_size(level)
+        for y in range(0, height, TILE_SIZE):
+            for x in range(0, width, TILE_SIZE):
+                tm._register_tile(x, y, min(TILE_SIZE, width - x), min(TILE_SIZE, height - y), None, level)
+        if width <= TILE_SIZE and height <= TILE_SIZE:
+            return tm
+        level += 1
+
+
+def rotated_rect(cx, cy, width, height, angle):
+    """Четыре угла по кругу, как у экрана в пикселях растра"""
+    c, s = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    corners = [(-width / 2, -height / 2), (width / 2, -height / 2), (width / 2, height / 2), (-width / 2, height / 2)]
+    return [(cx + x * c - y * s, cy + x * s + y * c) for x, y in corners]
+
+
+def intersects(quad, x0, y0, x1, y1):
+    """Пересечение выпуклого четырёхугольника с прямоугольником по разделяющим осям"""
+    points = np.array(quad)
+    box = np.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1)])
+    axes = [(1.0, 0.0), (0.0, 1.0)]
+    axes += [(ay - by, bx - ax) for (ax, ay), (bx, by) in zip(quad, quad[1:] + quad[:1])]
+    for axis in axes:
+        a, b = points @ axis, box @ axis
+        if a.max() < b.min() or b.max() < a.min():
+            return False
+    return True
+
+
+def brute_force_visible(tm, level, quad):
+    """Тайлы, ячейка сетки которых (в пикселях уровня 0) задевает четырёхугольник"""
+    span = TILE_SIZE << level
+    return [tile for tile in tm.levels[level]
+            if intersects(quad, tile.x, tile.y, tile.x + span, tile.y + span)]
+
+
+def test_band_x_range():
+    square = [(10, 10), (50, 10), (50, 40), (10, 40)]
+    assert _band_x_range(square, 20, 30) == (10, 50)
+    assert _band_x_range(square, 0, 15) == (10, 50)
+    assert _band_x_range(square, 45, 60) is None
+
+    # Ромб: в полосе у вершины отрезок уже, чем через середину
+    diamond = [(50, 0), (100, 50), (50, 100), (0, 50)]
+    assert _band_x_range(diamond, 40, 60) == (0, 100)
+    x_min, x_max = _band_x_range(diamond, 0, 10)
+    assert x_min == pytest.approx(40) and x_max == pytest.approx(60)
+    x_min, x_max = _band_x_range(diamond, 80, 90)
+    assert x_min == pytest.approx(30) and x_max == pytest.approx(70)
+
+
+@pytest.mark.parametrize("level", [0, 1, 2, 4])
+def test_visible_tiles_match_brute_force(level):
+    tm = make_manager()
+    rng = np.random.default_rng(level)
+    for _ in range(200):
+        # Экран целиком внутри растра, на краю или за его пределами
+        quad = rotated_rect(*rng.uniform(-400, 1400, 2), *rng.uniform(20, 900, 2), rng.uniform(0, 360))
+        visible = tm.visible_tiles(level, quad)
+        assert visible == brute_force_visible(tm, level, quad)
+        assert all(tile.level == level for tile in visible)
+
+
+def test_visible_tiles_of_partly_outside_viewport():
+    tm = make_manager()
+    # Экран захватывает левый верхний угол растра и пустоту за ним
+    quad = [(-500, -300), (150, -300), (150, 120), (-500, 120)]
+    assert [(tile.x, tile.y) for tile in tm.visible_tiles(0, quad)] == [(0, 0), (100, 0), (0, 100), (100, 100)]
+    assert [(tile.x, tile.y) for tile in tm.visible_tiles(1, quad)] == [(0, 0)]
+
+    # Правый нижний угол: крайние тайлы обрезаны по растру
+    quad = [(1020, 710), (1500, 710), (1500, 900), (1020, 900)]
+    visible = tm.visible_tiles(0, quad)
+    assert [(tile.x, tile.y, tile.width, tile.height) for tile in visible] == [(1000, 700, 50, 30)]
+
+    # Повёрнутый экран, который лишь обходит растр вокруг угла
+    assert tm.visible_tiles(0, [(-200, 0), (0, -200), (-100, -300), (-300, -100)]) == []
+    assert tm.visible_tiles(0, [(2000, 2000), (2100, 2000), (2100, 2100), (2000, 2100)]) == []
+
+
+def test_visible_tiles_of_whole_image():
+    tm = make_manager()
+    quad = [(-10, -10), (WIDTH + 10, -10), (WIDTH + 10, HEIGHT + 10), (-10, HEIGHT + 10)]
+    for level, tiles in enumerate(tm.levels):
+        assert tm.visible_tiles(level, quad) == tiles
+
+
+def test_level_for_scale():
+    tm = make_manager()
+    last = len(tm.levels) - 1
+    assert last == 4
+    assert tm.level_for_scale(3.0) == 0
+    assert tm.level_for_scale(1.0) == 0
+    assert tm.level_for_scale(0.5) == 1
+    assert tm.level_for_scale(0.3) == 1
+    assert tm.level_for_scale(0.25) == 2
+    assert tm.level_for_scale(1e-4) == last
+    assert tm.level_for_scale(0.0) == last
+
+    # Тексель выбранного уровня не крупнее пикселя экрана, а следующего — уже крупнее
+    for scale in np.geomspace(0.04, 1.0, 50):
+        level = tm.level_for_scale(scale)
+        assert scale * (1 << level) <= 1.0 + 1e-9
+        assert scale * (2 << level) > 1.0
+
+
+def test_level_for_scale_without_pyramid():
+    tm = TileManager()
+    assert tm.level_for_scale(0.01) == 0
@@ -0,0 +1,97 @@
+# Следование по линии: синтетические отрезки, остановка на разрыве, краю, пересечении и незагруженном тайле
+
+import numpy as np
+
+from tile_manager import TileManager
+from trace_follower import (STOP_CROSSING, STOP_EDGE, STOP_GAP, STOP_UNLOADED, TileGrayReader,
+                            TraceFollower)
+
+WIDTH, HEIGHT, TILE_SIZE = 1200, 256, 64
+
+
+def draw(segments):
+    """Бумага с тёмными отрезками толщиной ~3 пикселя: segments — ((x0, y0), (x1, y1))"""
+    ys, xs = np.mgrid[0:HEIGHT, 0:WIDTH] + 0.5
+    distance = np.full((HEIGHT, WIDTH), np.inf)
+    for (x0, y0), (x1, y1) in segments:
+        dx, dy = x1 - x0, y1 - y0
+        t = np.clip(((xs - x0) * dx + (ys - y0) * dy) / (dx * dx + dy * dy), 0, 1)
+        distance = np.minimum(distance, np.hypot(xs - x0 - t * dx, ys - y0 - t * dy))
+    noise = np.random.default_rng(4).normal(0, 5, (HEIGHT, WIDTH))
+    return (235 - 215 * np.clip(2.0 - distance, 0, 1) + noise).clip(0, 255).astype(np.uint8)
+
+
+def make_tile_manager(pixels, loaded_tiles=None):
+    """Тайлы регистрируются по рядам, как при загрузке; loaded_tiles — сколько уже пришло"""
+    tile_manager = TileManager()
+    tile_manager.tile_size = TILE_SIZE
+    tile_manager.image_width, tile_manager.image_height = WIDTH, HEIGHT
+    tile_manager.pixel_format = 'L'
+    tile_manager.level_sources = [pixels]
+    positions = [(x, y) for y in range(0, HEIGHT, TILE_SIZE) for x in range(0, WIDTH, TILE_SIZE)]
+    for x, y in positions[:loaded_tiles]:
+        tile_manager._register_tile(x, y, min(TILE_SIZE, WIDTH - x), min(TILE_SIZE, HEIGHT - y), None, 0)
+    return tile_manager
+
+
+def distance_to_line(points, start, end):
+    (x0, y0), (x1, y1) = start, end
+    return np.abs((x1 - x0) * (points[:, 1] - y0) - (y1 - y0) * (points[:, 0] - x0)) / np.hypot(x1 - x0, y1 - y0)
+
+
+def test_follows_slanted_segment_to_its_ends():
+    start, end = (100.0, 40.0), (1000.0, 220.0)
+    result = TraceFollower(make_tile_manager(draw([(start, end)]))).trace(550.5, 130.5)
+    # Концы отрезка внутри растра: линия там просто кончается
+    assert result.stops == (STOP_GAP, STOP_GAP)
+    points = result.points
+    errors = distance_to_line(points, start, end)
+    assert np.median(errors) < 0.3 and errors.max() < 1.0
+    assert abs(points[0, 0] - start[0]) < 6 and abs(points[-1, 0] - end[0]) < 6
+    assert (np.diff(points[:, 0]) > 0).all()
+
+
+def test_stops_at_gap_and_border():
+    pixels = draw([((0, 100.5), (500, 100.5)), ((520, 100.5), (WIDTH, 100.5))])
+    result = TraceFollower(make_tile_manager(pixels)).trace(300.5, 100.5)
+    assert result.stops == (STOP_EDGE, STOP_GAP)
+    points = result.points
+    assert points[0, 0] < 3
+    assert 494 < points[-1, 0] <= 502
+    assert np.abs(points[:, 1] - 100.5).max() < 1.0  # Сечение берётся по целым пикселям
+
+    # По другую сторону разрыва — отдельная линия до края
+    result = TraceFollower(make_tile_manager(pixels)).trace(700.5, 100.5)
+    assert result.stops == (STOP_GAP, STOP_EDGE)
+    assert 518 <= result.points[0, 0] < 526 and result.points[-1, 0] > WIDTH - 3
+
+
+def test_stops_at_bottom_border():
+    result = TraceFollower(make_tile_manager(draw([((300, 20), (340, HEIGHT))]))).trace(320.5, 138.5)
+    assert result.stops[1] == STOP_EDGE
+    assert result.points[-1, 1] > HEIGHT - 3
+
+
+def test_stops_at_crossing():
+    pixels = draw([((0, 100.5), (WIDTH, 100.5)), ((600.5, 0), (600.5, HEIGHT))])
+    result = TraceFollower(make_tile_manager(pixels)).trace(300.5, 100.5)
+    assert result.stops == (STOP_EDGE, STOP_CROSSING)
+    assert 585 < result.points[-1, 0] < 600
+
+
+def test_stops_before_unloaded_tile():
+    # Пришли ряд 0 и первые 10 тайлов ряда 1: линия в ряду 1 обрывается на x = 640
+    pixels = draw([((0, 100.5), (WIDTH, 100.5))])
+    columns = -(-WIDTH // TILE_SIZE)
+    tile_manager = make_tile_manager(pixels, loaded_tiles=columns + 10)
+    reader = TileGrayReader(tile_manager)
+    assert reader.tile(10, 1) is None
+    assert reader.sample(np.array([600, 700]), np.array([100, 100])) is None
+    assert reader.sample(np.array([600, 630]), np.array([100, 100])) is not None
+
+    result = TraceFollower(tile_manager).trace(300.5, 100.5)
+    assert result.stops == (STOP_EDGE, STOP_UNLOADED)
+    assert 620 < result.points[-1, 0] < 640
+
+    # Щелчок по ещё не загруженной части растра
+    assert TraceFollower(tile_manager).trace(900.5, 100.5) is None
@@ -0,0 +1,140 @@
+# Владелец текстур тайлов: создание, лимит видеопамяти, вытеснение и освобождение
+
+from collections import OrderedDict
+
+from OpenGL.GL import *
+
+from texture_upload import TextureUploader
+
+
+class _TexturePage:
+    """Массив текстур: слои одного формата и размера, занятые тайлами любых растров"""
+
+    def __init__(self, texture_id, layers):
+        self.texture_id = texture_id
+        self.layers = layers
+        self.free = list(range(layers - 1, -1, -1))  # pop() выдаёт слои по возрастанию
+
+
+class TextureManager:
+    """Все текстуры тайлов всех растров создаются и удаляются только здесь.
+
+    Тайл занимает слой массива текстур (страницы) своего формата и размера, поэтому
+    видимые тайлы рисуются одним вызовом на страницу, а не тремя вызовами на тайл.
+    Каждый слой записан за своим владельцем (TileManager), поэтому при удалении или
+    замене растра release(владелец) освобождает его видеопамять целиком, а
+    release_all() — всю при уничтожении виджета. Опустевшая страница удаляется.
+    Сверх max_bytes освобождаются слои тайлов, которые дольше всех не рисовались;
+    при следующем показе тайл загружается заново из памяти или с диска. Тайлы
+    текущего кадра не вытесняются.
+    """
+
+    LAYERS_PER_PAGE = 16  # Слоёв в странице: больше — меньше вызовов, но крупнее шаг выделения видеопамяти
+
+    def __init__(self, max_bytes=512 * 1024 ** 2, uploader=None):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.frame = 0
+        self.uploader = uploader or TextureUploader()
+        self._resident = OrderedDict()  # Тайл -> (владелец, байты, страница), от давних к недавним
+        self._pages = {}  # (формат, сторона слоя) -> [страницы]
+
+    def fits(self, size):
+        return self.used_bytes + size <= self.max_bytes
+
+    def create(self, owner, tile, pixels, pixel_format, layer_size, size):
+        """Загружает пиксели тайла в слой страницы (нужен текущий контекст OpenGL)"""
+        self.delete(tile)
+        page = self._allocate(tile, pixel_format, layer_size)
+        tile.tex_flipped = self.uploader.upload_layer(page.texture_id, tile.texture_layer, pixels, pixel_format)
+        self._resident[tile] = (owner, size, page)
+        self.used_bytes += size
+
+    def adopt(self, owner, tile, texture_id, flipped, pixel_format, layer_size, size):
+        """Переносит в слой страницы текстуру, загруженную в разделяемом контексте, и удаляет её;
+        сверх лимита текстура просто удаляется (нужен текущий контекст OpenGL)
+        """
+        self.delete(tile)
+        if self.fits(size):
+            page = self._allocate(tile, pixel_format, layer_size)
+            self.uploader.copy_to_layer(texture_id, tile.data_width, tile.data_height,
+                                        page.texture_id, tile.texture_layer)
+            tile.tex_flipped = flipped
+            self._resident[tile] = (owner, size, page)
+            self.used_bytes += size
+        glDeleteTextures([texture_id])
+        return tile in self._resident
+
+    def delete(self, tile):
+        """Освобождает слой тайла (нужен текущий контекст OpenGL)"""
+        entry = self._resident.pop(tile, None)
+        if entry:
+            self.used_bytes -= entry[1]
+            self._free(entry[2], tile.texture_layer)
+        tile.texture_id = 0
+
+    def release(self, owner):
+        """Освобождает все слои владельца (нужен текущий контекст OpenGL)"""
+        tiles = [tile for tile, entry in self._resident.items() if entry[0] is owner]
+        self._delete_tiles(tiles)
+
+    def release_all(self):
+        """Удаляет все страницы и буферы загрузки (нужен текущий контекст OpenGL)"""
+        self._delete_tiles(list(self._resident))
+        self.uploader.release()
+
+    def stats(self, owner=None):
+        """(число тайлов в видеопамяти, байты) — всего или одного владельца"""
+        if owner is None:
+            return len(self._resident), self.used_bytes
+        sizes = [entry[1] for entry in self._resident.values() if entry[0] is owner]
+        return len(sizes), sum(sizes)
+
+    def touch(self, tile):
+        """Отмечает тайл нужным в текущем кадре"""
+        tile.last_used = self.frame
+        if tile in self._resident:
+            self._resident.move_to_end(tile)
+
+    def begin_frame(self):
+        self.frame += 1
+
+    def evict(self):
+        """Удаляет давно не рисовавшиеся текстуры (нужен текущий контекст OpenGL)"""
+        while self.used_bytes > self.max_bytes and self._resident:
+            tile = next(iter(self._resident))
+            if tile.last_used == self.frame:
+                break  # Всё оставшееся нужно для текущего кадра
+            self.delete(tile)
+
+    def _allocate(self, tile, pixel_format, layer_size):
+        """Свободный слой в странице нужного формата; при нехватке создаёт новую страницу.
+
+        Берётся самая заполненная страница: слои уплотняются, и после вытеснения
+        скорее опустеют и удалятся целые страницы, чем останутся полупустые.
+        """
+        pages = self._pages.setdefault((pixel_format, layer_size), [])
+        page = min((page for page in pages if page.free), key=lambda page: len(page.free), default=None)
+        if page is None:
+            texture_id = self.uploader.create_array(pixel_format, layer_size, self.LAYERS_PER_PAGE)
+            page = _TexturePage(texture_id, self.LAYERS_PER_PAGE)
+            pages.append(page)
+        tile.texture_id = page.texture_id
+        tile.texture_layer = page.free.pop()
+        return page
+
+    def _free(self, page, layer):
+        page.free.append(layer)
+        if len(page.free) < page.layers:
+            return
+        glDeleteTextures([page.texture_id])
+        for key, pages in self._pages.items():
+            if page in pages:
+                pages.remove(page)
+                if not pages:
+                    del self._pages[key]
+                break
+
+    def _delete_tiles(self, tiles):
+        for tile in tiles:
+            self.delete(tile)
@@ -0,0 +1,234 @@
+# Загрузка пикселей тайлов в текстуры OpenGL (буфер распаковки PBO, шаг строк родителя, фоновый поток)
+
+import ctypes
+
+import numpy as np
+from OpenGL.GL import *
+from PyQt5.QtCore import QCoreApplication
+from PyQt5.QtGui import QOffscreenSurface, QOpenGLContext
+
+
+class TextureUploader:
+    """Загружает тайлы из срезов родительского массива без промежуточных копий numpy.
+
+    Срез тайла не делается непрерывным. При доступных PBO строки тайла один раз
+    копируются прямо в память буфера драйвера, glTexImage2D сразу возвращает
+    управление, а передача в видеопамять идёт асинхронно. Без PBO драйвер читает
+    строки прямо из родительского массива, шаг задаётся через GL_UNPACK_ROW_LENGTH.
+    Тайлы для отрисовки лежат в слоях массивов текстур (create_array, upload_layer);
+    отдельные текстуры (create_texture) нужны только для загрузки в рабочем потоке.
+    """
+
+    def __init__(self):
+        self.use_pbo = True  # Сбрасывается, если буферы распаковки недоступны
+        self._pbo = None
+        self._copy_framebuffer = 0  # Источник для copy_to_layer
+
+    def create_texture(self, pixels, pixel_format):
+        """Текстура из (h, w) для 'L' или (h, w, 4) для 'RGBA' (нужен текущий контекст OpenGL).
+
+        Возвращает (id текстуры, строки текстуры идут снизу вверх).
+        """
+        pixels, flipped = _prepare(pixels, pixel_format)
+        bytes_per_pixel = 4 if pixel_format == 'RGBA' else 1
+        height, width = pixels.shape[:2]
+
+        texture_id = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture_id)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        # Без этого линейная фильтрация подмешивает на краю тайла противоположный край
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)  # Строки L8 не выровнены по 4 байта
+
+        internal_format, data_format = _gl_formats(GL_TEXTURE_2D, pixel_format)
+
+        if self.use_pbo and self._stage(pixels):
+            glTexImage2D(GL_TEXTURE_2D, 0, internal_format, width, height,
+                         0, data_format, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        else:
+            glPixelStorei(GL_UNPACK_ROW_LENGTH, pixels.strides[0] // bytes_per_pixel)
+            glTexImage2D(GL_TEXTURE_2D, 0, internal_format, width, height,
+                         0, data_format, GL_UNSIGNED_BYTE, ctypes.c_void_p(pixels.ctypes.data))
+            glPixelStorei(GL_UNPACK_ROW_LENGTH, 0)
+        return texture_id, flipped
+
+    def create_array(self, pixel_format, size, layers):
+        """Пустой массив текстур из layers слоёв size x size (нужен текущий контекст OpenGL)"""
+        texture_id = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, texture_id)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        internal_format, data_format = _gl_formats(GL_TEXTURE_2D_ARRAY, pixel_format)
+        glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, internal_format, size, size, layers,
+                     0, data_format, GL_UNSIGNED_BYTE, None)
+        return texture_id
+
+    def upload_layer(self, texture_id, layer, pixels, pixel_format):
+        """Пиксели тайла в левый верхний угол слоя массива текстур (нужен текущий контекст OpenGL).
+
+        Возвращает True, если строки в слое идут снизу вверх.
+        """
+        pixels, flipped = _prepare(pixels, pixel_format)
+        bytes_per_pixel = 4 if pixel_format == 'RGBA' else 1
+        height, width = pixels.shape[:2]
+        data_format = GL_RGBA if pixel_format == 'RGBA' else GL_RED
+        glBindTexture(GL_TEXTURE_2D_ARRAY, texture_id)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+
+        if self.use_pbo and self._stage(pixels):
+            glTexSubImage3D(GL_TEXTURE_2D_ARRAY, 0, 0, 0, layer, width, height, 1,
+                            data_format, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        else:
+            glPixelStorei(GL_UNPACK_ROW_LENGTH, pixels.strides[0] // bytes_per_pixel)
+            glTexSubImage3D(GL_TEXTURE_2D_ARRAY, 0, 0, 0, layer, width, height, 1,
+                            data_format, GL_UNSIGNED_BYTE, ctypes.c_void_p(pixels.ctypes.data))
+            glPixelStorei(GL_UNPACK_ROW_LENGTH, 0)
+        return flipped
+
+    def copy_to_layer(self, source_texture, width, height, texture_id, layer):
+        """Копирует текстуру width x height в угол слоя массива, не выходя из видеопамяти
+        (нужен текущий контекст OpenGL; привязка кадрового буфера для чтения сохраняется).
+        """
+        previous = glGetIntegerv(GL_READ_FRAMEBUFFER_BINDING)
+        if not self._copy_framebuffer:
+            self._copy_framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self._copy_framebuffer)
+        glFramebufferTexture2D(GL_READ_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, source_texture, 0)
+        glReadBuffer(GL_COLOR_ATTACHMENT0)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, texture_id)
+        glCopyTexSubImage3D(GL_TEXTURE_2D_ARRAY, 0, 0, 0, layer, 0, 0, width, height)
+        glFramebufferTexture2D(GL_READ_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, 0, 0)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, previous)
+
+    def release(self):
+        """Удаляет буфер распаковки и кадровый буфер копирования (нужен текущий контекст OpenGL)"""
+        if self._pbo:
+            glDeleteBuffers(1, [self._pbo])
+            self._pbo = None
+        if self._copy_framebuffer:
+            glDeleteFramebuffers(1, [self._copy_framebuffer])
+            self._copy_framebuffer = 0
+
+    def _stage(self, pixels):
+        """Копирует строки тайла в PBO и оставляет его привязанным; False — PBO недоступен"""
+        size = pixels.shape[0] * pixels.shape[1] * (pixels.shape[2] if pixels.ndim == 3 else 1)
+        try:
+            if self._pbo is None:
+                self._pbo = glGenBuffers(1)
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self._pbo)
+            # Новое хранилище на каждый тайл: драйвер не ждёт, пока прежняя загрузка дочитает буфер
+            glBufferData(GL_PIXEL_UNPACK_BUFFER, size, None, GL_STREAM_DRAW)
+            address = glMapBuffer(GL_PIXEL_UNPACK_BUFFER, GL_WRITE_ONLY)
+            address = ctypes.cast(address, ctypes.c_void_p).value
+            if not address:
+                raise RuntimeError("glMapBuffer вернул пустой указатель")
+        except Exception as e:
+            print(f"PBO недоступны, текстуры загружаются напрямую: {str(e)}")
+            self.use_pbo = False
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+            return False
+
+        staging = np.ctypeslib.as_array((ctypes.c_ubyte * size).from_address(address)).reshape(pixels.shape)
+        try:
+            staging[...] = pixels  # Единственная копия: из страниц исходника в память драйвера
+        finally:
+            glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+        return True
+
+
+class SharedContextUploader:
+    """Загрузка текстур в рабочем потоке через второй контекст OpenGL.
+
+    Контекст разделяет объекты с контекстом виджета, поэтому созданные в нём
+    текстуры видны при отрисовке. После каждой загрузки ставится барьер
+    (glFenceSync); поток отрисовки берёт текстуру, только когда барьер пройден,
+    и не ждёт драйвер. Создаётся в GUI-потоке, begin/upload/end вызываются
+    в рабочем потоке.
+    """
+
+    def __init__(self, share_context, thread):
+        if not QOpenGLContext.supportsThreadedOpenGL():
+            raise RuntimeError("драйвер не поддерживает OpenGL в нескольких потоках")
+        self.context = QOpenGLContext()
+        self.context.setFormat(share_context.format())
+        self.context.setShareContext(share_context)
+        if not self.context.create() or not self.context.shareContext():
+            raise RuntimeError("не удалось создать разделяемый контекст")
+        # Поверхность создаётся в GUI-потоке, а использоваться может в любом
+        self.surface = QOffscreenSurface()
+        self.surface.setFormat(self.context.format())
+        self.surface.create()
+        if not self.surface.isValid():
+            raise RuntimeError("не удалось создать внеэкранную поверхность")
+        self.context.moveToThread(thread)
+        self._uploader = None
+
+    def begin(self):
+        """Делает контекст текущим в рабочем потоке"""
+        if not self.context.makeCurrent(self.surface):
+            raise RuntimeError("разделяемый контекст не стал текущим")
+        self._uploader = TextureUploader()
+
+    def upload(self, pixels, pixel_format):
+        """Текстура из пикселей: (id, строки снизу вверх, барьер для glClientWaitSync)"""
+        texture_id, flipped = self._uploader.create_texture(pixels, pixel_format)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        glFlush()  # Иначе барьер может не дойти до GPU, и другой контекст будет ждать его вечно
+        return texture_id, flipped, fence
+
+    def discard(self, texture):
+        """Удаляет текстуру, которую не удалось передать потоку отрисовки"""
+        texture_id, _, fence = texture
+        glDeleteSync(fence)
+        glDeleteTextures([texture_id])
+
+    def end(self):
+        """Освобождает контекст в рабочем потоке и возвращает его GUI-потоку для удаления"""
+        if self._uploader:
+            self._uploader.release()
+            self._uploader = None
+        glFinish()  # Все загрузки завершены до того, как контекст перестанет быть текущим
+        self.context.doneCurrent()
+        self.context.moveToThread(QCoreApplication.instance().thread())
+
+
+def fence_passed(fence):
+    """Пройден ли барьер (без ожидания; нужен текущий контекст OpenGL)"""
+    # GL_WAIT_FAILED тоже считается пройденным: ждать больше нечего
+    return glClientWaitSync(fence, 0, 0) != GL_TIMEOUT_EXPIRED
+
+
+def _prepare(pixels, pixel_format):
+    """Строки в порядке файла и с шагом, который понимает OpenGL: (пиксели, строки снизу вверх)"""
+    flipped = pixels.strides[0] < 0
+    if flipped:
+        # Строки BMP снизу вверх: грузим в порядке файла, а переворачивают координаты текстуры
+        pixels = pixels[::-1]
+    if not _has_row_pitch(pixels, 4 if pixel_format == 'RGBA' else 1):
+        pixels = np.ascontiguousarray(pixels)
+    return pixels, flipped
+
+
+def _gl_formats(target, pixel_format):
+    """(внутренний формат, формат данных) текстуры; для 'L' настраивает разворот канала в серый"""
+    if pixel_format == 'RGBA':
+        return GL_RGBA8, GL_RGBA
+    # Один канал в видеопамяти; при чтении шейдером он разворачивается в серый цвет
+    glTexParameteriv(target, GL_TEXTURE_SWIZZLE_RGBA, [GL_RED, GL_RED, GL_RED, GL_ONE])
+    return GL_R8, GL_RED
+
+
+def _has_row_pitch(pixels, bytes_per_pixel):
+    """Пиксели в строке идут подряд, а шаг строк кратен размеру пикселя"""
+    if pixels.ndim == 3 and pixels.strides[1:] != (bytes_per_pixel, 1):
+        return False
+    if pixels.ndim == 2 and pixels.strides[1] != 1:
+        return False
+    return pixels.strides[0] > 0 and pixels.strides[0] % bytes_per_pixel == 0
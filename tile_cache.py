@@ -0,0 +1,249 @@
+# Дисковый кэш подготовленных тайлов (все уровни пирамиды) для повторного открытия сканов
+
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+import weakref
+
+import numpy as np
+from PyQt5.QtCore import QStandardPaths
+
+from image_loader import map_raw_rows
+from tile_manager import column_slice, level_format, level_shape
+
+
+class CacheEntry:
+    """Готовая запись кэша: уровни пирамиды как массивы, отображённые в память"""
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.dpi = tuple(meta["dpi"])
+        self.pixel_format = meta["pixel_format"]
+        self.tile_size = meta["tile_size"]
+        self.level_sizes = [tuple(size) for size in meta["levels"]]
+        # Уровень 0 несжатого исходника не копируется в кэш, а берётся из самого файла
+        self.source_layout = meta.get("source_layout")
+
+    def level_array(self, level):
+        """Пиксели уровня без чтения файла целиком (numpy.memmap)"""
+        if level == 0 and self.source_layout:
+            return map_raw_rows(**self.source_layout)
+        return _track(np.load(os.path.join(self.path, f"level_{level}.npy"), mmap_mode='r'))
+
+
+_writer_numbers = itertools.count()
+_mapped_arrays = weakref.WeakValueDictionary()  # Отображённые в память уровни, которые ещё кем-то используются
+
+
+def _track(array):
+    _mapped_arrays[id(array)] = array
+    return array
+
+
+def _mapped_dirs():
+    """Каталоги записей, чьи файлы сейчас отображены в память (их нельзя удалять)"""
+    return {os.path.dirname(os.path.abspath(array.filename)) for array in list(_mapped_arrays.values())}
+
+
+class LevelArrays:
+    """Уровни пирамиды во временных файлах (кэш выключен или недоступен).
+
+    Тайлы пишутся сюда по мере нарезки, и после вытеснения из видеопамяти
+    они перечитываются отсюда, а не держатся копиями в памяти. Файлы без
+    имени: система удаляет их, когда массивы уровней больше не нужны.
+    skip_level_0 — уровень 0 читается из самого исходника (pixel_map).
+    """
+
+    def __init__(self, pixel_format, level_sizes, skip_level_0=False):
+        self._pixel_format = pixel_format
+        self._levels = []
+        for level, (width, height) in enumerate(level_sizes):
+            if level == 0 and skip_level_0:
+                self._levels.append(None)
+                continue
+            shape = level_shape(level_format(pixel_format, level), width, height)
+            self._levels.append(self._create_array(level, shape))
+
+    def _create_array(self, level, shape):
+        with tempfile.TemporaryFile(prefix="tiles_") as f:
+            # Отображение держит файл открытым и после закрытия f
+            return np.memmap(f, mode='w+', dtype=np.uint8, shape=shape)
+
+    def level_array(self, level):
+        """Массив уровня, в который идёт запись (None, если уровень берётся из исходника)"""
+        return self._levels[level]
+
+    def write_tile(self, x, y, tile_width, tile_height, tile_data, level):
+        if self._levels[level] is None:
+            return
+        pixel_format = level_format(self._pixel_format, level)
+        self._levels[level][y:y + tile_height, column_slice(pixel_format, x, tile_width)] = tile_data
+
+
+class CacheWriter(LevelArrays):
+    """Запись нового элемента кэша по мере нарезки тайлов.
+
+    Уровни пишутся в собственный каталог записи и доступны через level_array
+    ещё до завершения; commit последним записывает meta.json, и только с ним
+    запись считается готовой. Каталог не переименовывается: в Windows это
+    невозможно, пока его файлы отображены в память. Две загрузки одного файла
+    (например, отменённая и новая) не мешают друг другу: каждая удаляет только
+    свой каталог.
+    """
+
+    def __init__(self, cache, key, meta):
+        self._cache = cache
+        self._meta = meta
+        self._path = os.path.join(cache.cache_dir, f"{key}.{os.getpid()}.{next(_writer_numbers)}")
+        os.makedirs(self._path)
+        super().__init__(meta["pixel_format"], meta["levels"], bool(meta.get("source_layout")))
+
+    def _create_array(self, level, shape):
+        return _track(np.lib.format.open_memmap(
+            os.path.join(self._path, f"level_{level}.npy"), mode='w+', dtype=np.uint8, shape=shape))
+
+    def commit(self):
+        """Сбрасывает данные на диск и публикует запись: meta.json появляется атомарно.
+
+        Массивы level_array остаются действительными. Возвращает опубликованную
+        запись или None, если записать meta.json не удалось (тогда нужен discard).
+        """
+        for array in self._levels:
+            if array is not None:
+                array.flush()
+        self._levels = []
+        meta_path = os.path.join(self._path, "meta.json")
+        try:
+            with open(meta_path + ".part", 'w', encoding='utf-8') as f:
+                json.dump(self._meta, f)
+            os.replace(meta_path + ".part", meta_path)
+        except OSError as e:
+            print(f"Ошибка записи кэша тайлов: {str(e)}")
+            return None
+        path, self._path = self._path, None
+        self._cache.evict()
+        return CacheEntry(path, self._meta)
+
+    def discard(self):
+        """Удаляет свой неопубликованный каталог (опубликованные записи не трогает).
+
+        Если его файлы ещё отображены в память, каталог удалит evict, когда они освободятся.
+        """
+        self._levels = []
+        if self._path:
+            if self._path not in _mapped_dirs():
+                shutil.rmtree(self._path, ignore_errors=True)
+            self._path = None
+
+
+class TileCache:
+    """Каталог с тайлами, ключ — путь, размер и время изменения исходного файла.
+
+    Каждый уровень пирамиды хранится одним .npy-файлом, который при повторном
+    открытии отображается в память, так что декодирование исходника не нужно.
+    Каталог записи — <ключ>.<pid>.<номер>; у одного ключа может оказаться
+    несколько записей, тогда используется самая свежая, а прочие удаляются.
+    Объём ограничен max_bytes; вытесняются давно не открывавшиеся записи,
+    кроме отображённых в память.
+    """
+    FORMAT_VERSION = 3
+    STALE_TMP_SECONDS = 3600  # Каталоги неопубликованных записей (без meta.json) старше часа удаляются
+
+    def __init__(self, cache_dir=None, max_bytes=10 * 1024 ** 3):
+        if cache_dir is None:
+            cache_dir = os.path.join(QStandardPaths.writableLocation(QStandardPaths.CacheLocation), "tiles")
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, file_path, tile_size):
+        stat = os.stat(file_path)
+        source = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{tile_size}|{self.FORMAT_VERSION}"
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def lookup(self, file_path, tile_size):
+        """Запись для файла или None; попадание отмечается для LRU"""
+        return self.lookup_key(self.key(file_path, tile_size))
+
+    def lookup_key(self, key):
+        """Самая свежая опубликованная запись с ключом key или None"""
+        candidates = []
+        for name in self._entry_names():
+            if name.split(".")[0] == key:
+                meta_path = os.path.join(self.cache_dir, name, "meta.json")
+                try:
+                    candidates.append((os.path.getmtime(meta_path), meta_path))
+                except OSError:
+                    continue  # Запись ещё пишется
+        for _, meta_path in sorted(candidates, reverse=True):
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+                os.utime(meta_path)
+                return CacheEntry(os.path.dirname(meta_path), meta)
+            except (OSError, ValueError, KeyError):
+                continue
+        return None
+
+    def _entry_names(self):
+        try:
+            return [name for name in os.listdir(self.cache_dir)
+                    if os.path.isdir(os.path.join(self.cache_dir, name))]
+        except OSError:
+            return []
+
+    def create(self, file_path, tile_size, width, height, dpi, pixel_format, level_sizes, source_layout=None):
+        """source_layout — параметры map_raw_rows, если уровень 0 читается из исходника"""
+        meta = {
+            "version": self.FORMAT_VERSION,
+            "source": os.path.abspath(file_path),
+            "width": width,
+            "height": height,
+            "dpi": list(dpi),
+            "pixel_format": pixel_format,
+            "tile_size": tile_size,
+            "levels": [list(size) for size in level_sizes],
+            "source_layout": source_layout,
+        }
+        return CacheWriter(self, self.key(file_path, tile_size), meta)
+
+    def evict(self):
+        """Удаляет повторные записи одного ключа и самые давние записи, пока кэш
+        не уложится в max_bytes. Отображённые в память каталоги не трогаются.
+        """
+        entries = []
+        newest = {}  # Ключ -> время последнего открытия самой свежей его записи
+        total = 0
+        now = time.time()
+        mapped = _mapped_dirs()
+        for name in self._entry_names():
+            path = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(path, "meta.json")
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                if not os.path.exists(meta_path):
+                    # Каталоги пишущихся записей (и брошенных после сбоя) в учёт не идут
+                    if path not in mapped and now - os.path.getmtime(path) > self.STALE_TMP_SECONDS:
+                        shutil.rmtree(path, ignore_errors=True)
+                    continue
+                last_used = os.path.getmtime(meta_path)
+            except OSError:
+                continue
+            key = name.split(".")[0]
+            newest[key] = max(newest.get(key, last_used), last_used)
+            entries.append((last_used, size, key, path))
+            total += size
+
+        for last_used, size, key, path in sorted(entries):
+            if total <= self.max_bytes and last_used == newest[key]:
+                continue
+            if path in mapped:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
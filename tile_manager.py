@@ -1,96 +1,333 @@
 # Разбиение изображения на тайлы (части)
 
+import math
+
 import numpy as np
-from OpenGL.GL import *
-from PyQt5.QtCore import QPointF
+
+from texture_manager import TextureManager
+
+def column_slice(pixel_format, x, width):
+    """Срез столбцов массива пикселей для тайла с учётом упаковки битов"""
+    if pixel_format == '1':
+        # Биты упакованы по 8 пикселей, а границы тайлов кратны 8
+        return slice(x // 8, (x + width + 7) // 8)
+    return slice(x, x + width)
+
+
+def level_format(pixel_format, level):
+    """Формат пикселей уровня пирамиды: обзорные уровни битового растра серые"""
+    if level > 0 and pixel_format == '1':
+        return 'L'
+    return pixel_format
+
+
+def level_shape(pixel_format, width, height):
+    """Форма массива уровня: биты упакованы по 8 пикселей, RGBA — 4 байта на пиксель"""
+    if pixel_format == '1':
+        return height, (width + 7) // 8
+    if pixel_format == 'L':
+        return height, width
+    return height, width, 4
+
+
+def tile_slice(source, pixel_format, x, y, width, height):
+    """Тайл (x, y, ширина, высота в пикселях уровня) как срез массива уровня, без копирования"""
+    return source[y:y + height, column_slice(pixel_format, x, width)]
+
+
+def texture_pixels(tile_data, pixel_format, width):
+    """Пиксели для текстуры и её формат ('L' или 'RGBA')"""
+    if pixel_format == '1':
+        # Битовых текстур в OpenGL нет: распаковываем в L8 только на время загрузки
+        return np.unpackbits(tile_data, axis=1, count=width) * np.uint8(255), 'L'
+    return tile_data, pixel_format
+
+
+def gray_pixels(tile_data, pixel_format, width):
+    """Яркость пикселей (uint8, 255 — белый) для анализа изображения"""
+    if pixel_format == '1':
+        return np.unpackbits(tile_data, axis=1, count=width) * np.uint8(255)
+    if pixel_format == 'L':
+        return tile_data
+    rgb = tile_data[..., :3].astype(np.uint16)
+    return ((rgb[..., 0] * 77 + rgb[..., 1] * 150 + rgb[..., 2] * 29) >> 8).astype(np.uint8)
+
+
+def downsample(rows):
+    """Уменьшение вдвое усреднением блоков 2×2 (нечётный край дублируется)"""
+    if len(rows) % 2:
+        rows = np.concatenate((rows, rows[-1:]))
+    if rows.shape[1] % 2:
+        rows = np.concatenate((rows, rows[:, -1:]), axis=1)
+    r = rows.astype(np.uint16)
+    return ((r[0::2, 0::2] + r[1::2, 0::2] + r[0::2, 1::2] + r[1::2, 1::2] + 2) >> 2).astype(np.uint8)
+
+
+def _band_x_range(quad, y0, y1):
+    """Отрезок (x_min, x_max) выпуклого многоугольника внутри полосы y0 <= y <= y1 или None"""
+    xs = [x for x, y in quad if y0 <= y <= y1]
+    for (ax, ay), (bx, by) in zip(quad, quad[1:] + quad[:1]):
+        for y in (y0, y1):
+            # Точка пересечения ребра с границей полосы
+            if ay != by and min(ay, by) <= y <= max(ay, by):
+                xs.append(ax + (bx - ax) * (y - ay) / (by - ay))
+    if not xs:
+        return None
+    return min(xs), max(xs)
+
 
 class Tile:
-    def __init__(self, x, y, width, height, texture_id):
+    def __init__(self, x, y, width, height, texture_id, level=0):
+        # Положение и размер в пикселях исходного растра (уровня 0)
         self.x = x
         self.y = y
         self.width = width
         self.height = height
-        self.texture_id = texture_id
+        self.texture_id = texture_id  # Страница (массив текстур) с тайлом; 0 — выгружен из видеопамяти
+        self.texture_layer = 0  # Слой страницы; данные занимают его левый верхний угол
+        self.level = level
+        self.tex_flipped = False  # Строки текстуры снизу вверх (загружены из BMP без переворота)
+        # Размер текстуры в пикселях своего уровня
+        self.data_width = width
+        self.data_height = height
+        self.pixels = None  # Копия данных в памяти, если уровень не хранится на диске
+        self.last_used = -1  # Кадр, в котором тайл последний раз был нужен
+
+
+class PyramidBuilder:
+    """Нарезает полосы растра на тайлы и попутно строит обзорные уровни.
+
+    Каждый следующий уровень вдвое меньше предыдущего, последний помещается
+    в один тайл. Полосы подаются сверху вниз высотой tile_size строк, и для
+    каждого уровня в памяти держится не больше одного ряда тайлов.
+    emit_tile(x, y, ширина, высота, данные, уровень) получает координаты уровня.
+    """
+
+    def __init__(self, width, height, tile_size, pixel_format, emit_tile):
+        self.tile_size = tile_size
+        self.pixel_format = pixel_format
+        self.emit_tile = emit_tile
+
+        self.level_sizes = [(width, height)]
+        while max(width, height) > tile_size:
+            width, height = (width + 1) // 2, (height + 1) // 2
+            self.level_sizes.append((width, height))
+
+        self._pending = [None] * len(self.level_sizes)  # Накопленные строки уровней
+        self._next_row = [0] * len(self.level_sizes)
+
+    @property
+    def total_tiles(self):
+        ts = self.tile_size
+        return sum(((w + ts - 1) // ts) * ((h + ts - 1) // ts) for w, h in self.level_sizes)
+
+    def add_band(self, band):
+        """Очередная полоса уровня 0 в формате pixel_format"""
+        self._emit_row(0, band)
+        if len(self.level_sizes) > 1:
+            if self.pixel_format == '1':
+                band = np.unpackbits(band, axis=1, count=self.level_sizes[0][0]) * np.uint8(255)
+            self._add_rows(1, downsample(band))
+
+    def _add_rows(self, level, rows):
+        if self._pending[level] is not None:
+            rows = np.concatenate((self._pending[level], rows))
+        level_height = self.level_sizes[level][1]
+
+        # Ряд тайлов готов, когда набралось tile_size строк или уровень закончился
+        while len(rows) and (len(rows) >= self.tile_size or
+                             self._next_row[level] + len(rows) == level_height):
+            tile_row, rows = rows[:self.tile_size], rows[self.tile_size:]
+            self._emit_row(level, tile_row)
+            if level + 1 < len(self.level_sizes):
+                self._add_rows(level + 1, downsample(tile_row))
+
+        self._pending[level] = rows if len(rows) else None
+
+    def _emit_row(self, level, rows):
+        pixel_format = level_format(self.pixel_format, level)
+        y = self._next_row[level]
+        for x in range(0, self.level_sizes[level][0], self.tile_size):
+            tile_width = min(self.tile_size, self.level_sizes[level][0] - x)
+            # Срез без копирования: шаг строк полосы учитывает загрузчик текстур
+            tile_data = rows[:, column_slice(pixel_format, x, tile_width)]
+            self.emit_tile(x, y, tile_width, len(rows), tile_data, level)
+        self._next_row[level] += len(rows)
+
 
 class TileManager:
-    def __init__(self):
-        self.tiles = []
+    def __init__(self, texture_manager=None):
+        self.levels = [[]]  # Тайлы по уровням пирамиды (по рядам, слева направо); 0 — полное разрешение
+        self.tiles = self.levels[0]
         self.tile_size = 1024
         self.image_width = 0
         self.image_height = 0
+        self.pixel_format = 'RGBA'  # 'L' — серый, '1' — битовый, упакованный по 8 пикселей
+        # Массивы уровней на диске (numpy.memmap исходника или кэша) либо None;
+        # из них тайлы загружаются заново после вытеснения из видеопамяти
+        self.level_sources = []
+        self.texture_manager = texture_manager or TextureManager()  # Владелец текстур тайлов
+
+    def upload_tile(self, x, y, tile_width, tile_height, tile_data, level=0):
+        """Регистрирует тайл и загружает его в текстуру, если хватает лимита видеопамяти
+        (нужен текущий контекст OpenGL).
+
+        x, y, ширина и высота задаются в пикселях своего уровня пирамиды.
+        tile_data может быть None, если уровень есть в level_sources.
+        """
+        tile = self._register_tile(x, y, tile_width, tile_height, tile_data, level)
+        if self.texture_manager.fits(self.texture_bytes(level)):
+            if tile_data is None:
+                tile_data = self.tile_pixels(tile)
+            self._create_texture(tile, tile_data)
+        return tile
+
+    def adopt_tile(self, x, y, tile_width, tile_height, tile_data, level, texture_id, flipped):
+        """Регистрирует тайл с текстурой, уже загруженной в разделяемом контексте
+        (нужен текущий контекст OpenGL: сверх лимита видеопамяти текстура удаляется).
+        """
+        tile = self._register_tile(x, y, tile_width, tile_height, tile_data, level)
+        self.texture_manager.adopt(self, tile, texture_id, flipped, self.texture_format(level),
+                                   self.tile_size, self.texture_bytes(level))
+        return tile
+
+    def texture_format(self, level):
+        """Формат текстуры уровня: битовые тайлы загружаются как серые"""
+        return 'RGBA' if level_format(self.pixel_format, level) == 'RGBA' else 'L'
+
+    def texture_bytes(self, level):
+        """Видеопамять под тайл уровня: слой страницы tile_size x tile_size"""
+        return self.tile_size * self.tile_size * (4 if self.texture_format(level) == 'RGBA' else 1)
+
+    def _register_tile(self, x, y, tile_width, tile_height, tile_data, level):
+        # Переводим в пиксели уровня 0 и обрезаем выступающий за растр край
+        factor = 1 << level
+        x0, y0 = x * factor, y * factor
+        width0 = min(tile_width * factor, self.image_width - x0)
+        height0 = min(tile_height * factor, self.image_height - y0)
+
+        tile = Tile(x0, y0, width0, height0, 0, level)
+        # На обзорных уровнях текстура может выступать за край растра
+        tile.data_width = tile_width
+        tile.data_height = tile_height
+        if self._level_source(level) is None:
+            tile.pixels = tile_data  # Кроме как в памяти, данных тайла больше нигде нет
+
+        while len(self.levels) <= level:
+            self.levels.append([])
+        self.levels[level].append(tile)
+        return tile
+
+    def ensure_resident(self, tile):
+        """Загружает выгруженный тайл обратно в видеопамять (нужен текущий контекст OpenGL)"""
+        self.texture_manager.touch(tile)
+        if tile.texture_id:
+            return
+        self._create_texture(tile, self.tile_pixels(tile))
+
+    def evict_tile(self, tile):
+        """Удаляет текстуру тайла; данные остаются в памяти или на диске"""
+        self.texture_manager.delete(tile)
+
+    def tile_pixels(self, tile):
+        """Данные тайла в формате его уровня (упакованные биты для '1').
+
+        Это срез массива уровня без копирования: загрузчик текстур сам учитывает шаг строк.
+        """
+        if tile.pixels is not None:
+            return tile.pixels
+        return tile_slice(self._level_source(tile.level), level_format(self.pixel_format, tile.level),
+                          tile.x >> tile.level, tile.y >> tile.level, tile.data_width, tile.data_height)
+
+    def resident_parent(self, tile):
+        """Ближайший загруженный в видеопамять тайл более грубого уровня, накрывающий tile"""
+        for level in range(tile.level + 1, len(self.levels)):
+            parent = self.tile_at(level, tile.x, tile.y)
+            if parent is not None and parent.texture_id:
+                self.texture_manager.touch(parent)
+                return parent
+        return None
+
+    def tile_at(self, level, x, y):
+        """Тайл уровня, содержащий пиксель (x, y) уровня 0, или None (ещё не загружен)"""
+        columns = -(-self.level_size(level)[0] // self.tile_size)
+        index = ((y >> level) // self.tile_size) * columns + (x >> level) // self.tile_size
+        tiles = self.levels[level]
+        return tiles[index] if index < len(tiles) else None
+
+    def level_size(self, level):
+        """Размер уровня пирамиды в его пикселях"""
+        width, height = self.image_width, self.image_height
+        for _ in range(level):
+            width, height = (width + 1) // 2, (height + 1) // 2
+        return width, height
+
+    def set_level_sources(self, level_sources):
+        """Подключает дисковые массивы уровней; копии тайлов в памяти больше не нужны"""
+        self.level_sources = list(level_sources)
+        for level, tiles in enumerate(self.levels):
+            if self._level_source(level) is not None:
+                for tile in tiles:
+                    tile.pixels = None
+
+    def visible_tiles(self, level, quad):
+        """Тайлы уровня, пересекающие выпуклый четырёхугольник quad (углы в пикселях уровня 0).
+
+        Ряды и столбцы находятся прямо по сетке тайлов, без перебора всех тайлов,
+        поэтому время зависит от размера экрана, а не от размера растра.
+        """
+        tiles = self.levels[level]
+        span = self.tile_size << level  # Сторона тайла уровня в пикселях уровня 0
+        level_width, level_height = self.level_size(level)
+        columns = -(-level_width // self.tile_size)
+        rows = -(-level_height // self.tile_size)
+
+        ys = [point[1] for point in quad]
+        first_row = max(0, int(math.floor(min(ys) / span)))
+        last_row = min(rows - 1, int(math.floor(max(ys) / span)))
+
+        visible = []
+        for row in range(first_row, last_row + 1):
+            # Повёрнутый экран в полосе ряда занимает отрезок по x
+            x_range = _band_x_range(quad, row * span, (row + 1) * span)
+            if x_range is None:
+                continue
+            first_column = max(0, int(math.floor(x_range[0] / span)))
+            last_column = min(columns - 1, int(math.floor(x_range[1] / span)))
+            if first_column > last_column:
+                continue  # Отрезок целиком левее или правее растра
+            start = row * columns
+            visible.extend(tiles[start + first_column:start + last_column + 1])
+        return visible
+
+    def _level_source(self, level):
+        return self.level_sources[level] if level < len(self.level_sources) else None
+
+    def _create_texture(self, tile, tile_data):
+        tile_data, pixel_format = texture_pixels(tile_data, level_format(self.pixel_format, tile.level),
+                                                 tile.data_width)
+        self.texture_manager.create(self, tile, tile_data, pixel_format, self.tile_size,
+                                    self.texture_bytes(tile.level))
+
+    def release(self):
+        """Удаляет текстуры всех тайлов (нужен текущий контекст OpenGL)"""
+        self.texture_manager.release(self)
+        self.levels = [[]]
+        self.tiles = self.levels[0]
+        self.level_sources = []
+
+    def tile_count(self):
+        return sum(len(level) for level in self.levels)
+
+    def level_for_scale(self, screen_scale):
+        """Самый грубый уровень, тексель которого ещё не крупнее пикселя экрана.
 
-    def split_into_tiles(self, image_data, img_width, img_height, progress_callback=None):
-        self.tiles.clear()
-        self.image_width = img_width
-        self.image_height = img_height
-        total_tiles = ((img_height + self.tile_size - 1) // self.tile_size) * \
-                      ((img_width + self.tile_size - 1) // self.tile_size)
-        current_tile = 0
-
-        for y in range(0, img_height, self.tile_size):
-            for x in range(0, img_width, self.tile_size):
-                tile_width = min(self.tile_size, img_width - x)
-                tile_height = min(self.tile_size, img_height - y)
-
-                tile_data = image_data[y:y + tile_height, x:x + tile_width]
-
-                texture_id = glGenTextures(1)
-                glBindTexture(GL_TEXTURE_2D, texture_id)
-                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-                glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-                glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, tile_width, tile_height,
-                             0, GL_RGBA, GL_UNSIGNED_BYTE, tile_data)
-
-                self.tiles.append(Tile(x, y, tile_width, tile_height, texture_id))
-
-                current_tile += 1
-                if progress_callback:
-                    percent = int((current_tile / total_tiles) * 100)
-                    progress_callback(percent)
-
-    def get_visible_tiles(self, viewport_width, viewport_height, pan, zoom, rotation_angle=0,
-                          rotation_center=QPointF(0, 0)):
-        visible_tiles = []
-
-        # Рассчитываем расширенную область видимости с учетом поворота
-        expanded_viewport = max(viewport_width, viewport_height) * 1.5
-
-        for tile in self.tiles:
-            # Центр тайла в мировых координатах
-            tile_center_x = tile.x + tile.width / 2
-            tile_center_y = tile.y + tile.height / 2
-
-            # Преобразуем координаты с учетом поворота
-            if rotation_angle != 0:
-                # Смещаем в систему координат с центром в rotation_center
-                dx = tile_center_x - rotation_center.x()
-                dy = tile_center_y - rotation_center.y()
-
-                # Поворачиваем
-                import math
-                angle_rad = math.radians(rotation_angle)
-                cos_val = math.cos(angle_rad)
-                sin_val = math.sin(angle_rad)
-                rotated_dx = dx * cos_val - dy * sin_val
-                rotated_dy = dx * sin_val + dy * cos_val
-
-                # Возвращаем в мировые координаты
-                tile_center_x = rotated_dx + rotation_center.x()
-                tile_center_y = rotated_dy + rotation_center.y()
-
-            # Проверяем, попадает ли тайл в расширенную область видимости
-            tile_screen_x = tile_center_x * zoom + pan.x() - (tile.width * zoom) / 2
-            tile_screen_y = tile_center_y * zoom + pan.y() - (tile.height * zoom) / 2
-            tile_screen_width = tile.width * zoom
-            tile_screen_height = tile.height * zoom
-
-            if (tile_screen_x + tile_screen_width > -expanded_viewport and
-                    tile_screen_y + tile_screen_height > -expanded_viewport and
-                    tile_screen_x < viewport_width + expanded_viewport and
-                    tile_screen_y < viewport_height + expanded_viewport):
-                visible_tiles.append(tile)
-
-        return visible_tiles
+        screen_scale — сколько пикселей экрана занимает один пиксель уровня 0.
+        """
+        if screen_scale >= 1.0 or len(self.levels) == 1:
+            return 0
+        level = int(math.floor(math.log2(1.0 / screen_scale))) if screen_scale > 0 else len(self.levels) - 1
+        return min(level, len(self.levels) - 1)
 
     def is_empty(self):
         return len(self.tiles) == 0
\ No newline at end of file
@@ -0,0 +1,246 @@
+# Полуавтоматическая векторизация: следование по тёмной линии записи от точки щелчка
+
+import math
+
+import numpy as np
+
+from tile_manager import gray_pixels
+
+# Почему остановилось следование в одну сторону
+STOP_GAP = "gap"  # Линия прервалась
+STOP_CROSSING = "crossing"  # Пересечение или слияние с другой линией
+STOP_EDGE = "edge"  # Край растра
+STOP_LIMIT = "limit"  # Слишком много шагов (замкнутая линия)
+STOP_UNLOADED = "unloaded"  # Тайл впереди ещё не загружен
+
+
+class _TileNotLoaded(Exception):
+    pass
+
+
+class TileGrayReader:
+    """Яркость пикселей растра полного разрешения.
+
+    Тайл читается из TileManager (с диска или из памяти) и переводится в
+    серый при первом обращении к нему, поэтому следование по линии трогает
+    только тайлы, через которые она проходит. Пока растр загружается, части
+    тайлов ещё нет: для них tile() и sample() возвращают None.
+    """
+
+    def __init__(self, tile_manager):
+        self.tile_manager = tile_manager
+        self.tile_size = tile_manager.tile_size
+        self.width = tile_manager.image_width
+        self.height = tile_manager.image_height
+        self._tiles = {}  # (столбец, ряд) тайла -> яркость
+
+    def tile(self, column, row):
+        """Яркость тайла или None, если он ещё не загружен"""
+        gray = self._tiles.get((column, row))
+        if gray is None:
+            tile_manager = self.tile_manager
+            tile = tile_manager.tile_at(0, column * self.tile_size, row * self.tile_size)
+            if tile is None:
+                return None
+            gray = gray_pixels(np.asarray(tile_manager.tile_pixels(tile)), tile_manager.pixel_format,
+                               tile.data_width)
+            self._tiles[column, row] = gray
+        return gray
+
+    def sample(self, xs, ys):
+        """Яркость пикселей с целыми координатами (xs, ys); за краем растра — белый.
+
+        Наименьшие и наибольшие координаты — в первой и последней точке
+        (отрезок сечения или окно, развёрнутое по строкам). None — какой-то
+        из нужных тайлов ещё не загружен.
+        """
+        size = self.tile_size
+        # Частый случай — всё в одном тайле
+        x0, x1 = sorted((int(xs[0]), int(xs[-1])))
+        y0, y1 = sorted((int(ys[0]), int(ys[-1])))
+        if (x0 >= 0 and y0 >= 0 and x1 < self.width and y1 < self.height
+                and x0 // size == x1 // size and y0 // size == y1 // size):
+            column, row = x0 // size, y0 // size
+            gray = self.tile(column, row)
+            return None if gray is None else gray[ys - row * size, xs - column * size]
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        values = np.full(len(xs), 255, dtype=np.uint8)
+        columns, rows = xs // size, ys // size
+        for column, row in set(zip(columns[inside].tolist(), rows[inside].tolist())):
+            gray = self.tile(column, row)
+            if gray is None:
+                return None
+            mask = inside & (columns == column) & (rows == row)
+            values[mask] = gray[ys[mask] - row * size, xs[mask] - column * size]
+        return values
+
+
+class TraceResult:
+    def __init__(self, points, stops):
+        self.points = points  # Осевая линия (N, 2) в пикселях исходника, с долями пикселя
+        self.stops = stops  # Причины остановки: (назад, вперёд)
+
+
+class TraceFollower:
+    """Следует по тёмной линии в обе стороны от точки на ней.
+
+    На каждом шаге берётся поперечное сечение впереди по текущему
+    направлению; центр тёмного участка (взвешенный по темноте, с долями
+    пикселя) — следующая точка осевой линии. Следование останавливается,
+    если в сечении нет линии (разрыв), если тёмный участок резко шире
+    исходной линии или линия разворачивается (пересечение с другой записью)
+    на краю растра и перед ещё не загруженным тайлом — дальше решает пользователь.
+    Координаты непрерывные: пиксель (i, j) занимает [i, i + 1) x [j, j + 1).
+    """
+    STEP = 2.0  # Шаг вдоль линии в пикселях
+    SEED_RADIUS = 8  # Насколько далеко от щелчка ищется линия
+    MIN_CONTRAST = 40  # Наименьшая разница яркости бумаги и линии
+    MIN_HALF_WIDTH = 6  # Полуширина поперечного сечения
+    MAX_WIDTH_FACTOR = 2.5  # Участок шире исходной линии во столько раз — пересечение
+    MAX_TURN_COS = 0.0  # Поворот за шаг больше чем на 90° — пересечение
+
+    def __init__(self, tile_manager):
+        self.reader = TileGrayReader(tile_manager)
+
+    def trace(self, x, y):
+        """Линия через точку (x, y) или None, если рядом с ней линии нет (или тайлы не загружены)"""
+        try:
+            seed = self._seed(x, y)
+        except _TileNotLoaded:
+            return None
+        if seed is None:
+            return None
+        start, direction, threshold, width = seed
+        half_width = max(self.MIN_HALF_WIDTH, math.ceil(2 * width))
+        offsets = np.arange(-half_width, half_width + 1, dtype=np.float64)
+
+        backward, back_stop = self._follow(start, (-direction[0], -direction[1]), threshold, width, offsets)
+        forward, forward_stop = self._follow(start, direction, threshold, width, offsets)
+        points = np.array(backward[::-1] + [start] + forward, dtype=np.float64)
+        return TraceResult(points, (back_stop, forward_stop))
+
+    def _seed(self, x, y):
+        """Начало следования: (точка на оси, направление, порог темноты, ширина линии) или None"""
+        radius = 2 * self.SEED_RADIUS
+        xs, ys = np.meshgrid(np.arange(math.floor(x) - radius, math.floor(x) + radius + 1),
+                             np.arange(math.floor(y) - radius, math.floor(y) + radius + 1))
+        xs, ys = xs.ravel(), ys.ravel()
+        values = self._sample(xs, ys).astype(np.float64)
+        paper = np.percentile(values, 90)
+        ink = values.min()
+        if paper - ink < self.MIN_CONTRAST:
+            return None
+        threshold = (paper + ink) / 2
+
+        # Ближайший к щелчку тёмный пиксель
+        dark = values < threshold
+        centers_x, centers_y = xs + 0.5, ys + 0.5
+        distances = np.hypot(centers_x - x, centers_y - y)
+        distances[~dark] = np.inf
+        nearest = int(np.argmin(distances))
+        if distances[nearest] > self.SEED_RADIUS:
+            return None
+        start = (float(centers_x[nearest]), float(centers_y[nearest]))
+
+        # Направление линии — главная ось тёмных пикселей вокруг (взвешенных по темноте)
+        near = dark & (np.hypot(centers_x - start[0], centers_y - start[1]) <= radius)
+        weights = threshold - values[near]
+        dx, dy = centers_x[near] - start[0], centers_y[near] - start[1]
+        total = weights.sum()
+        mean_x, mean_y = (weights * dx).sum() / total, (weights * dy).sum() / total
+        dx, dy = dx - mean_x, dy - mean_y
+        xx, yy, xy = (weights * dx * dx).sum(), (weights * dy * dy).sum(), (weights * dx * dy).sum()
+        angle = 0.5 * math.atan2(2 * xy, xx - yy)
+        direction = (math.cos(angle), math.sin(angle))
+        if direction[0] < 0:
+            direction = (-direction[0], -direction[1])  # Вперёд — слева направо, как идёт запись
+
+        # Точка на оси и ширина — по сечению через сам тёмный пиксель
+        offsets = np.arange(-radius, radius + 1, dtype=np.float64)
+        run = self._cross_section(start, direction, threshold, offsets, max_shift=radius)
+        if run is None:
+            return None
+        shift, width = run
+        if not math.isfinite(width):
+            return None  # Тёмное пятно, а не линия
+        start = (start[0] - direction[1] * shift, start[1] + direction[0] * shift)
+        return start, direction, threshold, width
+
+    def _follow(self, start, direction, threshold, width, offsets):
+        """Точки оси в одну сторону от start и причина остановки"""
+        reader = self.reader
+        max_steps = int(4 * (reader.width + reader.height) / self.STEP)
+        max_width = self.MAX_WIDTH_FACTOR * width + 1
+        max_shift = max(2.0, width)  # Дальше линия за один шаг в сторону не уходит
+        points = []
+        x, y = start
+        dir_x, dir_y = direction
+        for _ in range(max_steps):
+            ahead_x, ahead_y = x + dir_x * self.STEP, y + dir_y * self.STEP
+            if not (0 <= ahead_x < reader.width and 0 <= ahead_y < reader.height):
+                return points, STOP_EDGE
+            try:
+                run = self._cross_section((ahead_x, ahead_y), (dir_x, dir_y), threshold, offsets, max_shift)
+            except _TileNotLoaded:
+                return points, STOP_UNLOADED
+            if run is None:
+                return points, STOP_GAP
+            shift, run_width = run
+            if run_width > max_width:
+                return points, STOP_CROSSING
+            new_x, new_y = ahead_x - dir_y * shift, ahead_y + dir_x * shift
+            step_x, step_y = new_x - x, new_y - y
+            length = math.hypot(step_x, step_y)
+            step_x, step_y = step_x / length, step_y / length
+            if step_x * dir_x + step_y * dir_y < self.MAX_TURN_COS:
+                return points, STOP_CROSSING
+            # Направление сглаживается: шум осевой линии не раскачивает шаг
+            dir_x, dir_y = dir_x + step_x, dir_y + step_y
+            length = math.hypot(dir_x, dir_y)
+            dir_x, dir_y = dir_x / length, dir_y / length
+            x, y = new_x, new_y
+            points.append((x, y))
+        return points, STOP_LIMIT
+
+    def _cross_section(self, center, direction, threshold, offsets, max_shift):
+        """Тёмный участок сечения поперёк direction через center.
+
+        Возвращает (сдвиг центра участка вдоль нормали, ширина участка) или None,
+        если в пределах max_shift от center линии нет. Участок, упирающийся
+        в край сечения, имеет бесконечную ширину.
+        """
+        normal_x, normal_y = -direction[1], direction[0]
+        xs = np.floor(center[0] + normal_x * offsets).astype(np.int64)
+        ys = np.floor(center[1] + normal_y * offsets).astype(np.int64)
+        values = self._sample(xs, ys).tolist()
+        middle = len(values) // 2
+        dark = [value < threshold for value in values]
+
+        nearest = None
+        for distance in range(int(max_shift) + 1):
+            for index in (middle - distance, middle + distance):
+                if 0 <= index < len(dark) and dark[index]:
+                    nearest = index
+                    break
+            if nearest is not None:
+                break
+        if nearest is None:
+            return None
+
+        first = last = nearest
+        while first > 0 and dark[first - 1]:
+            first -= 1
+        while last < len(dark) - 1 and dark[last + 1]:
+            last += 1
+        # Сечение берётся с шагом в пиксель: номер в сечении минус середина — сдвиг вдоль нормали
+        weights = [threshold - values[index] for index in range(first, last + 1)]
+        shift = sum(weight * (index - middle) for weight, index in zip(weights, range(first, last + 1))) / sum(weights)
+        if first == 0 or last == len(dark) - 1:
+            return shift, math.inf
+        return shift, last - first + 1
+
+    def _sample(self, xs, ys):
+        values = self.reader.sample(xs, ys)
+        if values is None:
+            raise _TileNotLoaded()
+        return values